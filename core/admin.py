@@ -3,6 +3,7 @@ from .models import (
     Cajas,
     FormaPago,
     MovimientosCaja,
+    ResumenCaja,
     AuditoriaCaja,
     Cliente,
     Proveedores,
@@ -15,6 +16,7 @@ from .models import (
 admin.site.register(Cajas)
 admin.site.register(FormaPago)
 admin.site.register(MovimientosCaja)
+admin.site.register(ResumenCaja)
 admin.site.register(AuditoriaCaja)
 admin.site.register(Cliente)
 admin.site.register(Proveedores)
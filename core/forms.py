@@ -1,6 +1,6 @@
 from django import forms
 from django.core.exceptions import ValidationError
-from django.forms import modelformset_factory
+from django.forms import BaseInlineFormSet, modelformset_factory
 from django.utils import timezone
 
 
@@ -247,7 +247,27 @@ class InsumoForm(forms.ModelForm):
 
         
 
+class InsumoEnCacheField(forms.ModelChoiceField):
+    """ModelChoiceField que resuelve el insumo desde un dict precargado por el formset."""
+
+    def __init__(self, *args, insumos=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.insumos = insumos
+
+    def to_python(self, value):
+        if self.insumos is None or value in self.empty_values:
+            return super().to_python(value)
+        try:
+            return self.insumos[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(self.error_messages["invalid_choice"], code="invalid_choice")
+
+
 class DetallesCompraForm(forms.ModelForm):
+    # Declarado fuera de Meta.fields: se valida contra el dict del formset y la validación
+    # del modelo no repite el SELECT del ForeignKey por línea.
+    insumo = InsumoEnCacheField(queryset=Insumos.objects.all())
+
     precio_unitario = forms.DecimalField(
         max_digits=10, 
         decimal_places=2, 
@@ -265,12 +285,40 @@ class DetallesCompraForm(forms.ModelForm):
 
     class Meta:
         model = DetallesCompra
-        fields = ['insumo', 'cantidad', 'precio_unitario'] 
-    def __init__(self, *args, **kwargs):
+        fields = ['cantidad', 'precio_unitario']
+
+    def __init__(self, *args, insumos=None, **kwargs):
         super().__init__(*args, **kwargs)
+        if self.instance.insumo_id:
+            self.initial.setdefault('insumo', self.instance.insumo_id)
+        self.fields['insumo'].insumos = insumos
         self.fields['insumo'].widget.attrs.update({'class': 'form-select detalle-insumo'})
         self.fields['cantidad'].widget.attrs.update({'class': 'form-control detalle-cantidad', 'min': '1'})
-    
+
+    def clean_insumo(self):
+        insumo = self.cleaned_data['insumo']
+        self.instance.insumo = insumo
+        return insumo
+
+
+class BaseDetallesCompraFormSet(BaseInlineFormSet):
+    """Carga en una sola consulta todos los insumos enviados, en lugar de una por línea."""
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        if self.is_bound:
+            kwargs['insumos'] = self.insumos_enviados
+        return kwargs
+
+    @property
+    def insumos_enviados(self):
+        if not hasattr(self, '_insumos_enviados'):
+            ids = [
+                valor for clave, valor in self.data.items()
+                if clave.startswith(self.prefix + '-') and clave.endswith('-insumo') and str(valor).isdigit()
+            ]
+            self._insumos_enviados = Insumos.objects.in_bulk(ids)
+        return self._insumos_enviados
 
 
 class ComprasForm(forms.ModelForm):
@@ -298,6 +346,7 @@ DetallesCompraFormSet = inlineformset_factory(
     Compras, 
     DetallesCompra, 
     form=DetallesCompraForm, 
+    formset=BaseDetallesCompraFormSet,
     extra=1, 
     can_delete=True
 )
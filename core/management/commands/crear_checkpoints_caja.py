@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Cajas
+
+
+class Command(BaseCommand):
+    help = "Guarda un checkpoint de saldo para las cajas abiertas (o la indicada)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--caja", type=int, help="Crear el checkpoint solo para la caja indicada.")
+        parser.add_argument(
+            "--todas",
+            action="store_true",
+            help="Incluir también las cajas cerradas.",
+        )
+
+    def handle(self, *args, **options):
+        cajas = Cajas.objects.all().order_by("id_caja")
+        if options["caja"]:
+            cajas = cajas.filter(id_caja=options["caja"])
+        elif not options["todas"]:
+            cajas = cajas.filter(caja_cerrada=False)
+
+        creados = 0
+        for caja_id in cajas.values_list("id_caja", flat=True):
+            with transaction.atomic():
+                caja = Cajas.objects.select_for_update().get(id_caja=caja_id)
+                anterior = caja.ultimo_checkpoint()
+                checkpoint = caja.crear_checkpoint()
+            if checkpoint is None or checkpoint == anterior:
+                continue
+            creados += 1
+            self.stdout.write(
+                f"Caja #{caja_id}: checkpoint hasta mov. {checkpoint.ultimo_movimiento_id} "
+                f"(saldo ${checkpoint.saldo})"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"{creados} checkpoints creados."))
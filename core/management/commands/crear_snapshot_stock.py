@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.utils_stock import crear_snapshot_stock
+
+
+class Command(BaseCommand):
+    help = "Guarda el stock de todos los insumos del día (pensado para correr por cron al cierre)."
+
+    def handle(self, *args, **options):
+        snapshots = crear_snapshot_stock()
+        if not snapshots:
+            self.stdout.write("No hay insumos para guardar.")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot del {snapshots[0].fecha}: {len(snapshots)} insumos "
+            f"hasta mov. {snapshots[0].ultimo_movimiento_id}."
+        ))
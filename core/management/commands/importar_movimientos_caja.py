@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Cajas, Empleados, MovimientosCaja
+from core.utils_caja import leer_movimientos_csv, importar_movimientos
+
+
+class Command(BaseCommand):
+    help = "Importa movimientos de caja desde un extracto CSV (fecha;tipo;forma_pago;monto;descripcion;referencia)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("archivo", help="Ruta del archivo CSV.")
+        parser.add_argument("--caja", type=int, help="Caja destino (por defecto, la última caja abierta).")
+        parser.add_argument("--empleado", type=int, help="Empleado que registra (por defecto, el de la caja).")
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Solo valida el archivo y muestra el resultado, sin guardar nada.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if options["caja"]:
+                caja = Cajas.objects.get(id_caja=options["caja"])
+            else:
+                caja = Cajas.objects.filter(caja_cerrada=False).latest("id_caja")
+        except Cajas.DoesNotExist:
+            raise CommandError("No se encontró la caja destino.")
+
+        if options["empleado"]:
+            empleado = Empleados.objects.filter(id_empleado=options["empleado"]).first()
+        else:
+            empleado = caja.id_empleado
+        if empleado is None:
+            raise CommandError("Indique el empleado con --empleado.")
+
+        with open(options["archivo"], encoding="utf-8-sig", errors="replace") as f:
+            filas, errores = leer_movimientos_csv(f.read())
+
+        for error in errores:
+            self.stdout.write(self.style.WARNING(error))
+        if errores:
+            raise CommandError(f"{len(errores)} filas con errores; no se importó nada.")
+
+        ingresos = sum(f["monto"] for f in filas if f["tipo"] == MovimientosCaja.Tipo.INGRESO)
+        egresos = sum(f["monto"] for f in filas if f["tipo"] == MovimientosCaja.Tipo.EGRESO)
+        self.stdout.write(
+            f"Caja #{caja.id_caja}: {len(filas)} movimientos, ingresos ${ingresos}, egresos ${egresos}, "
+            f"saldo resultante ${caja.saldo_sistema + ingresos - egresos}"
+        )
+        if options["dry_run"]:
+            self.stdout.write(self.style.SUCCESS("Dry-run: no se guardaron cambios."))
+            return
+
+        movimientos = importar_movimientos(caja, filas, empleado)
+        self.stdout.write(self.style.SUCCESS(f"{len(movimientos)} movimientos importados."))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Presupuestos
+from core.utils_presupuestos import recalcular_costos
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula costo_real y ganancia_real persistidos de trabajos y presupuestos "
+        "(por ejemplo, después de cambiar el costo de productos tercerizados)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--presupuesto", type=int, help="Recalcular solo el presupuesto indicado.")
+        parser.add_argument("--lote", type=int, default=500, help="Presupuestos por lote (500 por defecto).")
+
+    def handle(self, *args, **options):
+        presupuestos = Presupuestos.objects.all()
+        if options["presupuesto"]:
+            presupuestos = presupuestos.filter(id_presupuesto=options["presupuesto"])
+
+        cantidad = recalcular_costos(presupuestos, tamanio=options["lote"])
+        self.stdout.write(self.style.SUCCESS(f"{cantidad} presupuestos recalculados."))
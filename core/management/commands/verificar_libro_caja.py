@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import Cajas, MovimientosCaja
+
+
+class Command(BaseCommand):
+    help = (
+        "Recorre el libro de movimientos en orden y verifica la cadena de saldo_resultante "
+        "de cada caja. Con --reparar reescribe los saldos incorrectos (bloquea las cajas)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--caja", type=int, help="Verificar solo la caja indicada.")
+        parser.add_argument("--lote", type=int, default=10000, help="Movimientos leídos por consulta.")
+        parser.add_argument(
+            "--reparar",
+            action="store_true",
+            help="Corrige saldo_resultante con actualizaciones en bloque.",
+        )
+
+    def handle(self, *args, **options):
+        if options["reparar"]:
+            with transaction.atomic():
+                self.verificar(options, bloquear=True)
+        else:
+            self.verificar(options, bloquear=False)
+
+    def verificar(self, options, bloquear):
+        cajas = Cajas.objects.all()
+        movs = MovimientosCaja.objects.all()
+        if options["caja"]:
+            cajas = cajas.filter(id_caja=options["caja"])
+            movs = movs.filter(caja_id=options["caja"])
+        if bloquear:
+            cajas = cajas.select_for_update()
+
+        # Saldo corrido por caja; un único recorrido por id sirve para todas las cajas.
+        cajas = {c.id_caja: c for c in cajas.only("id_caja", "saldo_inicial", "total_ingresos", "total_egresos")}
+        saldos = {id_caja: c.saldo_inicial for id_caja, c in cajas.items()}
+        primeras = {}
+        revisados = divergentes = 0
+        ultimo_id = 0
+
+        while True:
+            lote = list(
+                movs.filter(id__gt=ultimo_id)
+                .order_by("id")
+                .values_list("id", "caja_id", "secuencia", "tipo", "monto", "saldo_resultante")[:options["lote"]]
+            )
+            if not lote:
+                break
+
+            reparar = []
+            for id_mov, caja_id, secuencia, tipo, monto, guardado in lote:
+                if tipo == MovimientosCaja.Tipo.INGRESO:
+                    saldos[caja_id] += monto
+                else:
+                    saldos[caja_id] -= monto
+                if guardado != saldos[caja_id]:
+                    divergentes += 1
+                    primeras.setdefault(caja_id, (id_mov, secuencia, guardado, saldos[caja_id]))
+                    reparar.append(MovimientosCaja(id=id_mov, saldo_resultante=saldos[caja_id]))
+
+            if reparar and options["reparar"]:
+                MovimientosCaja.objects.bulk_update(reparar, ["saldo_resultante"], batch_size=1000)
+            revisados += len(lote)
+            ultimo_id = lote[-1][0]
+
+        for caja_id, (id_mov, secuencia, guardado, esperado) in sorted(primeras.items()):
+            self.stdout.write(self.style.WARNING(
+                f"Caja #{caja_id}: primera diferencia en movimiento #{id_mov} (secuencia {secuencia}): "
+                f"guardado ${guardado}, esperado ${esperado}"
+            ))
+        for caja_id, caja in sorted(cajas.items()):
+            if saldos[caja_id] != caja.saldo_sistema:
+                self.stdout.write(self.style.WARNING(
+                    f"Caja #{caja_id}: saldo según libro ${saldos[caja_id]}, según totales ${caja.saldo_sistema} "
+                    "(ver verificar_saldos_caja)"
+                ))
+
+        if not divergentes:
+            self.stdout.write(self.style.SUCCESS(f"{revisados} movimientos verificados, sin diferencias."))
+            return
+        if not options["reparar"]:
+            raise CommandError(
+                f"{divergentes} movimientos con saldo_resultante incorrecto en {len(primeras)} cajas. "
+                "Use --reparar para corregirlos."
+            )
+        self.stdout.write(self.style.SUCCESS(f"{divergentes} movimientos reparados en {len(primeras)} cajas."))
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from core.models import Cajas, MovimientosCaja
+
+
+class Command(BaseCommand):
+    help = "Verifica que los totales persistidos de cada caja coincidan con el libro de movimientos."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--caja", type=int, help="Verificar solo la caja indicada.")
+        parser.add_argument(
+            "--reparar",
+            action="store_true",
+            help="Reescribe los totales de las cajas con diferencias.",
+        )
+
+    def handle(self, *args, **options):
+        cajas = Cajas.objects.all().order_by("id_caja")
+        movs = MovimientosCaja.objects.all()
+        if options["caja"]:
+            cajas = cajas.filter(id_caja=options["caja"])
+            movs = movs.filter(caja_id=options["caja"])
+
+        libro = self.totales_del_libro(movs)
+
+        diferencias = []
+        for caja in cajas:
+            ingresos, egresos = libro.get(caja.id_caja, (0, 0))
+            if caja.total_ingresos != ingresos or caja.total_egresos != egresos:
+                diferencias.append((caja, ingresos, egresos))
+                self.stdout.write(self.style.WARNING(
+                    f"Caja #{caja.id_caja}: persistido ingresos={caja.total_ingresos} "
+                    f"egresos={caja.total_egresos} / libro ingresos={ingresos} egresos={egresos}"
+                ))
+
+        if not diferencias:
+            self.stdout.write(self.style.SUCCESS(f"{cajas.count()} cajas verificadas, sin diferencias."))
+            return
+
+        if not options["reparar"]:
+            raise CommandError(f"{len(diferencias)} cajas con diferencias. Use --reparar para corregirlas.")
+
+        # Se bloquean las cajas y se vuelve a sumar el libro bajo el bloqueo: un movimiento
+        # contabilizado entre la verificación y la reparación no se pierde.
+        with transaction.atomic():
+            ids = [c.id_caja for c, _, _ in diferencias]
+            bloqueadas = list(Cajas.objects.select_for_update().filter(id_caja__in=ids).order_by("id_caja"))
+            libro = self.totales_del_libro(MovimientosCaja.objects.filter(caja_id__in=ids))
+            for caja in bloqueadas:
+                caja.total_ingresos, caja.total_egresos = libro.get(caja.id_caja, (0, 0))
+            Cajas.objects.bulk_update(bloqueadas, ["total_ingresos", "total_egresos"])
+        self.stdout.write(self.style.SUCCESS(f"{len(bloqueadas)} cajas reparadas."))
+
+    def totales_del_libro(self, movs):
+        """{caja_id: (ingresos, egresos)} sumando el libro, en una consulta."""
+        libro = {}
+        for fila in movs.values("caja_id", "tipo").annotate(m=Sum("monto")).order_by():
+            ing, egr = libro.get(fila["caja_id"], (0, 0))
+            if fila["tipo"] == MovimientosCaja.Tipo.INGRESO:
+                ing += fila["m"] or 0
+            else:
+                egr += fila["m"] or 0
+            libro[fila["caja_id"]] = (ing, egr)
+        return libro
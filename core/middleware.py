@@ -0,0 +1,12 @@
+from .utils_caja import auditoria_en_lote
+
+
+class AuditoriaMiddleware:
+    """Agrupa la auditoría de cada request en un solo INSERT al terminar."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with auditoria_en_lote():
+            return self.get_response(request)
@@ -0,0 +1,48 @@
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def poblar_totales(apps, schema_editor):
+    Cajas = apps.get_model("core", "Cajas")
+    MovimientosCaja = apps.get_model("core", "MovimientosCaja")
+
+    totales = {}
+    filas = (
+        MovimientosCaja.objects
+        .values("caja_id", "tipo")
+        .annotate(m=Sum("monto"))
+        .order_by()
+    )
+    for fila in filas:
+        ing, egr = totales.get(fila["caja_id"], (0, 0))
+        if fila["tipo"] == "INGRESO":
+            ing += fila["m"] or 0
+        else:
+            egr += fila["m"] or 0
+        totales[fila["caja_id"]] = (ing, egr)
+
+    cajas = list(Cajas.objects.filter(pk__in=totales.keys()))
+    for caja in cajas:
+        caja.total_ingresos, caja.total_egresos = totales[caja.pk]
+    Cajas.objects.bulk_update(cajas, ["total_ingresos", "total_egresos"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0046_movimientoscaja_revertido'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cajas',
+            name='total_egresos',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='cajas',
+            name='total_ingresos',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(poblar_totales, migrations.RunPython.noop),
+    ]
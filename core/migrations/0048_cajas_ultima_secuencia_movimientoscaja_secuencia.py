@@ -0,0 +1,53 @@
+from django.db import migrations, models
+
+
+def numerar_movimientos(apps, schema_editor):
+    Cajas = apps.get_model("core", "Cajas")
+    MovimientosCaja = apps.get_model("core", "MovimientosCaja")
+
+    ultimas = {}
+    lote = []
+    filas = (
+        MovimientosCaja.objects
+        .order_by("caja_id", "id")
+        .values_list("id", "caja_id")
+        .iterator(chunk_size=2000)
+    )
+    for mov_id, caja_id in filas:
+        ultimas[caja_id] = ultimas.get(caja_id, 0) + 1
+        lote.append(MovimientosCaja(id=mov_id, secuencia=ultimas[caja_id]))
+        if len(lote) >= 1000:
+            MovimientosCaja.objects.bulk_update(lote, ["secuencia"])
+            lote = []
+    if lote:
+        MovimientosCaja.objects.bulk_update(lote, ["secuencia"])
+
+    cajas = list(Cajas.objects.filter(pk__in=ultimas.keys()))
+    for caja in cajas:
+        caja.ultima_secuencia = ultimas[caja.pk]
+    Cajas.objects.bulk_update(cajas, ["ultima_secuencia"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0047_cajas_total_ingresos_cajas_total_egresos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cajas',
+            name='ultima_secuencia',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movimientoscaja',
+            name='secuencia',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(numerar_movimientos, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='movimientoscaja',
+            constraint=models.UniqueConstraint(fields=('caja', 'secuencia'), name='uniq_movimiento_caja_secuencia'),
+        ),
+    ]
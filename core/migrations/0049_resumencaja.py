@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def poblar_resumen(apps, schema_editor):
+    MovimientosCaja = apps.get_model("core", "MovimientosCaja")
+    ResumenCaja = apps.get_model("core", "ResumenCaja")
+
+    filas = (
+        MovimientosCaja.objects
+        .values("caja_id", "forma_pago_id", "tipo", "origen")
+        .annotate(total=Sum("monto"), cantidad=Count("id"))
+        .order_by()
+    )
+    ResumenCaja.objects.bulk_create([ResumenCaja(**f) for f in filas], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0048_cajas_ultima_secuencia_movimientoscaja_secuencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenCaja',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('tipo', models.CharField(choices=[('INGRESO', 'Ingreso'), ('EGRESO', 'Egreso')], max_length=10)),
+                ('origen', models.CharField(choices=[('MANUAL', 'Manual'), ('COMPRA', 'Por compra'), ('VENTA', 'Por venta')], max_length=10)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('cantidad', models.PositiveIntegerField(default=0)),
+                ('caja', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes', to='core.cajas')),
+                ('forma_pago', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='core.formapago')),
+            ],
+            options={
+                'verbose_name': 'Resumen de Caja',
+                'verbose_name_plural': 'Resúmenes de Caja',
+                'db_table': 'resumen_caja',
+                'constraints': [models.UniqueConstraint(fields=('caja', 'forma_pago', 'tipo', 'origen'), name='uniq_resumen_caja')],
+            },
+        ),
+        migrations.RunPython(poblar_resumen, migrations.RunPython.noop),
+    ]
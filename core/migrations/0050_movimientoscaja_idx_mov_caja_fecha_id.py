@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0049_resumencaja'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimientoscaja',
+            index=models.Index(fields=['fecha_hora', 'id'], name='idx_mov_caja_fecha_id'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0050_movimientoscaja_idx_mov_caja_fecha_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='auditoriacaja',
+            name='accion',
+            field=models.CharField(choices=[('ABRIR', 'Abrir caja'), ('CERRAR', 'Cerrar caja'), ('MOV_ALTA', 'Alta movimiento'), ('MOV_REV', 'Reversión movimiento'), ('STOCK', 'Movimiento de stock'), ('ERROR', 'Error de operación')], max_length=10),
+        ),
+    ]
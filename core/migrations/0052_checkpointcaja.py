@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0051_alter_auditoriacaja_accion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckpointCaja',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('ultimo_movimiento_id', models.IntegerField()),
+                ('ultima_secuencia', models.PositiveIntegerField(default=0)),
+                ('total_ingresos', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_egresos', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('saldo', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('fecha_hora', models.DateTimeField(auto_now_add=True)),
+                ('caja', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='core.cajas')),
+            ],
+            options={
+                'db_table': 'checkpoint_caja',
+            },
+        ),
+        migrations.CreateModel(
+            name='CheckpointCajaDetalle',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('tipo', models.CharField(choices=[('INGRESO', 'Ingreso'), ('EGRESO', 'Egreso')], max_length=10)),
+                ('origen', models.CharField(choices=[('MANUAL', 'Manual'), ('COMPRA', 'Por compra'), ('VENTA', 'Por venta')], max_length=10)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('cantidad', models.PositiveIntegerField(default=0)),
+                ('checkpoint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='detalles', to='core.checkpointcaja')),
+                ('forma_pago', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='core.formapago')),
+            ],
+            options={
+                'db_table': 'checkpoint_caja_detalle',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='checkpointcaja',
+            constraint=models.UniqueConstraint(fields=('caja', 'ultimo_movimiento_id'), name='uniq_checkpoint_caja_mov'),
+        ),
+    ]
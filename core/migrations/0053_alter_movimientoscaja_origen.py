@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0052_checkpointcaja'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='checkpointcajadetalle',
+            name='origen',
+            field=models.CharField(choices=[('MANUAL', 'Manual'), ('COMPRA', 'Por compra'), ('VENTA', 'Por venta'), ('IMPORTADO', 'Importado')], max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='movimientoscaja',
+            name='origen',
+            field=models.CharField(choices=[('MANUAL', 'Manual'), ('COMPRA', 'Por compra'), ('VENTA', 'Por venta'), ('IMPORTADO', 'Importado')], default='MANUAL', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='resumencaja',
+            name='origen',
+            field=models.CharField(choices=[('MANUAL', 'Manual'), ('COMPRA', 'Por compra'), ('VENTA', 'Por venta'), ('IMPORTADO', 'Importado')], max_length=10),
+        ),
+    ]
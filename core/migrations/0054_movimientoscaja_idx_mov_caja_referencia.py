@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0053_alter_movimientoscaja_origen'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimientoscaja',
+            index=models.Index(fields=['referencia_id', 'tipo', 'origen', 'revertido'], name='idx_mov_caja_referencia'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0054_movimientoscaja_idx_mov_caja_referencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaStock',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('cantidad', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('fecha_hora', models.DateTimeField(auto_now_add=True)),
+                ('insumo', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reservas', to='core.insumos')),
+                ('presupuesto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='core.presupuestos')),
+            ],
+            options={
+                'verbose_name_plural': 'Reservas de Stock',
+                'db_table': 'reservas_stock',
+                'indexes': [models.Index(fields=['insumo', 'cantidad'], name='idx_reserva_insumo_cantidad')],
+                'constraints': [models.UniqueConstraint(fields=('presupuesto', 'insumo'), name='uniq_reserva_presupuesto_insumo')],
+            },
+        ),
+    ]
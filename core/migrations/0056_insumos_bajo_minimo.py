@@ -0,0 +1,25 @@
+from django.db import migrations, models
+from django.db.models import F
+
+
+def poblar_bajo_minimo(apps, schema_editor):
+    Insumos = apps.get_model("core", "Insumos")
+    Insumos.objects.filter(
+        stock_minimo__isnull=False, stock_actual__lte=F("stock_minimo")
+    ).update(bajo_minimo=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0055_reservastock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='insumos',
+            name='bajo_minimo',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.RunPython(poblar_bajo_minimo, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0056_insumos_bajo_minimo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('fecha', models.DateField()),
+                ('fecha_hora', models.DateTimeField()),
+                ('ultimo_movimiento_id', models.IntegerField(default=0)),
+                ('cantidad', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('insumo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='core.insumos')),
+            ],
+            options={
+                'verbose_name_plural': 'Snapshots de Stock',
+                'db_table': 'stock_snapshot',
+                'indexes': [models.Index(fields=['fecha_hora'], name='idx_snapshot_fecha_hora')],
+                'constraints': [models.UniqueConstraint(fields=('insumo', 'fecha'), name='uniq_snapshot_insumo_fecha')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+from django.db.models import F
+
+
+def poblar_costo_promedio(apps, schema_editor):
+    Insumos = apps.get_model("core", "Insumos")
+    Insumos.objects.filter(precio_costo_unitario__isnull=False).update(
+        costo_promedio=F("precio_costo_unitario")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0057_stocksnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='insumos',
+            name='costo_promedio',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='stockmovimientos',
+            name='costo_unitario',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True),
+        ),
+        migrations.RunPython(poblar_costo_promedio, migrations.RunPython.noop),
+    ]
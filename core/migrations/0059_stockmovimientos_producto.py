@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0058_costo_promedio'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockmovimientos',
+            name='producto',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='movimientos_stock', to='core.productos'),
+        ),
+        migrations.AlterField(
+            model_name='stockmovimientos',
+            name='insumo',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='core.insumos'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockmovimientos',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('insumo__isnull', False), ('producto__isnull', True)), models.Q(('insumo__isnull', True), ('producto__isnull', False)), _connector='OR'), name='chk_stockmov_insumo_o_producto'),
+        ),
+    ]
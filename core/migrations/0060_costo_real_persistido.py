@@ -0,0 +1,59 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def poblar_costos(apps, schema_editor):
+    Presupuestos = apps.get_model("core", "Presupuestos")
+    Productos = apps.get_model("core", "Productos")
+    Trabajo = apps.get_model("core", "Trabajo")
+
+    costos_producto = dict(
+        Productos.objects.filter(tipo__nombre_tipo__iexact="tercerizado")
+        .order_by("-id_producto")
+        .values_list("nombre", "costo_inicial")
+    )
+    costos = {}
+    trabajos = list(Trabajo.objects.all())
+    for t in trabajos:
+        t.costo_real = (t.subtotal_insumos or 0) + (costos_producto.get(t.nombre_trabajo) or 0) * (t.cantidad or 0)
+        t.ganancia_real = (t.total_trabajo or 0) - t.costo_real
+        costos[t.presupuesto_id] = costos.get(t.presupuesto_id, Decimal("0")) + t.costo_real
+    Trabajo.objects.bulk_update(trabajos, ["costo_real", "ganancia_real"], batch_size=500)
+
+    presupuestos = list(Presupuestos.objects.filter(pk__in=costos.keys()))
+    for p in presupuestos:
+        p.costo_real = costos[p.pk]
+        p.ganancia_real = (p.total_presupuesto or 0) - p.costo_real
+    Presupuestos.objects.bulk_update(presupuestos, ["costo_real", "ganancia_real"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0059_stockmovimientos_producto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='presupuestos',
+            name='costo_real',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='presupuestos',
+            name='ganancia_real',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='trabajo',
+            name='costo_real',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='trabajo',
+            name='ganancia_real',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(poblar_costos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+LOTE = 1000
+
+
+def vincular_productos(apps, schema_editor):
+    """Asocia cada trabajo al producto de igual nombre (el de menor ID si hay repetidos), por lotes."""
+    Productos = apps.get_model("core", "Productos")
+    Trabajo = apps.get_model("core", "Trabajo")
+
+    por_nombre = {}
+    for id_producto, nombre in Productos.objects.order_by("-id_producto").values_list("id_producto", "nombre"):
+        por_nombre[nombre] = id_producto
+
+    ultimo = 0
+    while True:
+        lote = list(
+            Trabajo.objects.filter(id__gt=ultimo, producto__isnull=True)
+            .order_by("id")
+            .only("id", "nombre_trabajo")[:LOTE]
+        )
+        if not lote:
+            return
+        ultimo = lote[-1].id
+        vinculados = []
+        for trabajo in lote:
+            trabajo.producto_id = por_nombre.get(trabajo.nombre_trabajo)
+            if trabajo.producto_id:
+                vinculados.append(trabajo)
+        Trabajo.objects.bulk_update(vinculados, ["producto"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0060_costo_real_persistido'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajo',
+            name='producto',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trabajos', to='core.productos'),
+        ),
+        migrations.RunPython(vincular_productos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0061_trabajo_producto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedidos',
+            name='presupuesto',
+            field=models.OneToOneField(blank=True, db_column='id_presupuesto', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pedido', to='core.presupuestos'),
+        ),
+    ]
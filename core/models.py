@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import User
@@ -21,6 +23,9 @@ class Cajas(models.Model):
     fecha_hora_cierre = models.DateTimeField(blank=True, null=True)
     saldo_inicial = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     saldo_final = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_ingresos = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_egresos = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    ultima_secuencia = models.PositiveIntegerField(default=0)
     monto_fisico = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     diferencia = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     tolerancia = models.DecimalField(max_digits=12, decimal_places=2, default=0)
@@ -36,10 +41,105 @@ class Cajas(models.Model):
 
     @property
     def saldo_sistema(self):
-        movs = self.movimientos.all().values("tipo").annotate(m=models.Sum("monto"))
-        ingresos = sum(x["m"] for x in movs if x["tipo"] == MovimientosCaja.Tipo.INGRESO) or 0
-        egresos = sum(x["m"] for x in movs if x["tipo"] == MovimientosCaja.Tipo.EGRESO) or 0
-        return (self.saldo_inicial + ingresos - egresos)
+        """Saldo actual a partir de los totales persistidos (sin recorrer movimientos)."""
+        return self.saldo_inicial + self.total_ingresos - self.total_egresos
+
+    def ultimo_checkpoint(self):
+        return self.checkpoints.order_by("-ultimo_movimiento_id").first()
+
+    def filas_segun_movimientos(self, hasta_id=None):
+        """
+        Totales por (forma_pago_id, tipo, origen) según el libro. Parte del último
+        checkpoint y solo agrega los movimientos posteriores a él.
+        """
+        filas = {}
+        movs = self.movimientos.all()
+        checkpoint = self.ultimo_checkpoint()
+        if checkpoint:
+            for d in checkpoint.detalles.all():
+                filas[(d.forma_pago_id, d.tipo, d.origen)] = {"total": d.total, "cantidad": d.cantidad}
+            movs = movs.filter(id__gt=checkpoint.ultimo_movimiento_id)
+        if hasta_id is not None:
+            movs = movs.filter(id__lte=hasta_id)
+
+        delta = (
+            movs.values("forma_pago_id", "tipo", "origen")
+            .annotate(total=models.Sum("monto"), cantidad=models.Count("id"))
+            .order_by()
+        )
+        for f in delta:
+            fila = filas.setdefault((f["forma_pago_id"], f["tipo"], f["origen"]), {"total": 0, "cantidad": 0})
+            fila["total"] += f["total"]
+            fila["cantidad"] += f["cantidad"]
+        return filas
+
+    @staticmethod
+    def _totales_de_filas(filas):
+        ingresos = sum(f["total"] for (_, tipo, _), f in filas.items() if tipo == MovimientosCaja.Tipo.INGRESO)
+        egresos = sum(f["total"] for (_, tipo, _), f in filas.items() if tipo == MovimientosCaja.Tipo.EGRESO)
+        return ingresos or 0, egresos or 0
+
+    def totales_segun_movimientos(self):
+        """Recalcula (ingresos, egresos) desde el último checkpoint más los movimientos nuevos."""
+        return self._totales_de_filas(self.filas_segun_movimientos())
+
+    def recalcular_totales(self):
+        """Reconstruye totales y tabla resumen desde el libro (p. ej. tras una reversión)."""
+        filas = self.filas_segun_movimientos()
+        self.total_ingresos, self.total_egresos = self._totales_de_filas(filas)
+        self.save(update_fields=["total_ingresos", "total_egresos"])
+
+        self.resumenes.all().delete()
+        ResumenCaja.objects.bulk_create([
+            ResumenCaja(caja=self, forma_pago_id=fp, tipo=tipo, origen=origen, **f)
+            for (fp, tipo, origen), f in filas.items()
+        ])
+
+    def crear_checkpoint(self):
+        """Guarda saldo y totales por forma de pago hasta el último movimiento actual."""
+        ultimo = self.movimientos.order_by("-id").values_list("id", "secuencia").first()
+        if ultimo is None:
+            return None
+        checkpoint = self.ultimo_checkpoint()
+        if checkpoint and checkpoint.ultimo_movimiento_id >= ultimo[0]:
+            return checkpoint
+
+        filas = self.filas_segun_movimientos(hasta_id=ultimo[0])
+        ingresos, egresos = self._totales_de_filas(filas)
+        checkpoint = CheckpointCaja.objects.create(
+            caja=self,
+            ultimo_movimiento_id=ultimo[0],
+            ultima_secuencia=ultimo[1] or 0,
+            total_ingresos=ingresos,
+            total_egresos=egresos,
+            saldo=self.saldo_inicial + ingresos - egresos,
+        )
+        CheckpointCajaDetalle.objects.bulk_create([
+            CheckpointCajaDetalle(checkpoint=checkpoint, forma_pago_id=fp, tipo=tipo, origen=origen, **f)
+            for (fp, tipo, origen), f in filas.items()
+        ])
+        return checkpoint
+
+    def resumen_por_forma_pago(self):
+        """Ingresos, egresos y neto por forma de pago, leídos de ResumenCaja."""
+        filas = {}
+        for r in self.resumenes.select_related("forma_pago").order_by("forma_pago__nombre"):
+            fila = filas.setdefault(r.forma_pago_id, {
+                "forma_pago": r.forma_pago, "ingresos": 0, "egresos": 0, "cantidad": 0,
+            })
+            fila["ingresos" if r.tipo == MovimientosCaja.Tipo.INGRESO else "egresos"] += r.total
+            fila["cantidad"] += r.cantidad
+        for fila in filas.values():
+            fila["neto"] = fila["ingresos"] - fila["egresos"]
+        return list(filas.values())
+
+    def resumen_por_origen(self):
+        """Ingresos y egresos por origen (manual, compra, venta), leídos de ResumenCaja."""
+        filas = {o: {"origen": etiqueta, "ingresos": 0, "egresos": 0}
+                 for o, etiqueta in MovimientosCaja.Origen.choices}
+        for r in self.resumenes.all():
+            filas[r.origen]["ingresos" if r.tipo == MovimientosCaja.Tipo.INGRESO else "egresos"] += r.total
+        return list(filas.values())
 
 
 
@@ -66,6 +166,7 @@ class MovimientosCaja(models.Model):
         MANUAL = "MANUAL", "Manual"
         COMPRA = "COMPRA", "Por compra"
         VENTA = "VENTA", "Por venta"
+        IMPORTADO = "IMPORTADO", "Importado"
 
     id = models.AutoField(primary_key=True)
     caja = models.ForeignKey("Cajas", on_delete=models.PROTECT, related_name="movimientos")
@@ -79,20 +180,83 @@ class MovimientosCaja(models.Model):
     creado_por = models.ForeignKey("Empleados", on_delete=models.PROTECT)
     saldo_resultante = models.DecimalField(max_digits=12, decimal_places=2)
     revertido = models.BooleanField(default=False)
+    secuencia = models.PositiveIntegerField(blank=True, null=True)
 
     class Meta:
         db_table = "movimientos_caja"
         verbose_name_plural = "Movimientos de Caja"
+        constraints = [
+            models.UniqueConstraint(fields=["caja", "secuencia"], name="uniq_movimiento_caja_secuencia"),
+        ]
+        indexes = [
+            models.Index(fields=["fecha_hora", "id"], name="idx_mov_caja_fecha_id"),
+            models.Index(fields=["referencia_id", "tipo", "origen", "revertido"], name="idx_mov_caja_referencia"),
+        ]
 
     def __str__(self):
         return f"[{self.tipo}] ${self.monto} - {self.forma_pago} - {self.fecha_hora:%Y-%m-%d %H:%M}"
 
 
+class ResumenCaja(models.Model):
+    """Totales acumulados por (caja, forma de pago, tipo, origen), mantenidos al contabilizar."""
+    id = models.AutoField(primary_key=True)
+    caja = models.ForeignKey("Cajas", on_delete=models.CASCADE, related_name="resumenes")
+    forma_pago = models.ForeignKey("FormaPago", on_delete=models.PROTECT)
+    tipo = models.CharField(max_length=10, choices=MovimientosCaja.Tipo.choices)
+    origen = models.CharField(max_length=10, choices=MovimientosCaja.Origen.choices)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cantidad = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "resumen_caja"
+        verbose_name = "Resumen de Caja"
+        verbose_name_plural = "Resúmenes de Caja"
+        constraints = [
+            models.UniqueConstraint(fields=["caja", "forma_pago", "tipo", "origen"], name="uniq_resumen_caja"),
+        ]
+
+
+class CheckpointCaja(models.Model):
+    """Foto del saldo de una caja hasta un movimiento; los cálculos solo suman lo posterior."""
+    id = models.AutoField(primary_key=True)
+    caja = models.ForeignKey("Cajas", on_delete=models.CASCADE, related_name="checkpoints")
+    ultimo_movimiento_id = models.IntegerField()
+    ultima_secuencia = models.PositiveIntegerField(default=0)
+    total_ingresos = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_egresos = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    saldo = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    fecha_hora = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "checkpoint_caja"
+        constraints = [
+            models.UniqueConstraint(fields=["caja", "ultimo_movimiento_id"], name="uniq_checkpoint_caja_mov"),
+        ]
+
+    def __str__(self):
+        return f"Checkpoint Caja #{self.caja_id} hasta mov. {self.ultimo_movimiento_id}: ${self.saldo}"
+
+
+class CheckpointCajaDetalle(models.Model):
+    id = models.AutoField(primary_key=True)
+    checkpoint = models.ForeignKey("CheckpointCaja", on_delete=models.CASCADE, related_name="detalles")
+    forma_pago = models.ForeignKey("FormaPago", on_delete=models.PROTECT)
+    tipo = models.CharField(max_length=10, choices=MovimientosCaja.Tipo.choices)
+    origen = models.CharField(max_length=10, choices=MovimientosCaja.Origen.choices)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cantidad = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "checkpoint_caja_detalle"
+
+
 class AuditoriaCaja(models.Model):
     class Accion(models.TextChoices):
         ABRIR = "ABRIR", "Abrir caja"
         CERRAR = "CERRAR", "Cerrar caja"
         MOV_ALTA = "MOV_ALTA", "Alta movimiento"
+        MOV_REV = "MOV_REV", "Reversión movimiento"
+        STOCK = "STOCK", "Movimiento de stock"
         ERROR = "ERROR", "Error de operación"
 
     id = models.AutoField(primary_key=True)
@@ -171,6 +335,10 @@ class Insumos(models.Model):
     precio_costo_unitario = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     proveedor = models.ForeignKey("Proveedores", on_delete=models.PROTECT, null=True, blank=False)
     is_active = models.BooleanField(default=True)
+    # stock_actual <= stock_minimo, persistido para filtrar críticos por índice.
+    bajo_minimo = models.BooleanField(default=False, db_index=True)
+    # Promedio ponderado móvil de las compras; lo mantiene contabilizar_stock.
+    costo_promedio = models.DecimalField(max_digits=12, decimal_places=4, default=0)
 
     class Meta:
         db_table = "insumos"
@@ -179,6 +347,21 @@ class Insumos(models.Model):
     def __str__(self):
         return f"{self.nombre} ({self.unidad_medida or ''})"
 
+    @staticmethod
+    def esta_bajo_minimo(stock_actual, stock_minimo):
+        if stock_minimo in (None, ""):
+            return False
+        return Decimal(str(stock_actual or 0)) <= Decimal(str(stock_minimo))
+
+    def save(self, *args, **kwargs):
+        self.bajo_minimo = self.esta_bajo_minimo(self.stock_actual, self.stock_minimo)
+        if self.pk is None and not self.costo_promedio:
+            self.costo_promedio = self.precio_costo_unitario or 0
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"stock_actual", "stock_minimo"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"bajo_minimo"}
+        super().save(*args, **kwargs)
+
 
 class Empleados(models.Model):
     id_empleado = models.AutoField(primary_key=True)
@@ -230,6 +413,10 @@ class Pedidos(models.Model):
     fecha_entrega_real = models.DateField(blank=True, null=True)
     total_pedido = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     stock_descontado = models.BooleanField(default=False)
+    # Presupuesto del que se generó; único, así un presupuesto no se convierte dos veces.
+    presupuesto = models.OneToOneField(
+        "Presupuestos", models.SET_NULL, db_column="id_presupuesto", null=True, blank=True, related_name="pedido"
+    )
 
     class Meta:
         db_table = "pedidos"
@@ -325,6 +512,9 @@ class Presupuestos(models.Model):
     estado_presupuesto = models.CharField(max_length=20, choices=ESTADOS, default="EN ESPERA")
     trabajo = models.CharField(max_length=200, blank=True, null=True)
     descripcion = models.TextField(blank=True, null=True)
+    # Persistidos al escribir (utils_presupuestos); permiten ordenar y filtrar por rentabilidad.
+    costo_real = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    ganancia_real = models.DecimalField(max_digits=12, decimal_places=2, default=0, db_index=True)
 
 
     class Meta:
@@ -413,18 +603,82 @@ class StockMovimientos(models.Model):
     )
 
     id_movimiento = models.AutoField(primary_key=True)
-    insumo = models.ForeignKey(Insumos, on_delete=models.PROTECT)
+    # Cada movimiento es de un insumo o de un producto tercerizado.
+    insumo = models.ForeignKey(Insumos, on_delete=models.PROTECT, null=True, blank=True)
+    producto = models.ForeignKey(
+        "Productos", on_delete=models.PROTECT, null=True, blank=True, related_name="movimientos_stock"
+    )
     tipo = models.CharField(max_length=10, choices=MOVIMIENTO_TIPOS)
     cantidad = models.DecimalField(max_digits=10, decimal_places=2)
     detalle = models.CharField(max_length=200, null=True, blank=True)
+    # Precio de compra en las entradas valorizadas; costo promedio vigente en el resto.
+    costo_unitario = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
     fecha_hora = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         db_table = "stock_movimientos"
         verbose_name_plural = "Movimientos de Stock"
+        constraints = [
+            models.CheckConstraint(
+                condition=(
+                    models.Q(insumo__isnull=False, producto__isnull=True)
+                    | models.Q(insumo__isnull=True, producto__isnull=False)
+                ),
+                name="chk_stockmov_insumo_o_producto",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.fecha_hora} - {self.articulo.nombre} ({self.tipo})"
+
+    @property
+    def articulo(self):
+        return self.insumo or self.producto
+
+
+class StockSnapshot(models.Model):
+    """Stock de un insumo al cierre de un día; las consultas históricas solo suman lo posterior."""
+    id = models.AutoField(primary_key=True)
+    insumo = models.ForeignKey(Insumos, on_delete=models.CASCADE, related_name="snapshots")
+    fecha = models.DateField()
+    fecha_hora = models.DateTimeField()
+    ultimo_movimiento_id = models.IntegerField(default=0)
+    cantidad = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        db_table = "stock_snapshot"
+        verbose_name_plural = "Snapshots de Stock"
+        constraints = [
+            models.UniqueConstraint(fields=["insumo", "fecha"], name="uniq_snapshot_insumo_fecha"),
+        ]
+        indexes = [
+            models.Index(fields=["fecha_hora"], name="idx_snapshot_fecha_hora"),
+        ]
 
     def __str__(self):
-        return f"{self.fecha_hora} - {self.insumo.nombre} ({self.tipo})"
+        return f"{self.insumo_id} al {self.fecha}: {self.cantidad}"
+
+
+class ReservaStock(models.Model):
+    """Stock de un insumo comprometido por un presupuesto confirmado (en unidades de stock)."""
+    id = models.AutoField(primary_key=True)
+    insumo = models.ForeignKey(Insumos, on_delete=models.PROTECT, related_name="reservas")
+    presupuesto = models.ForeignKey("Presupuestos", on_delete=models.CASCADE, related_name="reservas")
+    cantidad = models.DecimalField(max_digits=10, decimal_places=2)
+    fecha_hora = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "reservas_stock"
+        verbose_name_plural = "Reservas de Stock"
+        constraints = [
+            models.UniqueConstraint(fields=["presupuesto", "insumo"], name="uniq_reserva_presupuesto_insumo"),
+        ]
+        indexes = [
+            models.Index(fields=["insumo", "cantidad"], name="idx_reserva_insumo_cantidad"),
+        ]
+
+    def __str__(self):
+        return f"{self.insumo.nombre}: {self.cantidad} (Presupuesto #{self.presupuesto_id})"
 
 
 class ConfiguracionEmpresa(models.Model):
@@ -481,6 +735,10 @@ class Trabajo(models.Model):
     id = models.AutoField(primary_key=True)
     presupuesto = models.ForeignKey(Presupuestos, on_delete=models.CASCADE, related_name="trabajos", db_column="id_presupuesto")
     nombre_trabajo = models.CharField(max_length=120)
+    # Producto del catálogo del que sale el trabajo; nulo en trabajos a medida.
+    producto = models.ForeignKey(
+        "Productos", on_delete=models.SET_NULL, null=True, blank=True, related_name="trabajos"
+    )
     descripcion = models.TextField(blank=True, null=True)
     cantidad = models.PositiveIntegerField(default=1)
     costo_diseno = models.DecimalField(max_digits=10, decimal_places=2, default=0)
@@ -488,6 +746,8 @@ class Trabajo(models.Model):
     subtotal_insumos = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     precio_unitario = models.DecimalField(max_digits=12, decimal_places=2, default=0)  
     total_trabajo = models.DecimalField(max_digits=12, decimal_places=2, default=0)   
+    costo_real = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    ganancia_real = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
     creado = models.DateTimeField(auto_now_add=True)
 
@@ -1,8 +1,12 @@
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.hashers import make_password
-from .models import Empleados
+from .models import CheckpointCaja, Empleados, Insumos, MovimientosCaja, ProductosInsumos
+from .utils_recetas import invalidar_recetas
+from .utils_stock import insumos_bajo_minimo
 
 @receiver(post_save, sender=Empleados)
 def crear_usuario_empleado(sender, instance, created, **kwargs):
@@ -31,3 +35,63 @@ def crear_usuario_empleado(sender, instance, created, **kwargs):
 
         instance.user = user
         instance.save()
+
+
+@receiver(post_save, sender=MovimientosCaja)
+def actualizar_totales_caja(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Las altas actualizan los totales dentro de contabilizar_movimiento; si se
+    modifica un movimiento existente se descartan los checkpoints que lo
+    incluyen y se recalcula desde el libro. Marcar un movimiento como
+    revertido no cambia montos (la reversión es un movimiento nuevo).
+    """
+    if created or (update_fields and set(update_fields) <= {"revertido"}):
+        return
+    invalidar_checkpoints(instance)
+    instance.caja.recalcular_totales()
+
+
+@receiver(post_delete, sender=MovimientosCaja)
+def recalcular_totales_caja(sender, instance, **kwargs):
+    invalidar_checkpoints(instance)
+    instance.caja.recalcular_totales()
+
+
+def invalidar_checkpoints(movimiento):
+    CheckpointCaja.objects.filter(
+        caja_id=movimiento.caja_id, ultimo_movimiento_id__gte=movimiento.id
+    ).delete()
+
+
+@receiver(post_save, sender=ProductosInsumos)
+@receiver(post_delete, sender=ProductosInsumos)
+def invalidar_receta_producto(sender, instance, **kwargs):
+    invalidar_recetas([instance.producto_id])
+
+
+@receiver(post_save, sender=Insumos)
+def invalidar_recetas_por_factor(sender, instance, created, update_fields=None, **kwargs):
+    """Si puede haber cambiado factor_conversion, las recetas que usan el insumo quedan viejas."""
+    if created or (update_fields and "factor_conversion" not in update_fields):
+        return
+    invalidar_recetas(
+        ProductosInsumos.objects.filter(insumo=instance).values_list("producto_id", flat=True).distinct()
+    )
+
+
+@receiver(insumos_bajo_minimo)
+def avisar_stock_minimo(sender, insumos, **kwargs):
+    """Aviso opcional por mail; se activa definiendo AVISOS_STOCK_EMAILS en settings."""
+    destinatarios = getattr(settings, "AVISOS_STOCK_EMAILS", None)
+    if not destinatarios:
+        return
+    lineas = "\n".join(f"- {i.nombre}: {i.stock_actual} (mínimo {i.stock_minimo})" for i in insumos)
+    try:
+        send_mail(
+            "Tinta Negra - Insumos bajo stock mínimo",
+            f"Los siguientes insumos quedaron bajo su stock mínimo:\n\n{lineas}\n",
+            settings.DEFAULT_FROM_EMAIL,
+            destinatarios,
+        )
+    except Exception as e:
+        print("ERROR email:", e)
@@ -1,3 +1,1090 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+from functools import partial
+from io import StringIO
+from tempfile import NamedTemporaryFile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import (
+    AuditoriaCaja, Cajas, Cliente, DetallesCompra, Empleados, EstadosPedidos, FormaPago, Insumos,
+    MovimientosCaja, Pedidos, PedidosInsumos, Presupuestos, Productos, ProductosInsumos, Proveedores,
+    StockMovimientos, StockSnapshot, TiposProducto, Trabajo, TrabajoInsumo, UnidadMedida,
+)
+from core.utils_caja import (
+    auditoria_en_lote, contabilizar_movimiento, importar_movimientos, leer_movimientos_csv, revertir_ventas,
+)
+from core.utils_presupuestos import recalcular_costos, repreciar_presupuestos
+from core.utils_recetas import explotar, receta_de
+from core.utils_stock import (
+    aplicar_conteo, consumo_valorizado, contabilizar_stock, crear_snapshot_stock, disponibles, faltantes_de,
+    insumos_bajo_minimo, insumos_criticos, leer_conteo_csv, liberar_reservas, reservar_presupuesto, stock_a_fecha,
+    valuacion_inventario,
+)
+from tinta_negra_web.views import iterar_en_lotes
+
+
+def crear_caja_basica(saldo_inicial="0"):
+    empleado = Empleados.objects.create(nombre="Cajero", rol="Empleado")
+    forma_pago = FormaPago.objects.create(nombre="Efectivo")
+    caja = Cajas.objects.create(saldo_inicial=Decimal(saldo_inicial))
+    return caja, empleado, forma_pago
+
+
+class DatosBaseTestCase(TestCase):
+    """Superusuario logueado con su empleado, un cliente y un contador de consultas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser("jefe", "jefe@example.com", "clave")
+        cls.empleado = Empleados.objects.create(nombre="Jefe", rol="Jefe", user=cls.usuario)
+        cls.cliente = Cliente.objects.create(nombre="Ana", apellido="Paz", telefono="1", email="a@a.com", dni="1")
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def contando(self, funcion, *args, **kwargs):
+        """Ejecuta funcion y devuelve (resultado, cantidad de consultas)."""
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = funcion(*args, **kwargs)
+        return resultado, len(consultas)
+
+
+class ContabilizarMovimientoTests(TestCase):
+
+    def setUp(self):
+        self.caja, self.empleado, self.forma_pago = crear_caja_basica("100")
+
+    def test_asigna_secuencia_saldo_y_auditoria(self):
+        with auditoria_en_lote(), self.captureOnCommitCallbacks(execute=True):
+            ingreso = contabilizar_movimiento(
+                self.caja, MovimientosCaja.Tipo.INGRESO, self.forma_pago, Decimal("50"), self.empleado
+            )
+            egreso = contabilizar_movimiento(
+                self.caja, MovimientosCaja.Tipo.EGRESO, self.forma_pago, Decimal("30"), self.empleado
+            )
+
+        self.assertEqual((ingreso.secuencia, egreso.secuencia), (1, 2))
+        self.assertEqual(ingreso.saldo_resultante, Decimal("150"))
+        self.assertEqual(egreso.saldo_resultante, Decimal("120"))
+
+        self.caja.refresh_from_db()
+        self.assertEqual(self.caja.saldo_sistema, Decimal("120"))
+        self.assertEqual(self.caja.ultima_secuencia, 2)
+        self.assertEqual(AuditoriaCaja.objects.filter(caja=self.caja).count(), 2)
+
+    def test_egreso_sin_saldo_suficiente(self):
+        with self.assertRaises(ValueError):
+            contabilizar_movimiento(
+                self.caja, MovimientosCaja.Tipo.EGRESO, self.forma_pago, Decimal("500"),
+                self.empleado, validar_saldo=True,
+            )
+        self.assertFalse(MovimientosCaja.objects.exists())
+
+
+@skipUnlessDBFeature("has_select_for_update")
+class ContabilizarMovimientoConcurrenteTests(TransactionTestCase):
+    HILOS = 8
+    MOVIMIENTOS_POR_HILO = 25
+
+    def test_sin_actualizaciones_perdidas(self):
+        caja, empleado, forma_pago = crear_caja_basica()
+        errores = []
+
+        def cajero():
+            try:
+                for _ in range(self.MOVIMIENTOS_POR_HILO):
+                    contabilizar_movimiento(
+                        caja, MovimientosCaja.Tipo.INGRESO, forma_pago, Decimal("1.00"), empleado
+                    )
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=cajero) for _ in range(self.HILOS)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+
+        self.assertEqual(errores, [])
+        total = self.HILOS * self.MOVIMIENTOS_POR_HILO
+        caja.refresh_from_db()
+        self.assertEqual(caja.saldo_sistema, Decimal(total))
+        self.assertEqual(caja.ultima_secuencia, total)
+
+        movs = list(MovimientosCaja.objects.filter(caja=caja).order_by("secuencia"))
+        self.assertEqual([m.secuencia for m in movs], list(range(1, total + 1)))
+        self.assertEqual([m.saldo_resultante for m in movs], [Decimal(i) for i in range(1, total + 1)])
+
+
+class ResumenCajaTests(TestCase):
+
+    def test_resumen_por_forma_pago_y_reconstruccion(self):
+        caja, empleado, efectivo = crear_caja_basica("0")
+        tarjeta = FormaPago.objects.create(nombre="Tarjeta")
+        contabilizar_movimiento(caja, MovimientosCaja.Tipo.INGRESO, efectivo, Decimal("100"), empleado)
+        contabilizar_movimiento(caja, MovimientosCaja.Tipo.INGRESO, efectivo, Decimal("40"), empleado)
+        contabilizar_movimiento(
+            caja, MovimientosCaja.Tipo.EGRESO, tarjeta, Decimal("25"), empleado,
+            origen=MovimientosCaja.Origen.COMPRA,
+        )
+
+        esperado = {
+            "Efectivo": (Decimal("140"), 0, 2),
+            "Tarjeta": (0, Decimal("25"), 1),
+        }
+        obtenido = {
+            f["forma_pago"].nombre: (f["ingresos"], f["egresos"], f["cantidad"])
+            for f in caja.resumen_por_forma_pago()
+        }
+        self.assertEqual(obtenido, esperado)
+
+        caja.resumenes.all().delete()
+        caja.recalcular_totales()
+        obtenido = {
+            f["forma_pago"].nombre: (f["ingresos"], f["egresos"], f["cantidad"])
+            for f in caja.resumen_por_forma_pago()
+        }
+        self.assertEqual(obtenido, esperado)
+
+
+class CheckpointCajaTests(TestCase):
+
+    def setUp(self):
+        self.caja, self.empleado, self.forma_pago = crear_caja_basica("10")
+
+    def contabilizar(self, tipo, monto):
+        return contabilizar_movimiento(self.caja, tipo, self.forma_pago, Decimal(monto), self.empleado)
+
+    def test_checkpoint_automatico_y_delta(self):
+        with mock.patch("core.utils_caja.MOVIMIENTOS_POR_CHECKPOINT", 2):
+            self.contabilizar(MovimientosCaja.Tipo.INGRESO, "100")
+            self.contabilizar(MovimientosCaja.Tipo.EGRESO, "30")
+            self.contabilizar(MovimientosCaja.Tipo.INGRESO, "5")
+
+        checkpoint = self.caja.ultimo_checkpoint()
+        self.assertEqual(checkpoint.ultima_secuencia, 2)
+        self.assertEqual(checkpoint.saldo, Decimal("80"))
+
+        with self.assertNumQueries(3):
+            self.assertEqual(self.caja.totales_segun_movimientos(), (Decimal("105"), Decimal("30")))
+
+    def test_modificar_movimiento_invalida_checkpoint(self):
+        mov = self.contabilizar(MovimientosCaja.Tipo.INGRESO, "100")
+        self.caja.crear_checkpoint()
+
+        mov.monto = Decimal("60")
+        mov.save()
+
+        self.caja.refresh_from_db()
+        self.assertIsNone(self.caja.ultimo_checkpoint())
+        self.assertEqual(self.caja.saldo_sistema, Decimal("70"))
+
+
+class ImportarMovimientosTests(DatosBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.caja, self.empleado, self.forma_pago = crear_caja_basica("100")
+
+    def test_valida_en_lote(self):
+        filas, errores = leer_movimientos_csv(
+            "fecha;tipo;forma_pago;monto;descripcion;referencia\n"
+            "2025-01-10;INGRESO;efectivo;1.500,50;Transferencia;\n"
+            ";PAGO;Cheque;-3;;abc\n"
+        )
+        self.assertEqual(len(filas), 1)
+        self.assertEqual(filas[0]["monto"], Decimal("1500.50"))
+        self.assertEqual(errores, [
+            "Fila 3: tipo inválido, forma de pago desconocida, monto inválido, referencia no numérica."
+        ])
+
+    def test_importa_con_saldo_resultante_en_una_pasada(self):
+        texto = "tipo;forma_pago;monto\n" + "INGRESO;Efectivo;10\nEGRESO;Efectivo;4\n" * 50
+        filas, errores = leer_movimientos_csv(texto)
+        self.assertEqual(errores, [])
+
+        _, consultas = self.contando(importar_movimientos, self.caja, filas, self.empleado)
+        self.assertLess(consultas, 15)
+
+        self.caja.refresh_from_db()
+        self.assertEqual(self.caja.saldo_sistema, Decimal("400"))
+        self.assertEqual(self.caja.ultima_secuencia, 100)
+        ultimo = self.caja.movimientos.get(secuencia=100)
+        self.assertEqual(ultimo.saldo_resultante, Decimal("400"))
+        self.assertEqual(ultimo.origen, MovimientosCaja.Origen.IMPORTADO)
+
+
+    def test_importa_en_la_caja_del_empleado_o_la_ultima_abierta(self):
+        jefe = Empleados.objects.get(user=self.usuario)
+        propia = Cajas.objects.create(saldo_inicial=Decimal("0"), id_empleado=jefe)
+        otro = Empleados.objects.create(nombre="Otro", rol="Empleado")
+        ajena = Cajas.objects.create(saldo_inicial=Decimal("0"), id_empleado=otro)
+        texto = "tipo;forma_pago;monto\nINGRESO;Efectivo;10\n"
+
+        url = reverse("movimientos_importar")
+        self.client.post(url, {"archivo": SimpleUploadedFile("extracto.csv", texto.encode())})
+        self.client.post(url, {"confirmar": "1"})
+        self.assertEqual((propia.movimientos.count(), ajena.movimientos.count()), (1, 0))
+
+        archivo = NamedTemporaryFile("w", suffix=".csv", delete=False)
+        self.addCleanup(os.remove, archivo.name)
+        with archivo:
+            archivo.write(texto)
+        call_command("importar_movimientos_caja", archivo.name, empleado=jefe.pk, stdout=StringIO())
+        self.assertEqual((propia.movimientos.count(), ajena.movimientos.count()), (1, 1))
+
+class RevertirVentasTests(DatosBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.caja, self.empleado, self.forma_pago = crear_caja_basica("0")
+        self.insumo = Insumos.objects.create(nombre="Papel", stock_actual=Decimal("50"))
+
+    def crear_pedidos_entregados(self, cantidad):
+        pedidos = []
+        for _ in range(cantidad):
+            pedido = Pedidos.objects.create(id_cliente=self.cliente, total_pedido=Decimal("20"), stock_descontado=True)
+            PedidosInsumos.objects.create(
+                pedido=pedido, insumo=self.insumo, cantidad=Decimal("2"), precio_unitario=Decimal("1"),
+            )
+            contabilizar_movimiento(
+                self.caja, MovimientosCaja.Tipo.INGRESO, self.forma_pago, Decimal("20"), self.empleado,
+                origen=MovimientosCaja.Origen.VENTA, referencia_id=pedido.id_pedido,
+            )
+            pedidos.append(pedido)
+        return pedidos
+
+    def revertir_contando(self, pedidos):
+        return self.contando(revertir_ventas, pedidos, self.caja, self.empleado)[1]
+
+    def test_consultas_fijas_y_saldos(self):
+        # La primera reversión crea el renglón de ResumenCaja; las siguientes solo lo actualizan.
+        self.revertir_contando(self.crear_pedidos_entregados(1))
+        uno = self.revertir_contando(self.crear_pedidos_entregados(1))
+        varios = self.revertir_contando(self.crear_pedidos_entregados(5))
+        self.assertEqual(uno, varios)
+
+        self.caja.refresh_from_db()
+        self.assertEqual(self.caja.saldo_sistema, 0)
+        self.assertFalse(MovimientosCaja.objects.filter(tipo=MovimientosCaja.Tipo.INGRESO, revertido=False).exists())
+        self.insumo.refresh_from_db()
+        self.assertEqual(self.insumo.stock_actual, Decimal("64"))
+        self.assertFalse(Pedidos.objects.filter(stock_descontado=True).exists())
+
+    def test_vista_exige_permiso_y_pedidos_entregados(self):
+        entregado = EstadosPedidos.objects.create(nombre_estado="ENTREGADO")
+        EstadosPedidos.objects.create(nombre_estado="CANCELADO")
+        pedidos = self.crear_pedidos_entregados(3)
+        Pedidos.objects.filter(id_pedido__in=[p.id_pedido for p in pedidos[:2]]).update(id_estado=entregado)
+        url = reverse("pedidos_revertir_entregas")
+
+        sin_permiso = User.objects.create_user("cajero", password="clave")
+        self.client.force_login(sin_permiso)
+        self.assertEqual(self.client.post(url, {"pedidos": [pedidos[0].id_pedido]}).status_code, 403)
+
+        self.client.force_login(self.usuario)
+        respuesta = self.client.post(url, {"pedidos": [p.id_pedido for p in pedidos]})
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn(f"#{pedidos[2].id_pedido}", respuesta.json()["error"])
+        self.assertFalse(MovimientosCaja.objects.filter(revertido=True).exists())
+
+        respuesta = self.client.post(url, {"pedidos": [p.id_pedido for p in pedidos[:2]]})
+        self.assertEqual(respuesta.json()["revertidos"], 2)
+
+
+class VerificarSaldosCajaTests(TestCase):
+
+    def test_detecta_y_repara_totales(self):
+        caja, empleado, forma_pago = crear_caja_basica("10")
+        otra = Cajas.objects.create(saldo_inicial=Decimal("0"))
+        contabilizar_movimiento(caja, MovimientosCaja.Tipo.INGRESO, forma_pago, Decimal("50"), empleado)
+        contabilizar_movimiento(caja, MovimientosCaja.Tipo.EGRESO, forma_pago, Decimal("20"), empleado)
+        caja.refresh_from_db()
+        with self.assertNumQueries(0):
+            self.assertEqual(caja.saldo_sistema, Decimal("40"))
+
+        Cajas.objects.filter(pk=caja.pk).update(total_ingresos=Decimal("999"), total_egresos=Decimal("0"))
+        salida = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("verificar_saldos_caja", stdout=salida)
+        self.assertIn(f"Caja #{caja.id_caja}: persistido ingresos=999", salida.getvalue())
+        self.assertNotIn(f"Caja #{otra.id_caja}", salida.getvalue())
+
+        salida = StringIO()
+        call_command("verificar_saldos_caja", reparar=True, stdout=salida)
+        self.assertIn("1 cajas reparadas.", salida.getvalue())
+        caja.refresh_from_db()
+        self.assertEqual(
+            (caja.total_ingresos, caja.total_egresos, caja.saldo_sistema),
+            (Decimal("50"), Decimal("20"), Decimal("40")),
+        )
+
+        salida = StringIO()
+        call_command("verificar_saldos_caja", stdout=salida)
+        self.assertIn("2 cajas verificadas, sin diferencias.", salida.getvalue())
+
+
+class VerificarLibroCajaTests(TestCase):
+
+    def test_detecta_y_repara_cadena(self):
+        caja, empleado, forma_pago = crear_caja_basica("10")
+        otra = Cajas.objects.create(saldo_inicial=Decimal("0"))
+        movs = [
+            contabilizar_movimiento(caja, MovimientosCaja.Tipo.INGRESO, forma_pago, Decimal("5"), empleado)
+            for _ in range(4)
+        ]
+        contabilizar_movimiento(otra, MovimientosCaja.Tipo.INGRESO, forma_pago, Decimal("7"), empleado)
+        MovimientosCaja.objects.filter(id=movs[1].id).update(saldo_resultante=Decimal("99"))
+        MovimientosCaja.objects.filter(id=movs[3].id).update(saldo_resultante=Decimal("1"))
+
+        salida = StringIO()
+        with self.assertRaises(CommandError) as error:
+            call_command("verificar_libro_caja", lote=2, stdout=salida)
+        self.assertIn("2 movimientos con saldo_resultante incorrecto en 1 cajas", str(error.exception))
+        # Solo se informa la primera diferencia de la caja afectada, y nada de la otra caja.
+        self.assertIn(f"movimiento #{movs[1].id} (secuencia 2): guardado $99.00, esperado $20.00", salida.getvalue())
+        self.assertNotIn(f"movimiento #{movs[3].id}", salida.getvalue())
+        self.assertNotIn(f"Caja #{otra.id_caja}", salida.getvalue())
+        self.assertEqual(
+            list(caja.movimientos.order_by("id").values_list("saldo_resultante", flat=True)),
+            [Decimal("15"), Decimal("99"), Decimal("25"), Decimal("1")],
+        )
+
+        salida = StringIO()
+        call_command("verificar_libro_caja", lote=2, reparar=True, stdout=salida)
+        self.assertIn("2 movimientos reparados en 1 cajas", salida.getvalue())
+        self.assertEqual(
+            list(caja.movimientos.order_by("id").values_list("saldo_resultante", flat=True)),
+            [Decimal("15"), Decimal("20"), Decimal("25"), Decimal("30")],
+        )
+
+        salida = StringIO()
+        call_command("verificar_libro_caja", lote=2, stdout=salida)
+        self.assertIn("5 movimientos verificados, sin diferencias.", salida.getvalue())
+
+
+class MovimientosListTests(DatosBaseTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        caja, empleado, forma_pago = crear_caja_basica()
+        ids = [
+            contabilizar_movimiento(caja, MovimientosCaja.Tipo.INGRESO, forma_pago, Decimal("1"), empleado).id
+            for _ in range(45)
+        ]
+        # 30 movimientos empatados en fecha_hora para que el corte de página caiga dentro del empate.
+        empate = timezone.make_aware(datetime(2026, 5, 1, 10, 0))
+        MovimientosCaja.objects.filter(id__in=ids[:30]).update(fecha_hora=empate)
+        MovimientosCaja.objects.filter(id__in=ids[30:]).update(fecha_hora=empate - timedelta(hours=1))
+        cls.esperados = list(MovimientosCaja.objects.order_by("-fecha_hora", "-id").values_list("id", flat=True))
+
+    def pagina(self, qs=""):
+        respuesta = self.client.get(f"{reverse('movimientos_list')}?{qs}")
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.context
+
+    def test_cursor_recorre_todo_sin_saltos_ni_repetidos(self):
+        vistos, paginas, contexto = [], [], self.pagina()
+        self.assertIsNone(contexto["anterior_qs"])
+        while True:
+            paginas.append([m.id for m in contexto["movs"]])
+            vistos += paginas[-1]
+            if not contexto["siguiente_qs"]:
+                break
+            contexto = self.pagina(contexto["siguiente_qs"])
+        self.assertEqual(vistos, self.esperados)
+        self.assertEqual([len(p) for p in paginas], [20, 20, 5])
+
+        # Volviendo desde la última página se obtiene exactamente la anterior.
+        self.assertIsNotNone(contexto["anterior_qs"])
+        self.assertEqual([m.id for m in self.pagina(contexto["anterior_qs"])["movs"]], paginas[1])
+
+    def test_cursor_invalido_vuelve_a_la_primera_pagina(self):
+        primera = [m.id for m in self.pagina()["movs"]]
+        for cursor in ("despues=basura", "despues=2026-13-01T00:00:00|5", "antes=2026-05-01T10:00:00|x", "despues="):
+            with self.subTest(cursor=cursor):
+                contexto = self.pagina(cursor)
+                self.assertEqual([m.id for m in contexto["movs"]], primera)
+                self.assertIsNone(contexto["anterior_qs"])
+
+    def exportar(self, nombre_url):
+        """Consume el StreamingHttpResponse y devuelve (filas del CSV, consultas hechas mientras se generó)."""
+        respuesta = self.client.get(reverse(nombre_url))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.streaming)
+        contenido, consultas = self.contando(b"".join, respuesta.streaming_content)
+        return list(csv.reader(contenido.decode("utf-8-sig").splitlines(), delimiter=";")), consultas
+
+    def test_exportar_caja_en_streaming_con_consultas_por_lote(self):
+        with mock.patch("tinta_negra_web.views.iterar_en_lotes", partial(iterar_en_lotes, tamanio=10)):
+            filas, consultas = self.exportar("movimientos_caja_exportar")
+        self.assertEqual(filas[0][:3], ["ID", "Caja", "Secuencia"])
+        self.assertEqual(len(filas) - 1, 45)
+        self.assertEqual(sorted(int(f[0]) for f in filas[1:]), sorted(self.esperados))
+        # Una consulta por lote de 10 (5 lotes) más la que encuentra el lote vacío: sin N+1.
+        self.assertEqual(consultas, 6)
+
+    def test_exportar_stock_en_streaming(self):
+        papel = Insumos.objects.create(nombre="Papel", stock_actual=Decimal("0"))
+        for _ in range(3):
+            contabilizar_stock([(papel, "entrada", Decimal("2"), "Compra")], "Compra")
+        with mock.patch("tinta_negra_web.views.iterar_en_lotes", partial(iterar_en_lotes, tamanio=2)):
+            filas, consultas = self.exportar("movimientos_stock_exportar")
+        self.assertEqual(
+            filas[0], ["ID", "Fecha/Hora", "ID insumo", "ID producto", "Artículo", "Tipo", "Cantidad", "Detalle"]
+        )
+        self.assertEqual([f[4] for f in filas[1:]], ["Papel"] * 3)
+        self.assertEqual(consultas, 3)
+
+
+@skipUnlessDBFeature("has_select_for_update")
+class ContabilizarStockConcurrenteTests(TransactionTestCase):
+    HILOS = 8
+    SALIDAS_POR_HILO = 25
+
+    def test_sin_descuentos_perdidos(self):
+        papel = Insumos.objects.create(nombre="Papel", stock_actual=Decimal("1000"))
+        tinta = Insumos.objects.create(nombre="Tinta", stock_actual=Decimal("1000"))
+        errores = []
+
+        def pedido():
+            try:
+                for _ in range(self.SALIDAS_POR_HILO):
+                    contabilizar_stock(
+                        [(papel, "salida", Decimal("2"), "Prueba"), (tinta, "salida", Decimal("1"), "Prueba")],
+                        "Prueba",
+                    )
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=pedido) for _ in range(self.HILOS)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+
+        self.assertEqual(errores, [])
+        salidas = self.HILOS * self.SALIDAS_POR_HILO
+        papel.refresh_from_db()
+        tinta.refresh_from_db()
+        self.assertEqual(papel.stock_actual, Decimal(1000 - 2 * salidas))
+        self.assertEqual(tinta.stock_actual, Decimal(1000 - salidas))
+        self.assertEqual(StockMovimientos.objects.count(), 2 * salidas)
+
+
+class ContabilizarStockTests(TestCase):
+
+    def test_una_actualizacion_por_operacion(self):
+        papel = Insumos.objects.create(nombre="Papel", stock_actual=Decimal("10"))
+        tinta = Insumos.objects.create(nombre="Tinta", stock_actual=Decimal("10"))
+        lineas = [
+            (papel, "entrada", Decimal("5"), "Compra"),
+            (papel, "salida", Decimal("1"), "Pedido"),
+            (tinta, "salida", Decimal("3"), "Pedido"),
+        ]
+        with CaptureQueriesContext(connection) as consultas:
+            contabilizar_stock(lineas, "Prueba")
+        self.assertEqual(len([q for q in consultas if q["sql"].startswith("UPDATE")]), 1)
+
+        papel.refresh_from_db()
+        tinta.refresh_from_db()
+        self.assertEqual((papel.stock_actual, tinta.stock_actual), (Decimal("14"), Decimal("7")))
+
+    def test_productos_en_el_mismo_libro(self):
+        papel = Insumos.objects.create(nombre="Papel", stock_actual=Decimal("10"))
+        taza = Productos.objects.create(
+            nombre="Taza", stock_actual=Decimal("8"), costo_diseno=0, margen_ganancia=0,
+        )
+        with CaptureQueriesContext(connection) as consultas:
+            contabilizar_stock(
+                [(papel, "salida", Decimal("1"), "Pedido")], "Prueba",
+                productos=[(taza, "salida", Decimal("3"), "Pedido"), (taza, "entrada", Decimal("1"), "Devolución")],
+            )
+        self.assertEqual(len([q for q in consultas if q["sql"].startswith("UPDATE")]), 2)
+        self.assertEqual(len([q for q in consultas if q["sql"].startswith("INSERT INTO \"stock_movimientos")]), 1)
+
+        taza.refresh_from_db()
+        self.assertEqual(taza.stock_actual, Decimal("6"))
+        self.assertEqual(
+            sorted(taza.movimientos_stock.values_list("tipo", "cantidad")),
+            [("entrada", Decimal("1")), ("salida", Decimal("3"))],
+        )
+
+    def test_bajo_minimo_y_aviso(self):
+        papel = Insumos.objects.create(nombre="Papel", stock_actual=Decimal("10"), stock_minimo=5)
+        self.assertFalse(papel.bajo_minimo)
+        self.assertEqual(insumos_criticos(), [])
+
+        avisados = []
+        insumos_bajo_minimo.connect(lambda sender, insumos, **kw: avisados.extend(insumos), weak=False, dispatch_uid="prueba")
+        self.addCleanup(insumos_bajo_minimo.disconnect, dispatch_uid="prueba")
+        with self.captureOnCommitCallbacks(execute=True):
+            contabilizar_stock([(papel, "salida", Decimal("6"), "Pedido")], "Prueba")
+        self.assertEqual([i.nombre for i in avisados], ["Papel"])
+        self.assertEqual([i.nombre for i in insumos_criticos()], ["Papel"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            contabilizar_stock([(papel, "entrada", Decimal("2"), "Compra")], "Prueba")
+        papel.refresh_from_db()
+        self.assertFalse(papel.bajo_minimo)
+        with self.assertNumQueries(1):
+            self.assertEqual(insumos_criticos(), [])
+
+
+class CostoPromedioTests(TestCase):
+
+    def test_promedio_ponderado_y_valuacion(self):
+        papel = Insumos.objects.create(nombre="Papel", stock_actual=Decimal("10"), precio_costo_unitario=Decimal("100"))
+        self.assertEqual(papel.costo_promedio, Decimal("100"))
+
+        contabilizar_stock([
+            (papel, "entrada", Decimal("5"), "Compra", Decimal("130")),
+            (papel, "entrada", Decimal("5"), "Compra", Decimal("150")),
+        ], "Compra")
+        papel.refresh_from_db()
+        self.assertEqual(papel.costo_promedio, Decimal("120"))
+
+        contabilizar_stock([(papel, "salida", Decimal("8"), "Pedido")], "Pedido")
+        papel.refresh_from_db()
+        self.assertEqual(papel.costo_promedio, Decimal("120"))
+        salida = StockMovimientos.objects.get(tipo="salida")
+        self.assertEqual(salida.costo_unitario, Decimal("120"))
+
+        with self.assertNumQueries(1):
+            insumos, total = valuacion_inventario()
+        self.assertEqual(total, Decimal("1440"))
+        consumo = consumo_valorizado(StockMovimientos.objects.all()).get()
+        self.assertEqual(consumo["costo_total"], Decimal("960"))
+
+
+class ComprasCreateTests(DatosBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.forma_pago = FormaPago.objects.create(nombre="Efectivo")
+        self.proveedor = Proveedores.objects.create(nombre="Papelera", razon_social="Papelera SA", cuit="20")
+        self.insumos = [
+            Insumos.objects.create(nombre=f"Insumo {i}", stock_actual=Decimal("1")) for i in range(20)
+        ]
+        Cajas.objects.create(saldo_inicial=Decimal("100000"), id_empleado=self.empleado)
+
+    def datos_compra(self, lineas):
+        datos = {
+            "proveedor": self.proveedor.id_proveedor,
+            "forma_pago": self.forma_pago.id_forma,
+            "detallescompra_set-TOTAL_FORMS": lineas,
+            "detallescompra_set-INITIAL_FORMS": 0,
+        }
+        for i in range(lineas):
+            datos[f"detallescompra_set-{i}-insumo"] = self.insumos[i].id_insumo
+            datos[f"detallescompra_set-{i}-cantidad"] = 3
+            datos[f"detallescompra_set-{i}-precio_unitario"] = "10.00"
+        return datos
+
+    def registrar_contando(self, lineas):
+        respuesta, consultas = self.contando(self.client.post, reverse("compras_create"), self.datos_compra(lineas))
+        self.assertRedirects(respuesta, reverse("compras_list"), fetch_redirect_response=False)
+        return consultas
+
+    def test_consultas_constantes_por_cantidad_de_lineas(self):
+        self.registrar_contando(1)
+        self.assertEqual(self.registrar_contando(2), self.registrar_contando(20))
+
+        self.assertEqual(DetallesCompra.objects.count(), 23)
+        self.assertEqual(StockMovimientos.objects.count(), 23)
+        self.insumos[0].refresh_from_db()
+        self.assertEqual(self.insumos[0].stock_actual, Decimal("10"))
+        caja = Cajas.objects.get()
+        self.assertEqual(caja.saldo_sistema, Decimal("100000") - 23 * 30)
+
+
+class ConvertirPresupuestoTests(DatosBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        EstadosPedidos.objects.create(nombre_estado="EN PRODUCCIÓN")
+        self.papel = Insumos.objects.create(nombre="Papel", stock_actual=Decimal("100"), factor_conversion=2)
+
+    def crear_presupuesto(self, trabajos=0):
+        presupuesto = Presupuestos.objects.create(id_cliente=self.cliente, total_presupuesto=Decimal("500"))
+        for i in range(trabajos):
+            trabajo = Trabajo.objects.create(presupuesto=presupuesto, nombre_trabajo=f"Trabajo {i}")
+            TrabajoInsumo.objects.create(
+                trabajo=trabajo, insumo=self.papel, cantidad=Decimal("4"),
+                precio_unitario=Decimal("10"), subtotal=Decimal("40"),
+            )
+        return presupuesto
+
+    def convertir(self, presupuesto):
+        return self.client.post(reverse("convertir_presupuesto_a_pedido", args=[presupuesto.id_presupuesto]))
+
+    def test_agrega_por_insumo_con_consultas_constantes(self):
+        _, pocas = self.contando(self.convertir, self.crear_presupuesto(2))
+        _, muchas = self.contando(self.convertir, self.crear_presupuesto(10))
+        self.assertEqual(muchas, pocas)
+
+        ultimo = Pedidos.objects.latest("id_pedido")
+        linea = PedidosInsumos.objects.get(pedido=ultimo)
+        self.assertEqual((linea.cantidad, linea.precio_unitario), (Decimal("40"), Decimal("10")))
+        self.papel.refresh_from_db()
+        self.assertEqual(self.papel.stock_actual, Decimal("100") - Decimal("4") - Decimal("20"))
+
+    def test_confirmar_y_convertir_descuenta_una_sola_vez(self):
+        tercerizado = TiposProducto.objects.create(nombre_tipo="Tercerizado")
+        taza = Productos.objects.create(
+            nombre="Taza", tipo=tercerizado, stock_actual=Decimal("10"), costo_diseno=0, margen_ganancia=0,
+        )
+        presupuesto = self.crear_presupuesto()
+        Trabajo.objects.create(presupuesto=presupuesto, nombre_trabajo="Taza", producto=taza, cantidad=3)
+
+        self.client.post(reverse("presupuesto_confirmar", args=[presupuesto.id_presupuesto]))
+        taza.refresh_from_db()
+        self.assertEqual(taza.stock_actual, Decimal("10"))
+
+        url = reverse("convertir_presupuesto_a_pedido", args=[presupuesto.id_presupuesto])
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.convertir(presupuesto)
+        self.convertir(presupuesto)
+        taza.refresh_from_db()
+        self.assertEqual(taza.stock_actual, Decimal("7"))
+        self.assertEqual(Pedidos.objects.get().presupuesto, presupuesto)
+
+    def test_confirmar_pedido_descuenta_una_vez_con_factor(self):
+        EstadosPedidos.objects.create(id_estado=2, nombre_estado="CONFIRMADO")
+        self.convertir(self.crear_presupuesto(1))
+        convertido = Pedidos.objects.get()
+        manual = Pedidos.objects.create(id_cliente=self.cliente)
+        PedidosInsumos.objects.create(pedido=manual, insumo=self.papel, cantidad=Decimal("6"), precio_unitario=1)
+
+        for pedido in (convertido, manual, manual):
+            self.client.get(reverse("pedido_confirmar", args=[pedido.id_pedido]))
+
+        # 4 hojas / factor 2 al convertir y 6 / 2 al confirmar el manual, una sola vez cada uno.
+        self.papel.refresh_from_db()
+        self.assertEqual(self.papel.stock_actual, Decimal("100") - Decimal("2") - Decimal("3"))
+        manual.refresh_from_db()
+        self.assertTrue(manual.stock_descontado)
+
+    def test_cancelar_tras_entregar_repone_solo_lo_descontado(self):
+        for estado in ("ENTREGADO", "CANCELADO"):
+            EstadosPedidos.objects.create(nombre_estado=estado)
+        FormaPago.objects.create(nombre="Efectivo")
+        Cajas.objects.create(saldo_inicial=Decimal("0"), id_empleado=self.empleado)
+        tinta = Insumos.objects.create(nombre="Tinta", stock_actual=Decimal("100"))
+        personalizado = TiposProducto.objects.create(nombre_tipo="Personalizado")
+        remera = Productos.objects.create(
+            nombre="Remera", tipo=personalizado, precio=Decimal("50"), costo_diseno=0, margen_ganancia=0,
+        )
+        ProductosInsumos.objects.create(producto=remera, insumo=tinta, cantidad=Decimal("3"))
+        presupuesto = self.crear_presupuesto()
+        trabajo = Trabajo.objects.create(
+            presupuesto=presupuesto, nombre_trabajo="Remera", producto=remera, cantidad=3,
+        )
+        TrabajoInsumo.objects.create(
+            trabajo=trabajo, insumo=tinta, cantidad=Decimal("3"), precio_unitario=Decimal("1"), subtotal=Decimal("3"),
+        )
+
+        self.convertir(presupuesto)
+        pedido = Pedidos.objects.get()
+        tinta.refresh_from_db()
+        self.assertEqual(tinta.stock_actual, Decimal("97"))
+
+        for estado in ("ENTREGADO", "CANCELADO"):
+            self.client.post(reverse("pedido_cambiar_estado", args=[pedido.id_pedido, estado]))
+            tinta.refresh_from_db()
+            self.assertEqual(tinta.stock_actual, Decimal("97") if estado == "ENTREGADO" else Decimal("100"))
+
+
+class AgregarTrabajoTests(DatosBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.presupuesto = Presupuestos.objects.create(id_cliente=self.cliente, total_presupuesto=Decimal("0"))
+        self.insumos = [
+            Insumos.objects.create(nombre=f"Insumo {i}", stock_actual=Decimal("100")) for i in range(40)
+        ]
+
+    def guardar_contando(self, lineas, editar=""):
+        datos = {
+            "nombre_trabajo": "Folletos",
+            "cantidad_trabajo": 1,
+            "insumos_json": json.dumps([
+                {"id_insumo": insumo.id_insumo, "cantidad": cantidad, "costo_unitario": "10"}
+                for insumo, cantidad in lineas
+            ]),
+            "editar_trabajo_id": editar,
+        }
+        url = reverse("agregar_trabajo", args=[self.presupuesto.id_presupuesto])
+        respuesta, consultas = self.contando(self.client.post, url, datos)
+        self.assertTrue(respuesta.json()["ok"])
+        return consultas
+
+    def test_consultas_constantes_y_edicion_por_diferencias(self):
+        pocas = self.guardar_contando([(i, 1) for i in self.insumos[:2]])
+        self.assertEqual(self.guardar_contando([(i, 1) for i in self.insumos]), pocas)
+
+        trabajo = Trabajo.objects.latest("id")
+        previas = dict(trabajo.insumos.values_list("insumo_id", "id"))
+        # Cambia la cantidad del primero y quita el último: el resto de las líneas no se toca.
+        lineas = [(self.insumos[0], 3)] + [(i, 1) for i in self.insumos[1:39]]
+        self.guardar_contando(lineas, editar=trabajo.id)
+
+        self.assertEqual(Trabajo.objects.latest("id").id, trabajo.id)
+        actuales = dict(trabajo.insumos.values_list("insumo_id", "id"))
+        self.assertEqual(actuales, {k: v for k, v in previas.items() if k != self.insumos[39].id_insumo})
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.subtotal_insumos, Decimal("410"))
+
+
+class RecetasTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.papel = Insumos.objects.create(nombre="Papel", factor_conversion=2)
+        self.tinta = Insumos.objects.create(nombre="Tinta")
+        self.taza = Productos.objects.create(nombre="Taza", costo_diseno=0, margen_ganancia=0)
+        self.remera = Productos.objects.create(nombre="Remera", costo_diseno=0, margen_ganancia=0)
+        ProductosInsumos.objects.create(producto=self.taza, insumo=self.papel, cantidad=Decimal("4"))
+        ProductosInsumos.objects.create(producto=self.taza, insumo=self.tinta, cantidad=Decimal("1"))
+        ProductosInsumos.objects.create(producto=self.remera, insumo=self.tinta, cantidad=Decimal("3"))
+
+    def test_explota_en_una_consulta_y_usa_cache(self):
+        pares = [(self.taza.id_producto, 2), (self.remera.id_producto, 1), (self.taza.id_producto, 1)]
+        with self.assertNumQueries(1):
+            requerimiento = explotar(pares)
+        self.assertEqual(requerimiento, {self.papel.id_insumo: Decimal("6"), self.tinta.id_insumo: Decimal("6")})
+        with self.assertNumQueries(0):
+            explotar(pares)
+
+    def test_invalida_al_cambiar_receta_o_factor(self):
+        self.assertEqual(receta_de(self.taza.id_producto)[self.papel.id_insumo], Decimal("2"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.papel.factor_conversion = 4
+            self.papel.save()
+            # Hasta que se confirma la transacción, el cache sigue sirviendo la receta anterior.
+            self.assertEqual(receta_de(self.taza.id_producto)[self.papel.id_insumo], Decimal("2"))
+        self.assertEqual(receta_de(self.taza.id_producto)[self.papel.id_insumo], Decimal("1"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductosInsumos.objects.filter(producto=self.taza, insumo=self.papel).delete()
+        self.assertNotIn(self.papel.id_insumo, receta_de(self.taza.id_producto))
+
+
+class ReservaStockTests(DatosBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.papel = Insumos.objects.create(nombre="Papel", stock_actual=Decimal("10"), factor_conversion=2)
+        self.tinta = Insumos.objects.create(nombre="Tinta", stock_actual=Decimal("5"))
+        self.primero = self.crear_presupuesto(Decimal("12"))
+        self.segundo = self.crear_presupuesto(Decimal("12"))
+
+    def crear_presupuesto(self, hojas):
+        presupuesto = Presupuestos.objects.create(id_cliente=self.cliente)
+        trabajo = Trabajo.objects.create(presupuesto=presupuesto, nombre_trabajo="Folletos")
+        TrabajoInsumo.objects.create(
+            trabajo=trabajo, insumo=self.papel, cantidad=hojas, precio_unitario=1, subtotal=hojas,
+        )
+        return presupuesto
+
+    def test_reserva_y_atp(self):
+        reservar_presupuesto(self.primero)
+
+        with self.assertNumQueries(1):
+            disponible = {i.id_insumo: i.disponible for i in disponibles()}
+        self.assertEqual(disponible, {self.papel.id_insumo: Decimal("4"), self.tinta.id_insumo: Decimal("5")})
+
+        requerimiento = {self.papel.id_insumo: Decimal("6"), self.tinta.id_insumo: Decimal("1")}
+        with self.assertNumQueries(1):
+            faltantes = faltantes_de(requerimiento)
+        self.assertEqual([(i.nombre, r, d) for i, r, d in faltantes], [("Papel", Decimal("6"), Decimal("4"))])
+        self.assertEqual(faltantes_de(requerimiento, excluir_presupuesto=self.primero), [])
+
+        liberar_reservas(self.primero)
+        self.assertEqual(faltantes_de(requerimiento), [])
+
+    def test_editar_trabajos_refresca_la_reserva(self):
+        self.primero.estado_presupuesto = "CONFIRMADO"
+        self.primero.save()
+        reservar_presupuesto(self.primero)
+
+        self.client.post(reverse("agregar_trabajo", args=[self.primero.id_presupuesto]), {
+            "nombre_trabajo": "Tarjetas",
+            "insumos_json": json.dumps([{"id_insumo": self.tinta.id_insumo, "cantidad": 2, "costo_unitario": "1"}]),
+        })
+        self.assertEqual(
+            dict(self.primero.reservas.values_list("insumo_id", "cantidad")),
+            {self.papel.id_insumo: Decimal("6"), self.tinta.id_insumo: Decimal("2")},
+        )
+
+    def test_rechazar_libera_reservas_y_valida_estado(self):
+        self.primero.estado_presupuesto = "CONFIRMADO"
+        self.primero.save()
+        reservar_presupuesto(self.primero)
+
+        url = reverse("presupuesto_rechazar", args=[self.primero.id_presupuesto])
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.client.post(url)
+        self.client.post(url)
+
+        self.primero.refresh_from_db()
+        self.assertEqual(self.primero.estado_presupuesto, "RECHAZADO")
+        self.assertFalse(self.primero.reservas.exists())
+
+        Pedidos.objects.create(id_cliente=self.cliente, presupuesto=self.segundo)
+        self.client.post(reverse("presupuesto_rechazar", args=[self.segundo.id_presupuesto]))
+        self.segundo.refresh_from_db()
+        self.assertEqual(self.segundo.estado_presupuesto, "EN ESPERA")
+
+    def test_aprobar_no_reserva_presupuestos_rechazados_ni_convertidos(self):
+        url = reverse("presupuesto_aprobar", args=[self.primero.id_presupuesto])
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+        self.primero.estado_presupuesto = "RECHAZADO"
+        self.primero.save()
+        self.client.post(url)
+        Pedidos.objects.create(id_cliente=self.cliente, presupuesto=self.segundo)
+        self.client.post(reverse("presupuesto_aprobar", args=[self.segundo.id_presupuesto]))
+
+        self.primero.refresh_from_db()
+        self.assertEqual(self.primero.estado_presupuesto, "RECHAZADO")
+        self.assertFalse(self.primero.reservas.exists() or self.segundo.reservas.exists())
+
+
+class StockSnapshotTests(TestCase):
+
+    def mover(self, insumo, tipo, cantidad, momento):
+        movimientos = contabilizar_stock([(insumo, tipo, Decimal(cantidad), "Prueba")], "Prueba")
+        StockMovimientos.objects.filter(pk=movimientos[0].pk).update(fecha_hora=momento)
+
+    def test_stock_a_fecha(self):
+        dia = lambda d, h: timezone.make_aware(datetime(2026, 1, d, h))
+        papel = Insumos.objects.create(nombre="Papel", stock_actual=Decimal("10"))
+        self.mover(papel, "salida", "2", dia(1, 10))
+        crear_snapshot_stock()
+        StockSnapshot.objects.update(fecha_hora=dia(1, 23))
+        self.mover(papel, "entrada", "5", dia(2, 10))
+        tinta = Insumos.objects.create(nombre="Tinta", stock_actual=Decimal("3"))
+
+        with self.assertNumQueries(5):
+            stock = stock_a_fecha(dia(2, 12))
+        self.assertEqual(stock, {papel.id_insumo: Decimal("13"), tinta.id_insumo: Decimal("3")})
+        self.assertEqual(stock_a_fecha(dia(1, 23))[papel.id_insumo], Decimal("8"))
+        # Antes del primer snapshot se reconstruye hacia atrás desde el stock actual.
+        self.assertEqual(stock_a_fecha(dia(1, 9))[papel.id_insumo], Decimal("10"))
+
+
+
+class AjusteManualInsumoTests(DatosBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.proveedor = Proveedores.objects.create(nombre="Papelera", razon_social="Papelera SA", cuit="20")
+        self.unidad = UnidadMedida.objects.create(nombre="Resma")
+
+    def datos(self, **cambios):
+        datos = {
+            "proveedor": self.proveedor.pk, "nombre": "Papel", "unidad_medida": self.unidad.pk,
+            "factor_conversion": 1, "stock_actual": 10, "stock_minimo": 0, "precio_costo_unitario": "5",
+        }
+        datos.update(cambios)
+        return datos
+
+    def test_alta_y_edicion_pasan_por_el_libro(self):
+        self.client.post(reverse("insumo_create"), self.datos())
+        papel = Insumos.objects.get()
+        antes_de_editar = timezone.now()
+        self.client.post(reverse("insumo_edit", args=[papel.pk]), self.datos(stock_actual=7))
+
+        papel.refresh_from_db()
+        self.assertEqual(papel.stock_actual, Decimal("7"))
+        self.assertEqual(
+            list(papel.stockmovimientos_set.order_by("id_movimiento").values_list("tipo", "cantidad")),
+            [("entrada", Decimal("10")), ("salida", Decimal("3"))],
+        )
+        self.assertEqual(stock_a_fecha(antes_de_editar)[papel.pk], Decimal("10"))
+
+class ConteoInventarioTests(DatosBaseTestCase):
+
+    def test_csv_y_ajuste_en_lote(self):
+        insumos = [Insumos.objects.create(nombre=f"Insumo {i}", stock_actual=Decimal("10")) for i in range(30)]
+        texto = "insumo;cantidad\n" + "\n".join(
+            f"{i.nombre};{8 if n % 2 else 12}" for n, i in enumerate(insumos)
+        ) + "\nInexistente;3\nInsumo 0;x\n"
+        conteos, errores = leer_conteo_csv(texto)
+        self.assertEqual(len(conteos), 30)
+        self.assertEqual(errores, ["Fila 32: insumo desconocido.", "Fila 33: insumo repetido, cantidad inválida."])
+
+        pocos = {i: conteos[i] for i in list(conteos)[:3]}
+        _, consultas_pocos = self.contando(aplicar_conteo, pocos)
+        diferencias, consultas_todos = self.contando(aplicar_conteo, conteos)
+        self.assertEqual(consultas_pocos, consultas_todos)
+        self.assertEqual(len(diferencias), 27)
+
+        self.assertEqual(
+            sorted(set(Insumos.objects.values_list("stock_actual", flat=True))), [Decimal("8"), Decimal("12")]
+        )
+        self.assertEqual(StockMovimientos.objects.count(), 30)
+
+
+class PresupuestosListTests(DatosBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        tercerizado = TiposProducto.objects.create(nombre_tipo="Tercerizado")
+        self.taza = Productos.objects.create(
+            nombre="Taza", tipo=tercerizado, costo_inicial=Decimal("30"), costo_diseno=0, margen_ganancia=0,
+        )
+
+    def crear_presupuestos(self, cantidad, trabajos):
+        for _ in range(cantidad):
+            presupuesto = Presupuestos.objects.create(id_cliente=self.cliente, total_presupuesto=Decimal("1000"))
+            for i in range(trabajos):
+                Trabajo.objects.create(
+                    presupuesto=presupuesto, nombre_trabajo="Taza" if i % 2 else "Folletos",
+                    producto=self.taza if i % 2 else None, cantidad=2, subtotal_insumos=Decimal("10"),
+                )
+        recalcular_costos(Presupuestos.objects.all())
+
+    def consultas_listado(self):
+        respuesta, consultas = self.contando(self.client.get, reverse("presupuestos_list"))
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta, consultas
+
+    def test_consultas_fijas_por_pagina(self):
+        self.crear_presupuestos(1, 10)
+        respuesta, una_fila = self.consultas_listado()
+        self.assertEqual(respuesta.context["presupuestos"][0].ganancia_real, Decimal("600"))
+
+        self.crear_presupuestos(14, 10)
+        _, pagina_completa = self.consultas_listado()
+        self.assertEqual(una_fila, pagina_completa)
+
+    def test_costos_persistidos_al_editar_trabajos(self):
+        self.crear_presupuestos(1, 0)
+        presupuesto = Presupuestos.objects.get()
+        trabajo = Trabajo.objects.create(
+            presupuesto=presupuesto, nombre_trabajo="Taza", producto=self.taza, cantidad=2,
+            subtotal_insumos=Decimal("10"), total_trabajo=Decimal("100"),
+        )
+
+        # La copia se llama "Taza (copia)" pero conserva el producto: su costo sigue incluyendo el tercerizado.
+        self.client.post(reverse("duplicar_trabajo", args=[trabajo.id]))
+        presupuesto.refresh_from_db()
+        self.assertEqual((presupuesto.costo_real, presupuesto.ganancia_real), (Decimal("140"), Decimal("60")))
+        self.assertEqual(list(presupuesto.trabajos.values_list("producto", flat=True)), [self.taza.pk] * 2)
+
+        self.client.post(reverse("eliminar_trabajo", args=[trabajo.id]))
+        presupuesto.refresh_from_db()
+        self.assertEqual((presupuesto.costo_real, presupuesto.ganancia_real), (Decimal("70"), Decimal("30")))
+
+    def test_editores_de_renglones_recalculan_la_ganancia(self):
+        self.crear_presupuestos(1, 0)
+        presupuesto = Presupuestos.objects.get()
+        papel = Insumos.objects.create(nombre="Papel", stock_actual=Decimal("100"), precio_costo_unitario=Decimal("5"))
+
+        self.client.post(
+            reverse("agregar_insumo_presupuesto", args=[presupuesto.id_presupuesto]),
+            {"insumo_id": papel.id_insumo, "cantidad_usada": "2"},
+        )
+        presupuesto.refresh_from_db()
+        self.assertEqual(presupuesto.ganancia_real, Decimal("10"))
+
+        self.client.post(
+            reverse("guardar_trabajo", args=[presupuesto.id_presupuesto]),
+            {"nombre_trabajo": "Folletos", "cantidad_trabajo": 2, "subtotal_trabajo": "5"},
+        )
+        presupuesto.refresh_from_db()
+        self.assertEqual(presupuesto.ganancia_real, Decimal("20"))
+
+
+class RepreciarPresupuestosTests(DatosBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        personalizado = TiposProducto.objects.create(nombre_tipo="Personalizado")
+        self.remera = Productos.objects.create(
+            nombre="Remera", tipo=personalizado, precio=Decimal("50"), costo_diseno=0, margen_ganancia=0,
+        )
+        self.papel = Insumos.objects.create(nombre="Papel", precio_costo_unitario=Decimal("5"))
+        self.abierto = self.crear_presupuesto("EN ESPERA")
+        self.confirmado = self.crear_presupuesto("CONFIRMADO")
+        recalcular_costos(Presupuestos.objects.all())
+
+    def crear_presupuesto(self, estado):
+        presupuesto = Presupuestos.objects.create(
+            id_cliente=self.cliente, estado_presupuesto=estado, total_presupuesto=Decimal("190"),
+        )
+        a_medida = Trabajo.objects.create(
+            presupuesto=presupuesto, nombre_trabajo="Folletos", cantidad=2, costo_diseno=Decimal("10"),
+            margen_ganancia=Decimal("50"), subtotal_insumos=Decimal("20"), precio_unitario=Decimal("45"),
+            total_trabajo=Decimal("90"),
+        )
+        catalogo = Trabajo.objects.create(
+            presupuesto=presupuesto, nombre_trabajo="Remera", producto=self.remera, cantidad=2,
+            subtotal_insumos=Decimal("10"), precio_unitario=Decimal("50"), total_trabajo=Decimal("100"),
+        )
+        for trabajo, cantidad in ((a_medida, 4), (catalogo, 2)):
+            TrabajoInsumo.objects.create(
+                trabajo=trabajo, insumo=self.papel, cantidad=cantidad,
+                precio_unitario=Decimal("5"), subtotal=Decimal("5") * cantidad,
+            )
+        return presupuesto
+
+    def test_vista_previa_y_aplicacion(self):
+        # Una compra a 8 no cambia el precio de costo con el que se cotiza...
+        contabilizar_stock([(self.papel, "entrada", Decimal("10"), "Compra", Decimal("8"))], "Compra")
+        self.assertEqual(repreciar_presupuestos([self.papel.id_insumo])["presupuestos"], [])
+        # ...sí lo hace la edición manual del precio del insumo.
+        Insumos.objects.filter(pk=self.papel.pk).update(precio_costo_unitario=Decimal("8"))
+
+        previa = repreciar_presupuestos([self.papel.id_insumo])
+        self.assertEqual((previa["delta"], previa["trabajos"], previa["lineas"]), (Decimal("36"), 2, 2))
+        self.assertEqual([f["presupuesto"].pk for f in previa["presupuestos"]], [self.abierto.pk])
+        self.assertEqual(TrabajoInsumo.objects.filter(precio_unitario=Decimal("8")).count(), 0)
+
+        repreciar_presupuestos([self.papel.id_insumo], aplicar=True)
+        a_medida, catalogo = self.abierto.trabajos.order_by("id")
+        self.assertEqual((a_medida.subtotal_insumos, a_medida.total_trabajo), (Decimal("32"), Decimal("126")))
+        self.assertEqual((catalogo.subtotal_insumos, catalogo.total_trabajo), (Decimal("16"), Decimal("100")))
+        self.abierto.refresh_from_db()
+        self.assertEqual(
+            (self.abierto.subtotal, self.abierto.total_presupuesto, self.abierto.costo_real, self.abierto.ganancia_real),
+            (Decimal("226"), Decimal("226"), Decimal("48"), Decimal("178")),
+        )
+        self.confirmado.refresh_from_db()
+        self.assertEqual(self.confirmado.total_presupuesto, Decimal("190"))
+
+        self.assertEqual(repreciar_presupuestos(aplicar=True)["presupuestos"], [])
+
+    def test_aplicar_con_consultas_constantes(self):
+        Insumos.objects.filter(pk=self.papel.pk).update(precio_costo_unitario=Decimal("8"))
+        _, uno = self.contando(repreciar_presupuestos, [self.papel.id_insumo], aplicar=True)
+
+        Insumos.objects.filter(pk=self.papel.pk).update(precio_costo_unitario=Decimal("9"))
+        for _ in range(4):
+            self.crear_presupuesto("EN ESPERA")
+        resumen, cinco = self.contando(repreciar_presupuestos, [self.papel.id_insumo], aplicar=True)
+        self.assertEqual(len(resumen["presupuestos"]), 5)
+        self.assertEqual(cinco, uno)
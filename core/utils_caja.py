@@ -1,9 +1,19 @@
+import csv
+import threading
 from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from django.db import transaction
 from django.utils import timezone
 from django.http import JsonResponse
-from django.db.models import Sum
-from .models import Cajas, Empleados, MovimientosCaja, FormaPago
+from django.db.models import Sum, F
+from .models import (
+    AuditoriaCaja, Cajas, Empleados, MovimientosCaja, FormaPago, ResumenCaja,
+    Pedidos, PedidosInsumos, PedidosProductos,
+)
+
+# Cada cuántos movimientos de una caja se guarda un CheckpointCaja.
+MOVIMIENTOS_POR_CHECKPOINT = 500
 
 def caja_abierta_de(request):
     """Devuelve la caja ABIERTA del empleado logueado (o None)."""
@@ -17,6 +27,382 @@ def caja_abierta_de(request):
         .first()
     )
 
+_auditoria = threading.local()
+
+
+def auditar(accion, request=None, usuario=None, caja=None, movimiento=None, detalle="", ip=None):
+    """
+    Encola una entrada de AuditoriaCaja. La entrada solo se confirma si la
+    transacción en curso hace commit (transaction.on_commit); dentro de
+    auditoria_en_lote() las confirmadas se insertan juntas al final.
+    """
+    if request is not None:
+        usuario = usuario or (request.user if request.user.is_authenticated else None)
+        ip = ip or request.META.get("REMOTE_ADDR")
+    entrada = AuditoriaCaja(
+        accion=accion, usuario=usuario, caja=caja, movimiento=movimiento, detalle=detalle, ip=ip,
+    )
+    lote = getattr(_auditoria, "lote", None)
+    if lote is None:
+        transaction.on_commit(lambda: AuditoriaCaja.objects.bulk_create([entrada]))
+    else:
+        transaction.on_commit(lambda: lote.append(entrada))
+
+
+@contextmanager
+def auditoria_en_lote():
+    """Acumula la auditoría confirmada del bloque y la inserta con un único bulk_create."""
+    anterior = getattr(_auditoria, "lote", None)
+    _auditoria.lote = []
+    try:
+        yield
+    finally:
+        lote = _auditoria.lote
+        _auditoria.lote = anterior
+        if lote:
+            if anterior is not None:
+                anterior.extend(lote)
+            else:
+                AuditoriaCaja.objects.bulk_create(lote)
+
+
+def acumular_resumen(caja, forma_pago, tipo, origen, monto, cantidad=1):
+    """Suma al renglón de ResumenCaja correspondiente; se llama con la caja bloqueada."""
+    actualizados = ResumenCaja.objects.filter(
+        caja=caja, forma_pago=forma_pago, tipo=tipo, origen=origen
+    ).update(total=F("total") + monto, cantidad=F("cantidad") + cantidad)
+    if not actualizados:
+        ResumenCaja.objects.create(
+            caja=caja, forma_pago=forma_pago, tipo=tipo, origen=origen,
+            total=monto, cantidad=cantidad,
+        )
+
+
+@transaction.atomic
+def contabilizar_movimiento(caja, tipo, forma_pago, monto, creado_por,
+                            origen=MovimientosCaja.Origen.MANUAL, descripcion="",
+                            referencia_id=None, usuario=None, ip=None, validar_saldo=False):
+    """
+    Único punto de alta de movimientos de caja.
+
+    Bloquea la fila de la caja (SELECT ... FOR UPDATE) para que dos cajeros no
+    calculen el mismo saldo_resultante, asigna el siguiente número de secuencia
+    de la caja, inserta el movimiento, actualiza los totales y el resumen por
+    forma de pago y encola su auditoría, todo en una sola transacción.
+    """
+    caja = Cajas.objects.select_for_update().get(pk=caja.pk)
+    saldo_actual = caja.saldo_sistema
+
+    if tipo == MovimientosCaja.Tipo.EGRESO and validar_saldo and monto > saldo_actual:
+        raise ValueError("No hay saldo suficiente para realizar el egreso.")
+
+    if tipo == MovimientosCaja.Tipo.INGRESO:
+        caja.total_ingresos += monto
+    else:
+        caja.total_egresos += monto
+    caja.ultima_secuencia += 1
+
+    mov = MovimientosCaja.objects.create(
+        caja=caja,
+        fecha_hora=timezone.now(),
+        tipo=tipo,
+        forma_pago=forma_pago,
+        monto=monto,
+        descripcion=descripcion,
+        origen=origen,
+        referencia_id=referencia_id,
+        creado_por=creado_por,
+        saldo_resultante=caja.saldo_sistema,
+        secuencia=caja.ultima_secuencia,
+    )
+    caja.save(update_fields=["total_ingresos", "total_egresos", "ultima_secuencia"])
+    acumular_resumen(caja, forma_pago, tipo, origen, monto)
+    if caja.ultima_secuencia % MOVIMIENTOS_POR_CHECKPOINT == 0:
+        caja.crear_checkpoint()
+
+    auditar(
+        AuditoriaCaja.Accion.MOV_ALTA,
+        usuario=usuario if usuario is not None else creado_por.user,
+        caja=caja,
+        movimiento=mov,
+        detalle=f"{mov.get_origen_display()}: {tipo} ${monto}",
+        ip=ip,
+    )
+    return mov
+
+
+COLUMNAS_IMPORTACION = ["fecha", "tipo", "forma_pago", "monto", "descripcion", "referencia"]
+FORMATOS_FECHA_IMPORTACION = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%d/%m/%Y %H:%M", "%d/%m/%Y"]
+
+
+def _leer_monto(valor):
+    valor = (valor or "").strip().replace("$", "").replace(" ", "")
+    if "," in valor:
+        valor = valor.replace(".", "").replace(",", ".")
+    return Decimal(valor)
+
+
+def _leer_fecha(valor):
+    valor = (valor or "").strip()
+    if not valor:
+        return timezone.now()
+    for formato in FORMATOS_FECHA_IMPORTACION:
+        try:
+            return timezone.make_aware(datetime.strptime(valor, formato))
+        except ValueError:
+            continue
+    raise ValueError
+
+
+def leer_movimientos_csv(texto):
+    """
+    Valida un extracto CSV (fecha;tipo;forma_pago;monto;descripcion;referencia)
+    contra las formas de pago activas, consultadas una sola vez.
+    Devuelve (filas, errores); las filas ya traen los objetos resueltos.
+    """
+    lineas = texto.lstrip("\ufeff").splitlines()
+    if not lineas:
+        return [], ["El archivo está vacío."]
+    delimitador = ";" if lineas[0].count(";") >= lineas[0].count(",") else ","
+    lector = csv.DictReader(lineas, delimiter=delimitador)
+    lector.fieldnames = [(c or "").strip().lower() for c in lector.fieldnames or []]
+    faltantes = [c for c in ("tipo", "forma_pago", "monto") if c not in lector.fieldnames]
+    if faltantes:
+        return [], [f"Faltan columnas: {', '.join(faltantes)}."]
+
+    formas_pago = {}
+    for fp in FormaPago.objects.filter(activo=True):
+        formas_pago[str(fp.id_forma)] = fp
+        formas_pago[fp.nombre.strip().lower()] = fp
+
+    filas, errores = [], []
+    for numero, fila in enumerate(lector, start=2):
+        tipo = (fila.get("tipo") or "").strip().upper()
+        forma_pago = formas_pago.get((fila.get("forma_pago") or "").strip().lower())
+        referencia = (fila.get("referencia") or "").strip()
+        problemas = []
+        if tipo not in MovimientosCaja.Tipo.values:
+            problemas.append("tipo inválido")
+        if forma_pago is None:
+            problemas.append("forma de pago desconocida")
+        try:
+            monto = _leer_monto(fila.get("monto"))
+            if monto <= 0:
+                raise InvalidOperation
+        except InvalidOperation:
+            problemas.append("monto inválido")
+        try:
+            fecha = _leer_fecha(fila.get("fecha"))
+        except ValueError:
+            problemas.append("fecha inválida")
+        if referencia and not referencia.isdigit():
+            problemas.append("referencia no numérica")
+
+        if problemas:
+            errores.append(f"Fila {numero}: {', '.join(problemas)}.")
+            continue
+        filas.append({
+            "fila": numero,
+            "fecha_hora": fecha,
+            "tipo": tipo,
+            "forma_pago": forma_pago,
+            "monto": monto,
+            "descripcion": (fila.get("descripcion") or "").strip()[:255],
+            "referencia_id": int(referencia) if referencia else None,
+        })
+    return filas, errores
+
+
+@transaction.atomic
+def importar_movimientos(caja, filas, creado_por, usuario=None, ip=None):
+    """
+    Contabiliza un lote de movimientos importados con un solo bulk_create.
+
+    Con la caja bloqueada calcula secuencia y saldo_resultante de todo el lote
+    en una pasada y actualiza totales, resumen por forma de pago y auditoría
+    una vez por lote en lugar de una vez por movimiento.
+    """
+    caja = Cajas.objects.select_for_update().get(pk=caja.pk)
+    if not filas:
+        return []
+    secuencia_inicial = caja.ultima_secuencia
+    origen = MovimientosCaja.Origen.IMPORTADO
+
+    movimientos, resumen = [], {}
+    for f in filas:
+        if f["tipo"] == MovimientosCaja.Tipo.INGRESO:
+            caja.total_ingresos += f["monto"]
+        else:
+            caja.total_egresos += f["monto"]
+        caja.ultima_secuencia += 1
+        movimientos.append(MovimientosCaja(
+            caja=caja,
+            fecha_hora=f["fecha_hora"],
+            tipo=f["tipo"],
+            forma_pago=f["forma_pago"],
+            monto=f["monto"],
+            descripcion=f["descripcion"],
+            origen=origen,
+            referencia_id=f["referencia_id"],
+            creado_por=creado_por,
+            saldo_resultante=caja.saldo_sistema,
+            secuencia=caja.ultima_secuencia,
+        ))
+        clave = (f["forma_pago"], f["tipo"])
+        total, cantidad = resumen.get(clave, (0, 0))
+        resumen[clave] = (total + f["monto"], cantidad + 1)
+
+    MovimientosCaja.objects.bulk_create(movimientos, batch_size=1000)
+    caja.save(update_fields=["total_ingresos", "total_egresos", "ultima_secuencia"])
+    for (forma_pago, tipo), (total, cantidad) in resumen.items():
+        acumular_resumen(caja, forma_pago, tipo, origen, total, cantidad)
+    if caja.ultima_secuencia // MOVIMIENTOS_POR_CHECKPOINT > secuencia_inicial // MOVIMIENTOS_POR_CHECKPOINT:
+        caja.crear_checkpoint()
+
+    auditar(
+        AuditoriaCaja.Accion.MOV_ALTA,
+        usuario=usuario if usuario is not None else creado_por.user,
+        caja=caja,
+        detalle=f"Importación de {len(movimientos)} movimientos (secuencias "
+                f"{secuencia_inicial + 1}-{caja.ultima_secuencia})",
+        ip=ip,
+    )
+    return movimientos
+
+
+def consumo_de_pedidos(ids_pedidos):
+    """
+    Stock que consumen los pedidos dados, en hasta tres consultas: insumos del
+    pedido, productos tercerizados y recetas de los personalizados (en cache).
+    Los pedidos con PedidosInsumos (los generados desde un presupuesto) ya
+    tienen sus insumos detallados: a ésos no se les explota la receta.
+    Devuelve ([(id_producto, cantidad, id_pedido), ...], [(id_insumo, cantidad, id_pedido), ...]).
+    """
+    detalle_productos, detalle_insumos = [], []
+
+    for d in PedidosInsumos.objects.filter(pedido_id__in=ids_pedidos).values(
+        "pedido_id", "insumo_id", "cantidad", "insumo__factor_conversion"
+    ):
+        cantidad = Decimal(d["cantidad"]) / Decimal(d["insumo__factor_conversion"] or 1)
+        detalle_insumos.append((d["insumo_id"], cantidad, d["pedido_id"]))
+    con_insumos = {id_pedido for _, _, id_pedido in detalle_insumos}
+
+    personalizados = {}
+    for item in PedidosProductos.objects.filter(id_pedido_id__in=ids_pedidos).values(
+        "id_pedido_id", "id_producto_id", "cantidad", "id_producto__tipo__nombre_tipo"
+    ):
+        tipo = (item["id_producto__tipo__nombre_tipo"] or "").upper()
+        cantidad = Decimal(item["cantidad"] or 0)
+        if tipo == "TERCERIZADO":
+            detalle_productos.append((item["id_producto_id"], cantidad, item["id_pedido_id"]))
+        elif tipo == "PERSONALIZADO" and item["id_pedido_id"] not in con_insumos:
+            personalizados.setdefault(item["id_producto_id"], []).append((item["id_pedido_id"], cantidad))
+
+    if personalizados:
+        from .utils_recetas import recetas_de
+
+        for producto_id, receta in recetas_de(personalizados).items():
+            for id_pedido, unidades in personalizados[producto_id]:
+                for insumo_id, cantidad in receta.items():
+                    detalle_insumos.append((insumo_id, cantidad * unidades, id_pedido))
+
+    return detalle_productos, detalle_insumos
+
+
+@transaction.atomic
+def revertir_ventas(pedidos, caja, creado_por, estado=None, usuario=None, ip=None):
+    """
+    Revierte en bloque el cobro y el descuento de stock de varios pedidos.
+
+    Usa un número fijo de consultas sin importar cuántos pedidos sean: una
+    búsqueda de los cobros (índice idx_mov_caja_referencia), un bulk_create de
+    los egresos de reversión y actualizaciones en bloque de stock y pedidos.
+    Devuelve los movimientos de reversión creados.
+    """
+    pedidos = list(pedidos)
+    ids = [p.id_pedido for p in pedidos]
+    caja = Cajas.objects.select_for_update().get(pk=caja.pk)
+    secuencia_inicial = caja.ultima_secuencia
+
+    cobros = list(MovimientosCaja.objects.filter(
+        referencia_id__in=ids,
+        tipo=MovimientosCaja.Tipo.INGRESO,
+        origen=MovimientosCaja.Origen.VENTA,
+        revertido=False,
+    ))
+
+    reversiones, resumen = [], {}
+    for cobro in cobros:
+        caja.total_egresos += cobro.monto
+        caja.ultima_secuencia += 1
+        reversiones.append(MovimientosCaja(
+            caja=caja,
+            fecha_hora=timezone.now(),
+            tipo=MovimientosCaja.Tipo.EGRESO,
+            forma_pago_id=cobro.forma_pago_id,
+            monto=cobro.monto,
+            descripcion=f"Reversión entrega Pedido #{cobro.referencia_id}",
+            origen=MovimientosCaja.Origen.VENTA,
+            referencia_id=cobro.referencia_id,
+            creado_por=creado_por,
+            saldo_resultante=caja.saldo_sistema,
+            secuencia=caja.ultima_secuencia,
+        ))
+        total, cantidad = resumen.get(cobro.forma_pago_id, (0, 0))
+        resumen[cobro.forma_pago_id] = (total + cobro.monto, cantidad + 1)
+
+    if cobros:
+        MovimientosCaja.objects.bulk_create(reversiones)
+        MovimientosCaja.objects.filter(id__in=[c.id for c in cobros]).update(revertido=True)
+        caja.save(update_fields=["total_egresos", "ultima_secuencia"])
+        for forma_pago_id, (total, cantidad) in resumen.items():
+            acumular_resumen(
+                caja, FormaPago(id_forma=forma_pago_id), MovimientosCaja.Tipo.EGRESO,
+                MovimientosCaja.Origen.VENTA, total, cantidad,
+            )
+        if caja.ultima_secuencia // MOVIMIENTOS_POR_CHECKPOINT > secuencia_inicial // MOVIMIENTOS_POR_CHECKPOINT:
+            caja.crear_checkpoint()
+
+    con_stock = [p.id_pedido for p in pedidos if p.stock_descontado]
+    if con_stock:
+        from .utils_stock import contabilizar_stock
+
+        detalle_productos, detalle_insumos = consumo_de_pedidos(con_stock)
+        contabilizar_stock(
+            [
+                (insumo_id, "entrada", cantidad, f"Reposición por reversión de Pedido #{id_pedido}")
+                for insumo_id, cantidad, id_pedido in detalle_insumos
+            ],
+            f"Reposición por reversión de Pedidos {', '.join(f'#{i}' for i in con_stock)}",
+            usuario=usuario if usuario is not None else creado_por.user,
+            ip=ip,
+            productos=[
+                (producto_id, "entrada", cantidad, f"Reposición por reversión de Pedido #{id_pedido}")
+                for producto_id, cantidad, id_pedido in detalle_productos
+            ],
+        )
+
+    cambios = {"stock_descontado": False}
+    if estado is not None:
+        cambios["id_estado"] = estado
+    Pedidos.objects.filter(id_pedido__in=ids).update(**cambios)
+    for p in pedidos:
+        p.stock_descontado = False
+        if estado is not None:
+            p.id_estado = estado
+
+    for cobro in cobros:
+        auditar(
+            AuditoriaCaja.Accion.MOV_REV,
+            usuario=usuario if usuario is not None else creado_por.user,
+            caja=caja,
+            movimiento=cobro,
+            detalle=f"Reversión del cobro de Pedido #{cobro.referencia_id}: ${cobro.monto}",
+            ip=ip,
+        )
+    return reversiones
+
+
 @transaction.atomic
 def registrar_movimiento(request, tipo, forma_pago_id, monto, descripcion="", origen="MANUAL"):
     try:
@@ -26,18 +412,20 @@ def registrar_movimiento(request, tipo, forma_pago_id, monto, descripcion="", or
     caja = Cajas.objects.filter(caja_cerrada=False, id_empleado=empleado).first()
     if not caja:
         return None, "No hay caja abierta asignada al empleado."
-    saldo_actual = caja.saldo_sistema
-    if tipo == MovimientosCaja.Tipo.EGRESO and monto > saldo_actual:
-        return None, "No hay saldo suficiente para realizar el egreso."
-    nuevo_saldo = saldo_actual + monto if tipo == MovimientosCaja.Tipo.INGRESO else saldo_actual - monto
-    mov = MovimientosCaja.objects.create(
-        caja=caja,
-        tipo=tipo,
-        monto=monto,
-        forma_pago_id=forma_pago_id,
-        descripcion=descripcion,
-        creado_por=empleado,            
-        saldo_resultante=nuevo_saldo
-    )
+    try:
+        mov = contabilizar_movimiento(
+            caja,
+            tipo,
+            FormaPago.objects.get(id_forma=forma_pago_id),
+            monto,
+            empleado,
+            origen=origen,
+            descripcion=descripcion,
+            usuario=request.user,
+            ip=request.META.get("REMOTE_ADDR"),
+            validar_saldo=True,
+        )
+    except ValueError as e:
+        return None, str(e)
 
     return mov, None
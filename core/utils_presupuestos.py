@@ -0,0 +1,181 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import Presupuestos, Trabajo, TrabajoInsumo
+
+CENTAVOS = Decimal("0.01")
+# Sólo se re-precian los presupuestos que el cliente todavía no aceptó.
+ESTADO_ABIERTO = "EN ESPERA"
+
+
+def costo_tercerizado(trabajo):
+    """Costo unitario del producto tercerizado del trabajo (0 si es a medida o personalizado)."""
+    producto = trabajo.producto
+    if producto and producto.tipo and producto.tipo.nombre_tipo.lower() == "tercerizado":
+        return Decimal(producto.costo_inicial or 0)
+    return Decimal("0")
+
+
+def calcular_costos_trabajos(trabajos):
+    """
+    Completa costo_real (insumos + costo del tercerizado × cantidad) y
+    ganancia_real de cada trabajo, en Decimal y sin guardar. Los trabajos
+    deben venir con select_related("producto__tipo").
+    """
+    for t in trabajos:
+        costo = Decimal(t.subtotal_insumos or 0) + costo_tercerizado(t) * (t.cantidad or 0)
+        t.costo_real = costo.quantize(CENTAVOS)
+        t.ganancia_real = (Decimal(t.total_trabajo or 0) - t.costo_real).quantize(CENTAVOS)
+    return trabajos
+
+
+@transaction.atomic
+def actualizar_costos_presupuesto(presupuesto):
+    """
+    Recalcula y guarda costo_real/ganancia_real de los trabajos del presupuesto
+    y del presupuesto. Llamar después de fijar su total_presupuesto.
+    """
+    trabajos = calcular_costos_trabajos(list(presupuesto.trabajos.select_related("producto__tipo")))
+    Trabajo.objects.bulk_update(trabajos, ["costo_real", "ganancia_real"])
+    presupuesto.costo_real = sum((t.costo_real for t in trabajos), Decimal("0.00"))
+    presupuesto.ganancia_real = (Decimal(presupuesto.total_presupuesto or 0) - presupuesto.costo_real).quantize(CENTAVOS)
+    presupuesto.save(update_fields=["costo_real", "ganancia_real"])
+
+
+def recalcular_costos(presupuestos, tamanio=500):
+    """
+    Recalcula los costos persistidos de un queryset de presupuestos por lotes:
+    por lote, una consulta de trabajos (con su producto) y dos bulk_update.
+    Devuelve la cantidad de presupuestos procesados.
+    """
+    ids = list(presupuestos.order_by("id_presupuesto").values_list("id_presupuesto", flat=True))
+    for inicio in range(0, len(ids), tamanio):
+        lote = ids[inicio:inicio + tamanio]
+        with transaction.atomic():
+            trabajos = calcular_costos_trabajos(list(
+                Trabajo.objects.filter(presupuesto_id__in=lote).select_related("producto__tipo")
+            ))
+            Trabajo.objects.bulk_update(trabajos, ["costo_real", "ganancia_real"], batch_size=tamanio)
+
+            costos = {}
+            for t in trabajos:
+                costos[t.presupuesto_id] = costos.get(t.presupuesto_id, Decimal("0.00")) + t.costo_real
+            lote_presupuestos = list(Presupuestos.objects.filter(id_presupuesto__in=lote).only(
+                "id_presupuesto", "total_presupuesto", "costo_real", "ganancia_real"
+            ))
+            for p in lote_presupuestos:
+                p.costo_real = costos.get(p.id_presupuesto, Decimal("0.00"))
+                p.ganancia_real = (Decimal(p.total_presupuesto or 0) - p.costo_real).quantize(CENTAVOS)
+            Presupuestos.objects.bulk_update(lote_presupuestos, ["costo_real", "ganancia_real"], batch_size=tamanio)
+    return len(ids)
+
+
+def trabajos_afectados(insumo_ids=None):
+    """
+    Índice de dependencias insumo → trabajos abiertos, en una consulta:
+    {presupuesto_id: {trabajo_id, ...}} con los trabajos de presupuestos en
+    espera que usan alguno de los insumos (todos si insumo_ids es None).
+    """
+    lineas = TrabajoInsumo.objects.filter(trabajo__presupuesto__estado_presupuesto=ESTADO_ABIERTO)
+    if insumo_ids is not None:
+        lineas = lineas.filter(insumo_id__in=insumo_ids)
+    indice = {}
+    for presupuesto_id, trabajo_id in lineas.values_list("trabajo__presupuesto_id", "trabajo_id").distinct():
+        indice.setdefault(presupuesto_id, set()).add(trabajo_id)
+    return indice
+
+
+def precio_de_linea(insumo):
+    """Precio por unidad base, como lo calcula el formulario del presupuesto."""
+    return (Decimal(insumo.precio_costo_unitario or 0) / Decimal(insumo.factor_conversion or 1)).quantize(CENTAVOS)
+
+
+def repreciar_presupuestos(insumo_ids=None, aplicar=False, tamanio=500):
+    """
+    Lleva las líneas de los presupuestos en espera al costo vigente de sus
+    insumos y recalcula trabajos y presupuestos. Los trabajos a medida
+    recalculan su precio con su margen; los del catálogo mantienen el precio
+    del producto y sólo cambian su costo.
+
+    Los trabajos a tocar salen de trabajos_afectados. Por lote de presupuestos:
+    una consulta de trabajos, una de líneas y, si aplicar=True, tres
+    bulk_update más recalcular_costos sobre los presupuestos cambiados.
+    Con aplicar=False no escribe nada y sirve de vista previa. Devuelve
+    {"presupuestos": [{"presupuesto", "total_actual", "total_nuevo", "delta"}],
+    "trabajos": n, "lineas": n, "delta": Decimal}.
+    """
+    objetivo = set(insumo_ids) if insumo_ids is not None else None
+    indice = trabajos_afectados(objetivo)
+    ids = sorted(indice)
+    resumen = {"presupuestos": [], "trabajos": 0, "lineas": 0, "delta": Decimal("0.00")}
+
+    for inicio in range(0, len(ids), tamanio):
+        lote = ids[inicio:inicio + tamanio]
+        with transaction.atomic():
+            presupuestos = Presupuestos.objects.filter(id_presupuesto__in=lote)
+            if aplicar:
+                presupuestos = presupuestos.select_for_update()
+            else:
+                presupuestos = presupuestos.select_related("id_cliente")
+            presupuestos = presupuestos.in_bulk()
+
+            # Todos los trabajos del lote (para el total), pero sólo las líneas de los afectados.
+            trabajos = Trabajo.objects.filter(presupuesto_id__in=lote).in_bulk()
+            afectados = set().union(*(indice[p] for p in lote))
+            lineas = TrabajoInsumo.objects.filter(trabajo_id__in=afectados).select_related("insumo")
+
+            subtotales = {}
+            modificadas = []
+            for ti in lineas:
+                if objetivo is None or ti.insumo_id in objetivo:
+                    precio = precio_de_linea(ti.insumo)
+                    if precio != ti.precio_unitario:
+                        ti.precio_unitario = precio
+                        ti.subtotal = (precio * ti.cantidad).quantize(CENTAVOS)
+                        modificadas.append(ti)
+                subtotales[ti.trabajo_id] = subtotales.get(ti.trabajo_id, Decimal("0.00")) + ti.subtotal
+
+            cambiados = [trabajos[i] for i in {ti.trabajo_id for ti in modificadas}]
+            for t in cambiados:
+                t.subtotal_insumos = subtotales[t.id]
+                if t.producto_id is None:
+                    costo_bruto = t.subtotal_insumos + Decimal(t.costo_diseno or 0)
+                    margen = Decimal(t.margen_ganancia or 0) / Decimal("100")
+                    t.precio_unitario = (costo_bruto * (Decimal("1.00") + margen)).quantize(CENTAVOS)
+                    t.total_trabajo = (t.precio_unitario * (t.cantidad or 0)).quantize(CENTAVOS)
+
+            totales = {}
+            for t in trabajos.values():
+                totales[t.presupuesto_id] = totales.get(t.presupuesto_id, Decimal("0.00")) + Decimal(t.total_trabajo or 0)
+
+            a_guardar = []
+            for presupuesto_id in sorted({t.presupuesto_id for t in cambiados}):
+                p = presupuestos[presupuesto_id]
+                total_actual = Decimal(p.total_presupuesto or 0)
+                total_nuevo = totales[presupuesto_id]
+                resumen["presupuestos"].append({
+                    "presupuesto": p,
+                    "total_actual": total_actual,
+                    "total_nuevo": total_nuevo,
+                    "delta": total_nuevo - total_actual,
+                })
+                resumen["delta"] += total_nuevo - total_actual
+                p.subtotal = p.total_presupuesto = total_nuevo
+                a_guardar.append(p)
+
+            resumen["trabajos"] += len(cambiados)
+            resumen["lineas"] += len(modificadas)
+            if aplicar and modificadas:
+                TrabajoInsumo.objects.bulk_update(
+                    modificadas, ["precio_unitario", "subtotal"], batch_size=tamanio
+                )
+                Trabajo.objects.bulk_update(
+                    cambiados, ["subtotal_insumos", "precio_unitario", "total_trabajo"], batch_size=tamanio
+                )
+                Presupuestos.objects.bulk_update(
+                    a_guardar, ["subtotal", "total_presupuesto"], batch_size=tamanio
+                )
+                recalcular_costos(Presupuestos.objects.filter(id_presupuesto__in=[p.id_presupuesto for p in a_guardar]))
+    return resumen
@@ -0,0 +1,60 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import ProductosInsumos
+
+# Se invalidan por señal al tocar ProductosInsumos o factor_conversion, pero con el cache
+# local de cada proceso la invalidación no llega a los demás workers: la duración acota
+# cuánto puede explotarse una receta vieja allí.
+DURACION_CACHE_RECETAS = 60 * 5
+
+
+def _clave(producto_id):
+    return f"receta:{producto_id}"
+
+
+def recetas_de(producto_ids):
+    """
+    Requerimiento aplanado por producto: {producto_id: {insumo_id: cantidad}},
+    con la cantidad ya expresada en unidades de stock (factor_conversion
+    aplicado). Lo que no está en cache se carga con una sola consulta.
+    """
+    producto_ids = set(producto_ids)
+    en_cache = cache.get_many([_clave(p) for p in producto_ids])
+    recetas = {p: en_cache[_clave(p)] for p in producto_ids if _clave(p) in en_cache}
+
+    faltantes = producto_ids - recetas.keys()
+    if faltantes:
+        nuevas = {p: {} for p in faltantes}
+        for pi in ProductosInsumos.objects.filter(producto_id__in=faltantes).values(
+            "producto_id", "insumo_id", "cantidad", "insumo__factor_conversion"
+        ):
+            receta = nuevas[pi["producto_id"]]
+            cantidad = Decimal(pi["cantidad"]) / Decimal(pi["insumo__factor_conversion"] or 1)
+            receta[pi["insumo_id"]] = receta.get(pi["insumo_id"], 0) + cantidad
+        cache.set_many({_clave(p): r for p, r in nuevas.items()}, DURACION_CACHE_RECETAS)
+        recetas.update(nuevas)
+    return recetas
+
+
+def receta_de(producto_id):
+    return recetas_de([producto_id])[producto_id]
+
+
+def explotar(pares):
+    """Agrega en {insumo_id: cantidad} los insumos que consumen N pares (producto_id, cantidad)."""
+    pares = [(p, Decimal(c or 0)) for p, c in pares]
+    recetas = recetas_de(p for p, _ in pares)
+    requerimiento = {}
+    for producto_id, unidades in pares:
+        for insumo_id, cantidad in recetas[producto_id].items():
+            requerimiento[insumo_id] = requerimiento.get(insumo_id, 0) + cantidad * unidades
+    return requerimiento
+
+
+def invalidar_recetas(producto_ids):
+    """Borra las recetas al confirmar la transacción, para que nadie vuelva a cachear la vieja."""
+    claves = [_clave(p) for p in producto_ids]
+    transaction.on_commit(lambda: cache.delete_many(claves))
@@ -0,0 +1,393 @@
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import (
+    AuditoriaCaja, Insumos, Pedidos, Productos, ReservaStock, StockMovimientos, StockSnapshot, TrabajoInsumo,
+)
+from .utils_caja import _leer_monto, auditar
+
+# Se emite (ya confirmada la transacción) con los insumos que acaban de quedar bajo su mínimo.
+insumos_bajo_minimo = Signal()
+
+
+def _sumar_deltas(lineas):
+    deltas = {}
+    for insumo_id, tipo, cantidad, *_ in lineas:
+        signo = 1 if tipo == "entrada" else -1
+        deltas[insumo_id] = deltas.get(insumo_id, 0) + signo * cantidad
+    return deltas
+
+
+def _actualizar_costo_promedio(lineas):
+    """
+    Promedio ponderado móvil: por cada insumo con entradas valorizadas,
+    costo = (stock·costo + Σ cantidad·precio + entradas sin precio·costo) / (stock + entradas),
+    resuelto en un único UPDATE por CASE con el stock previo (debe correr antes
+    de sumar el stock). Las salidas salen al costo promedio y no lo cambian.
+    Si no había stock positivo, el costo pasa a ser el de la compra.
+    """
+    entradas = {}
+    for insumo_id, tipo, cantidad, _, costo in lineas:
+        if tipo != "entrada":
+            continue
+        valor, valorizadas, sin_precio = entradas.get(insumo_id, (0, 0, 0))
+        if costo is None:
+            sin_precio += cantidad
+        else:
+            valor += cantidad * Decimal(costo)
+            valorizadas += cantidad
+        entradas[insumo_id] = (valor, valorizadas, sin_precio)
+
+    campo = Insumos._meta.get_field("costo_promedio")
+    actualizar = []
+    for insumo_id, (valor, valorizadas, sin_precio) in entradas.items():
+        if not valorizadas:
+            continue
+        promedio = ExpressionWrapper(
+            (F("stock_actual") * F("costo_promedio") + valor + sin_precio * F("costo_promedio"))
+            / (F("stock_actual") + valorizadas + sin_precio),
+            output_field=campo,
+        )
+        actualizar.append(Insumos(id_insumo=insumo_id, costo_promedio=Case(
+            When(stock_actual__gt=0, then=promedio),
+            default=Value(valor / valorizadas, output_field=campo),
+            output_field=campo,
+        )))
+    if actualizar:
+        Insumos.objects.bulk_update(actualizar, ["costo_promedio"])
+
+
+@transaction.atomic
+def contabilizar_stock(lineas, motivo, request=None, usuario=None, ip=None, productos=()):
+    """
+    Único punto de movimiento de stock, de insumos y de productos tercerizados.
+
+    `lineas` es una lista de (insumo, tipo, cantidad, detalle[, costo_unitario])
+    con tipo "entrada" o "salida"; `productos`, de (producto, tipo, cantidad,
+    detalle). Agrega un StockMovimientos por línea (un solo bulk_create) y
+    aplica el neto de cada artículo en un único
+    UPDATE ... SET stock_actual = CASE ... stock_actual + delta ... END
+    por tabla, sin leer el stock en Python, así dos pedidos simultáneos no
+    pisan sus descuentos. Las entradas con costo_unitario (compras) actualizan
+    antes el costo promedio; cada movimiento de insumo queda valorizado.
+    """
+    lineas = [
+        (insumo.pk if isinstance(insumo, Insumos) else insumo, tipo, cantidad, detalle, costo[0] if costo else None)
+        for insumo, tipo, cantidad, detalle, *costo in lineas
+        if cantidad
+    ]
+    productos = [
+        (producto.pk if isinstance(producto, Productos) else producto, tipo, cantidad, detalle)
+        for producto, tipo, cantidad, detalle in productos
+        if cantidad
+    ]
+    if not lineas and not productos:
+        return []
+
+    movimientos = []
+    if lineas:
+        _actualizar_costo_promedio(lineas)
+        deltas = _sumar_deltas(lineas)
+        Insumos.objects.bulk_update(
+            [Insumos(id_insumo=i, stock_actual=F("stock_actual") + d) for i, d in deltas.items()],
+            ["stock_actual"],
+        )
+        movidos = list(Insumos.objects.filter(id_insumo__in=deltas).only(
+            "id_insumo", "nombre", "stock_actual", "stock_minimo", "bajo_minimo", "costo_promedio"
+        ))
+        actualizar_bajo_minimo(movidos)
+        costos = {i.id_insumo: i.costo_promedio for i in movidos}
+        movimientos += [
+            StockMovimientos(
+                insumo_id=insumo_id, tipo=tipo, cantidad=cantidad, detalle=detalle,
+                costo_unitario=costo if costo is not None else costos[insumo_id],
+            )
+            for insumo_id, tipo, cantidad, detalle, costo in lineas
+        ]
+    if productos:
+        Productos.objects.bulk_update(
+            [Productos(id_producto=i, stock_actual=F("stock_actual") + d) for i, d in _sumar_deltas(productos).items()],
+            ["stock_actual"],
+        )
+        movimientos += [
+            StockMovimientos(producto_id=producto_id, tipo=tipo, cantidad=cantidad, detalle=detalle)
+            for producto_id, tipo, cantidad, detalle in productos
+        ]
+
+    movimientos = StockMovimientos.objects.bulk_create(movimientos)
+    auditar(
+        AuditoriaCaja.Accion.STOCK, request=request, usuario=usuario, ip=ip,
+        detalle=f"{motivo}: {len(movimientos)} movimientos de stock",
+    )
+    return movimientos
+
+
+def disponibles(insumo_ids=None, excluir_presupuesto=None):
+    """
+    Insumos anotados con `reservado` y `disponible` (stock_actual − reservado),
+    en una sola consulta agregada sobre reservas_stock. Las reservas del
+    presupuesto indicado no cuentan (para revalidar su propio trabajo).
+    """
+    filtro = Q()
+    if excluir_presupuesto is not None:
+        filtro = ~Q(reservas__presupuesto=excluir_presupuesto)
+    qs = Insumos.objects.annotate(
+        reservado=Coalesce(
+            Sum("reservas__cantidad", filter=filtro),
+            Value(0, output_field=DecimalField(max_digits=10, decimal_places=2)),
+        ),
+    ).annotate(disponible=F("stock_actual") - F("reservado"))
+    if insumo_ids is not None:
+        qs = qs.filter(id_insumo__in=insumo_ids)
+    return qs
+
+
+def faltantes_de(requerimiento, excluir_presupuesto=None):
+    """
+    Chequeo ATP en lote: recibe {id_insumo: cantidad en unidades de stock} y
+    devuelve [(insumo, requerido, disponible)] para los que no alcanzan.
+    """
+    faltantes = []
+    for insumo in disponibles(requerimiento, excluir_presupuesto).order_by("nombre"):
+        if requerimiento[insumo.id_insumo] > insumo.disponible:
+            faltantes.append((insumo, requerimiento[insumo.id_insumo], insumo.disponible))
+    return faltantes
+
+
+def requerimiento_de_presupuesto(presupuesto):
+    """{id_insumo: cantidad en unidades de stock} que consumen los trabajos del presupuesto."""
+    requerimiento = {}
+    for det in TrabajoInsumo.objects.filter(trabajo__presupuesto=presupuesto).values(
+        "insumo_id", "cantidad", "insumo__factor_conversion"
+    ):
+        cantidad = Decimal(det["cantidad"]) / Decimal(det["insumo__factor_conversion"] or 1)
+        requerimiento[det["insumo_id"]] = requerimiento.get(det["insumo_id"], 0) + cantidad
+    return requerimiento
+
+
+@transaction.atomic
+def reservar_presupuesto(presupuesto):
+    """Reemplaza las reservas del presupuesto por lo que piden sus trabajos actuales."""
+    requerimiento = requerimiento_de_presupuesto(presupuesto)
+    ReservaStock.objects.filter(presupuesto=presupuesto).delete()
+    ReservaStock.objects.bulk_create([
+        ReservaStock(presupuesto=presupuesto, insumo_id=insumo_id, cantidad=cantidad)
+        for insumo_id, cantidad in requerimiento.items()
+        if cantidad
+    ])
+    return requerimiento
+
+
+def liberar_reservas(presupuesto):
+    ReservaStock.objects.filter(presupuesto=presupuesto).delete()
+
+
+def refrescar_reservas(presupuesto):
+    """Tras editar trabajos: re-reserva si el presupuesto está confirmado y todavía no generó su pedido."""
+    if presupuesto.estado_presupuesto == "CONFIRMADO" and not Pedidos.objects.filter(presupuesto=presupuesto).exists():
+        reservar_presupuesto(presupuesto)
+
+
+def actualizar_bajo_minimo(insumos):
+    """
+    Recalcula el flag bajo_minimo de los insumos recién movidos (ya leídos por
+    quien llama; solo si alguno cruzó el umbral, un UPDATE por sentido) y
+    avisa de los que quedaron bajo mínimo.
+    """
+    cruzaron, recuperados = [], []
+    for insumo in insumos:
+        bajo = Insumos.esta_bajo_minimo(insumo.stock_actual, insumo.stock_minimo)
+        if bajo and not insumo.bajo_minimo:
+            cruzaron.append(insumo)
+        elif insumo.bajo_minimo and not bajo:
+            recuperados.append(insumo.id_insumo)
+
+    if cruzaron:
+        Insumos.objects.filter(id_insumo__in=[i.id_insumo for i in cruzaron]).update(bajo_minimo=True)
+        transaction.on_commit(lambda: insumos_bajo_minimo.send(sender=Insumos, insumos=cruzaron))
+    if recuperados:
+        Insumos.objects.filter(id_insumo__in=recuperados).update(bajo_minimo=False)
+    return cruzaron
+
+
+def insumos_criticos():
+    """
+    Insumos bajo su mínimo para el tablero. Se leen directo del flag indexado
+    bajo_minimo: es una consulta barata y, a diferencia de un cache por
+    proceso, ningún worker sirve una lista vieja.
+    """
+    return list(Insumos.objects.filter(bajo_minimo=True).order_by("stock_actual"))
+
+
+def _netos(movimientos):
+    """{insumo_id: entradas − salidas} de un queryset de StockMovimientos, en una consulta."""
+    netos = {}
+    for fila in movimientos.values("insumo_id", "tipo").annotate(total=Sum("cantidad")).order_by():
+        signo = 1 if fila["tipo"] == "entrada" else -1
+        netos[fila["insumo_id"]] = netos.get(fila["insumo_id"], 0) + signo * fila["total"]
+    return netos
+
+
+@transaction.atomic
+def crear_snapshot_stock():
+    """
+    Guarda el stock actual de todos los insumos como snapshot del día,
+    reemplazando el de hoy si ya existía. Bloquea los insumos
+    para que ningún movimiento quede entre el stock leído y ultimo_movimiento_id.
+    """
+    fecha = timezone.localdate()
+    insumos = list(Insumos.objects.select_for_update().values_list("id_insumo", "stock_actual"))
+    ultimo = StockMovimientos.objects.aggregate(m=Max("id_movimiento"))["m"] or 0
+    ahora = timezone.now()
+
+    StockSnapshot.objects.filter(fecha=fecha).delete()
+    return StockSnapshot.objects.bulk_create([
+        StockSnapshot(
+            insumo_id=insumo_id, fecha=fecha, fecha_hora=ahora,
+            ultimo_movimiento_id=ultimo, cantidad=stock,
+        )
+        for insumo_id, stock in insumos
+    ])
+
+
+def stock_a_fecha(momento):
+    """
+    {insumo_id: stock} al instante `momento`. Parte del último snapshot tomado
+    antes de esa hora y suma solo los movimientos posteriores a él hasta
+    `momento`. Los insumos sin snapshot previo se reconstruyen hacia atrás
+    desde el stock actual.
+    """
+    snapshot = StockSnapshot.objects.filter(fecha_hora__lte=momento).order_by("-fecha_hora").first()
+    stock = {}
+    if snapshot:
+        stock = dict(
+            StockSnapshot.objects.filter(fecha=snapshot.fecha).values_list("insumo_id", "cantidad")
+        )
+        delta = _netos(StockMovimientos.objects.filter(
+            id_movimiento__gt=snapshot.ultimo_movimiento_id, fecha_hora__lte=momento, insumo__isnull=False,
+        ))
+        for insumo_id in stock:
+            stock[insumo_id] += delta.get(insumo_id, 0)
+
+    sin_snapshot = Insumos.objects.all()
+    if snapshot:
+        sin_snapshot = sin_snapshot.exclude(snapshots__fecha=snapshot.fecha)
+    actuales = dict(sin_snapshot.values_list("id_insumo", "stock_actual"))
+    if actuales:
+        posteriores = _netos(StockMovimientos.objects.filter(insumo_id__in=actuales.keys(), fecha_hora__gt=momento))
+        for insumo_id, actual in actuales.items():
+            stock[insumo_id] = actual - posteriores.get(insumo_id, 0)
+    return stock
+
+
+def valuacion_inventario():
+    """Insumos con `valor` = stock_actual × costo_promedio y el total, en una sola consulta."""
+    insumos = list(Insumos.objects.annotate(
+        valor=ExpressionWrapper(
+            F("stock_actual") * F("costo_promedio"),
+            output_field=DecimalField(max_digits=16, decimal_places=2),
+        ),
+    ).order_by("-valor", "nombre"))
+    return insumos, sum((i.valor for i in insumos), Decimal("0"))
+
+
+def consumo_valorizado(movimientos):
+    """Salidas agrupadas por insumo con cantidad y costo (cantidad × costo_unitario del movimiento)."""
+    return (
+        movimientos.filter(tipo="salida", insumo__isnull=False)
+        .values("insumo_id", "insumo__nombre")
+        .annotate(
+            cantidad_total=Sum("cantidad"),
+            costo_total=Sum(
+                F("cantidad") * Coalesce(F("costo_unitario"), Value(0, output_field=DecimalField())),
+                output_field=DecimalField(max_digits=16, decimal_places=2),
+            ),
+        )
+        .order_by("-costo_total")
+    )
+
+
+COLUMNAS_CONTEO = ["insumo", "cantidad"]
+
+
+def leer_conteo_csv(texto):
+    """
+    Lee un conteo físico CSV (insumo;cantidad), donde insumo es el ID o el
+    nombre. Resuelve los insumos activos con una sola consulta y devuelve
+    ({id_insumo: cantidad}, errores).
+    """
+    lineas = texto.lstrip("\ufeff").splitlines()
+    if not lineas:
+        return {}, ["El archivo está vacío."]
+    delimitador = ";" if lineas[0].count(";") >= lineas[0].count(",") else ","
+    lector = csv.DictReader(lineas, delimiter=delimitador)
+    lector.fieldnames = [(c or "").strip().lower() for c in lector.fieldnames or []]
+    faltantes = [c for c in COLUMNAS_CONTEO if c not in lector.fieldnames]
+    if faltantes:
+        return {}, [f"Faltan columnas: {', '.join(faltantes)}."]
+
+    insumos = {}
+    for insumo_id, nombre in Insumos.objects.filter(is_active=True).values_list("id_insumo", "nombre"):
+        insumos[str(insumo_id)] = insumo_id
+        insumos[nombre.strip().lower()] = insumo_id
+
+    conteos, errores = {}, []
+    for numero, fila in enumerate(lector, start=2):
+        insumo_id = insumos.get((fila.get("insumo") or "").strip().lower())
+        problemas = []
+        if insumo_id is None:
+            problemas.append("insumo desconocido")
+        elif insumo_id in conteos:
+            problemas.append("insumo repetido")
+        try:
+            cantidad = _leer_monto(fila.get("cantidad"))
+            if cantidad < 0:
+                raise InvalidOperation
+        except InvalidOperation:
+            problemas.append("cantidad inválida")
+        if problemas:
+            errores.append(f"Fila {numero}: {', '.join(problemas)}.")
+            continue
+        conteos[insumo_id] = cantidad
+    return conteos, errores
+
+
+def diferencias_conteo(conteos, bloquear=False):
+    """
+    Compara {id_insumo: contado} con el stock del sistema en una sola consulta.
+    Devuelve [(insumo, sistema, contado, diferencia)] solo de los que difieren.
+    """
+    insumos = Insumos.objects.filter(id_insumo__in=conteos).order_by("nombre")
+    if bloquear:
+        insumos = insumos.select_for_update()
+    return [
+        (insumo, insumo.stock_actual, conteos[insumo.id_insumo], conteos[insumo.id_insumo] - insumo.stock_actual)
+        for insumo in insumos.only("id_insumo", "nombre", "unidad_medida", "stock_actual")
+        if conteos[insumo.id_insumo] != insumo.stock_actual
+    ]
+
+
+@transaction.atomic
+def aplicar_conteo(conteos, request=None, usuario=None, ip=None):
+    """
+    Ajusta el stock al conteo físico: bloquea los insumos contados, recalcula
+    las diferencias contra el stock vigente y las contabiliza en un solo lote.
+    """
+    diferencias = diferencias_conteo(conteos, bloquear=True)
+    fecha = timezone.localdate().strftime("%d/%m/%Y")
+    contabilizar_stock(
+        [
+            (insumo, "entrada" if diferencia > 0 else "salida", abs(diferencia),
+             f"Conteo físico {fecha}: sistema {sistema}, contado {contado}")
+            for insumo, sistema, contado, diferencia in diferencias
+        ],
+        f"Conteo físico {fecha}",
+        request=request, usuario=usuario, ip=ip,
+    )
+    return diferencias
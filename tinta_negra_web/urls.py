@@ -72,6 +72,7 @@ urlpatterns = [
 
     path("presupuesto/nuevo/", views.presupuesto_create, name="presupuesto_create"),
     path("presupuestos/", views.presupuestos_list, name="presupuestos_list"),
+    path("presupuestos/repreciar/", views.repreciar_presupuestos_view, name="repreciar_presupuestos"),
     path("presupuesto/<int:pk>/detalle/", presupuesto_detalle, name="presupuesto_detalle"),
 
     path("presupuesto/<int:presupuesto_id>/agregar-insumo/", agregar_insumo_presupuesto, name="agregar_insumo_presupuesto"),
@@ -96,6 +97,7 @@ urlpatterns = [
     path("presupuesto/<int:pk>/email-preview/", views.presupuesto_email_preview, name="presupuesto_email_preview"),
     path("presupuesto/<int:pk>/enviar-email/", views.presupuesto_enviar_email, name="presupuesto_enviar_email"),
     path("presupuesto/<int:id>/aprobar/", presupuesto_aprobar, name="presupuesto_aprobar"),
+    path("presupuesto/<int:id>/rechazar/", views.presupuesto_rechazar, name="presupuesto_rechazar"),
     path("presupuesto/<int:presupuesto_id>/editar/", views.presupuesto_edit, name="presupuesto_edit"),
 
     path("pedidos/", views.pedidos_list, name="pedidos_list"),
@@ -103,8 +105,13 @@ urlpatterns = [
     path("pedidos/<int:pk>/editar-insumos/", pedido_editar_insumos, name="pedido_editar_insumos"),
     path("pedidos/<int:pk>/confirmar/", pedido_confirmar, name="pedido_confirmar"),
     path("pedidos/<int:id_pedido>/estado/<str:nuevo_estado>/", pedido_cambiar_estado, name="pedido_cambiar_estado"),
+    path("pedidos/revertir-entregas/", views.pedidos_revertir_entregas, name="pedidos_revertir_entregas"),
 
     path("stock/movimientos/", movimientos_stock_list, name="movimientos_stock_list"),
+    path("stock/movimientos/exportar/", views.movimientos_stock_exportar, name="movimientos_stock_exportar"),
+    path("stock/a-fecha/", views.inventario_a_fecha, name="inventario_a_fecha"),
+    path("stock/valuacion/", views.reporte_valuacion_inventario, name="valuacion_inventario"),
+    path("stock/conteo/", views.conteo_inventario, name="conteo_inventario"),
     path("productos/<int:pk>/insumos/", producto_insumos, name="producto_insumos"),
 
     path("productos/", views.productos_list, name="productos_list"),
@@ -129,6 +136,8 @@ urlpatterns = [
     path('cajas/formas-pago/toggle/<int:id>/', views.formas_pago_toggle, name='formas_pago_toggle'),
     path('cajas/<int:id>/', views.detalle_caja_view, name='detalle_caja'),
     path('cajas/movimientos/', views.movimientos_list, name='movimientos_list'),
+    path('cajas/movimientos/exportar/', views.movimientos_caja_exportar, name='movimientos_caja_exportar'),
+    path('cajas/movimientos/importar/', views.movimientos_importar, name='movimientos_importar'),
 
     path("configuracion/", views.configuracion, name="configuracion"),
     path("configuracion/empresa/", views.configuracion_empresa, name="configuracion_empresa"),
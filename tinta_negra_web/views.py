@@ -1,3 +1,4 @@
+import csv
 import json
 from django import forms
 from django.contrib import messages
@@ -8,14 +9,14 @@ from django.core.paginator import Paginator
 from django.db import transaction
 from django.db.models import Q
 from django.db.models.deletion import ProtectedError
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.utils import timezone
 from django.views.decorators.cache import never_cache
 from django.views.decorators.http import require_http_methods, require_POST
 from django.forms import modelformset_factory, inlineformset_factory
 from django.db.models import Sum
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 from datetime import date
 from django.views.decorators.csrf import csrf_exempt
 from django.template.loader import render_to_string, get_template
@@ -45,7 +46,18 @@ from core.models import (
     PresupuestosProductos, Trabajo, TrabajoInsumo, TiposProducto, FormaPago,
     Proveedores as Proveedor
 ) 
-from core.utils_caja import registrar_movimiento
+from core.utils_caja import (
+    registrar_movimiento, contabilizar_movimiento, auditar, caja_abierta_de,
+    leer_movimientos_csv, importar_movimientos, COLUMNAS_IMPORTACION, revertir_ventas,
+    consumo_de_pedidos,
+)
+from core.utils_stock import (
+    contabilizar_stock, faltantes_de, reservar_presupuesto, liberar_reservas, refrescar_reservas,
+    insumos_criticos, stock_a_fecha, valuacion_inventario, consumo_valorizado,
+    COLUMNAS_CONTEO, leer_conteo_csv, diferencias_conteo, aplicar_conteo,
+)
+from core.utils_recetas import receta_de
+from core.utils_presupuestos import actualizar_costos_presupuesto, repreciar_presupuestos
 import io, base64
 from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear
 from datetime import timedelta
@@ -83,10 +95,13 @@ def home(request):
     ultima_caja = Cajas.objects.order_by("-id_caja").first()
     caja_abierta = False
     saldo_actual = 0
+    resumen_forma_pago = []
 
     if ultima_caja:
         caja_abierta = not ultima_caja.caja_cerrada
         saldo_actual = ultima_caja.saldo_sistema if caja_abierta else ultima_caja.saldo_final
+        if caja_abierta:
+            resumen_forma_pago = ultima_caja.resumen_por_forma_pago()
 
     pedidos_pendientes = Pedidos.objects.exclude(
         id_estado__nombre_estado__in=["ENTREGADO", "CANCELADO"]
@@ -98,11 +113,8 @@ def home(request):
     ).order_by("-id_pedido")[:5]
 
 
-    insumos_criticos = Insumos.objects.filter(
-        stock_actual__lte=F("stock_minimo")
-    ).order_by("stock_actual")
-
-    insumos_criticos_count = insumos_criticos.count()
+    criticos = insumos_criticos()
+    insumos_criticos_count = len(criticos)
     es_duenio = request.user.groups.filter(name='Jefe').exists()
     es_empleado = request.user.groups.filter(name='Empleados').exists()
 
@@ -110,12 +122,13 @@ def home(request):
         "caja": ultima_caja,
         "caja_abierta": caja_abierta,
         "saldo_actual": saldo_actual,
+        "resumen_forma_pago": resumen_forma_pago,
 
         "pedidos_pendientes": pedidos_pendientes,
         "pedidos_pendientes_count": pedidos_pendientes_count,
         "pedidos_recientes": pedidos_recientes,
 
-        "insumos_criticos": insumos_criticos,
+        "insumos_criticos": criticos,
         "insumos_criticos_count": insumos_criticos_count,
 
         "es_duenio": es_duenio,
@@ -373,13 +386,32 @@ def proveedor_create_ajax(request):
         })
     return JsonResponse({"success": False, "errors": form.errors}, status=400)
 
+def ajustar_stock_insumo(insumo, stock_anterior, stock_nuevo, request=None):
+    """Pasa por el libro de stock la diferencia de un ajuste manual o del stock inicial."""
+    diferencia = Decimal(stock_nuevo or 0) - Decimal(stock_anterior or 0)
+    contabilizar_stock(
+        [(insumo, "entrada" if diferencia > 0 else "salida", abs(diferencia), "Ajuste manual")],
+        f"Ajuste manual de {insumo.nombre}: {stock_anterior} → {stock_nuevo}",
+        request=request,
+    )
+
+
+# El stock nunca se guarda desde un formulario: se mueve con contabilizar_stock.
+CAMPOS_INSUMO_SIN_STOCK = [c for c in InsumoForm.Meta.fields if c != "stock_actual"]
+
+
 @login_required
 @permission_required("core.add_insumos", raise_exception=True)
+@transaction.atomic
 def insumo_create(request):
     if request.method == "POST":
         form = InsumoForm(request.POST)
         if form.is_valid():
-            insumo = form.save()
+            insumo = form.save(commit=False)
+            stock_inicial = insumo.stock_actual
+            insumo.stock_actual = 0
+            insumo.save()
+            ajustar_stock_insumo(insumo, 0, stock_inicial, request=request)
             return redirect("insumos_list") 
     else:
         form = InsumoForm()
@@ -390,12 +422,18 @@ def insumo_create(request):
 @never_cache
 @login_required
 @permission_required('core.change_insumos', raise_exception=True)
+@transaction.atomic
 def insumo_edit(request, pk):
     insumo = get_object_or_404(Insumos, id_insumo=pk)
+    stock_anterior = insumo.stock_actual
     if request.method == 'POST':
         form = InsumoForm(request.POST, instance=insumo)
         if form.is_valid():
-            form.save()
+            insumo = form.save(commit=False)
+            stock_nuevo = insumo.stock_actual
+            insumo.stock_actual = stock_anterior
+            insumo.save(update_fields=CAMPOS_INSUMO_SIN_STOCK)
+            ajustar_stock_insumo(insumo, stock_anterior, stock_nuevo, request=request)
             messages.success(request, 'Insumo actualizado exitosamente.', extra_tags="insumo")
             list(messages.get_messages(request))
             return redirect('insumos_list')
@@ -432,25 +470,16 @@ def compras_create(request):
             return redirect('home')
 
         if form.is_valid() and formset.is_valid():
-            from decimal import Decimal
-
-            total_compra = Decimal('0.00')
-
-            for detalle_form in formset:
-                if detalle_form.cleaned_data.get("DELETE"):
-                    continue
-
-                insumo = detalle_form.cleaned_data.get("insumo")
-                cantidad = detalle_form.cleaned_data.get("cantidad")
-                precio_unitario = detalle_form.cleaned_data.get("precio_unitario")
-
-                if not insumo:
-                    continue
-
-                if cantidad and precio_unitario:
-                    cant = Decimal(str(cantidad))
-                    pu = Decimal(str(precio_unitario))
-                    total_compra += cant * pu
+            lineas = [
+                f.cleaned_data for f in formset.forms
+                if f.cleaned_data and not f.cleaned_data.get("DELETE")
+                and f.cleaned_data.get("insumo") and f.cleaned_data.get("cantidad")
+                and f.cleaned_data.get("precio_unitario")
+            ]
+            total_compra = sum(
+                (Decimal(str(l["cantidad"])) * Decimal(str(l["precio_unitario"])) for l in lineas),
+                Decimal('0.00'),
+            )
 
             if caja_abierta.saldo_sistema < total_compra:
                 messages.error(
@@ -464,47 +493,45 @@ def compras_create(request):
             compra.empleado = empleado_actual 
             compra.total = total_compra
             compra.save()
+            proveedor = form.cleaned_data["proveedor"]
 
-            for detalle_form in formset:
-                if detalle_form.cleaned_data.get("DELETE"):
-                    continue
-
-                insumo = detalle_form.cleaned_data.get("insumo")
-                cantidad = detalle_form.cleaned_data.get("cantidad")
-                precio_unitario = detalle_form.cleaned_data.get("precio_unitario")
-
-                if not insumo or not cantidad or not precio_unitario:
-                    continue
-
-                detalle = detalle_form.save(commit=False)
-                detalle.compra = compra
-                detalle.save()
-
-                from decimal import Decimal
-                stock_actual = insumo.stock_actual or 0
-                stock_actual_dec = Decimal(str(stock_actual))
-                cantidad_dec = Decimal(str(cantidad))
-
-                insumo.stock_actual = stock_actual_dec + cantidad_dec
-                insumo.save()
-
-                StockMovimientos.objects.create(
-                    insumo=insumo,
-                    tipo='entrada',
-                    cantidad=cantidad_dec,
-                    detalle=f"Compra #{compra.id_compra} - {compra.proveedor.nombre if compra.proveedor else ''}"
+            try:
+                contabilizar_movimiento(
+                    caja_abierta,
+                    MovimientosCaja.Tipo.EGRESO,
+                    form.cleaned_data['forma_pago'],
+                    total_compra,
+                    empleado_actual,
+                    origen=MovimientosCaja.Origen.COMPRA,
+                    descripcion=f"Pago a {proveedor.nombre} por Compra #{compra.id_compra}",
+                    referencia_id=compra.id_compra,
+                    usuario=request.user,
+                    ip=request.META.get("REMOTE_ADDR"),
+                    validar_saldo=True,
                 )
+            except ValueError as e:
+                transaction.set_rollback(True)
+                messages.error(request, f"❌ {e}")
+                list(messages.get_messages(request))
+                return redirect('compras_create')
 
-            MovimientosCaja.objects.create(
-                caja=caja_abierta,
-                tipo=MovimientosCaja.Tipo.EGRESO,
-                forma_pago=form.cleaned_data['forma_pago'],
-                monto=total_compra,
-                descripcion=f"Pago a {compra.proveedor.nombre} por Compra #{compra.id_compra}",
-                origen=MovimientosCaja.Origen.COMPRA,
-                referencia_id=compra.id_compra,
-                creado_por=empleado_actual,
-                saldo_resultante=caja_abierta.saldo_sistema - total_compra
+            DetallesCompra.objects.bulk_create([
+                DetallesCompra(
+                    compra=compra,
+                    insumo=l["insumo"],
+                    cantidad=l["cantidad"],
+                    precio_unitario=l["precio_unitario"],
+                )
+                for l in lineas
+            ])
+            detalle_stock = f"Compra #{compra.id_compra} - {proveedor.nombre}"
+            contabilizar_stock(
+                [
+                    (l["insumo"], "entrada", Decimal(str(l["cantidad"])), detalle_stock, l["precio_unitario"])
+                    for l in lineas
+                ],
+                f"Compra #{compra.id_compra}",
+                request=request,
             )
 
             messages.success(
@@ -641,7 +668,7 @@ def insumo_editar_ajax(request):
     if prov_id:
         insumo.proveedor = get_object_or_404(Proveedores, pk=prov_id) 
 
-    insumo.save()
+    insumo.save(update_fields=CAMPOS_INSUMO_SIN_STOCK)
 
     return JsonResponse({
         "success": True,
@@ -664,10 +691,10 @@ def insumo_nuevo_ajax(request):
         nombre=request.POST.get("nombre"),
         descripcion=request.POST.get("descripcion"),
         unidad_medida=request.POST.get("unidad_medida"),
-        stock_actual=request.POST.get("stock_actual") or 0,
         stock_minimo=request.POST.get("stock_minimo") or 0,
         precio_costo_unitario=request.POST.get("precio_costo_unitario") or 0,
     )
+    ajustar_stock_insumo(insumo, 0, request.POST.get("stock_actual") or 0, request=request)
     return JsonResponse({
         "success": True,
         "id": insumo.id_insumo,
@@ -699,7 +726,7 @@ def agregar_insumo_presupuesto(request, presupuesto_id):
 
         PresupuestosInsumos.objects.create(
             presupuesto=presupuesto,
-            id_insumo=insumo,
+            insumo=insumo,
             cantidad=cantidad_real,
             precio_unitario=insumo.precio_costo_unitario,
         )
@@ -714,6 +741,7 @@ def agregar_insumo_presupuesto(request, presupuesto_id):
             presupuesto.total_presupuesto = presupuesto.subtotal
 
         presupuesto.save()
+        actualizar_costos_presupuesto(presupuesto)
         return JsonResponse({"success": True})
 
     return JsonResponse({"success": False})
@@ -765,6 +793,10 @@ def abrir_caja_view(request):
             descripcion="Apertura automática (caja general)",
             caja_cerrada=False
         )
+        auditar(
+            AuditoriaCaja.Accion.ABRIR, request=request, caja=caja,
+            detalle=f"Apertura con saldo inicial ${saldo_inicial}",
+        )
 
         messages.success(
             request,
@@ -802,6 +834,10 @@ def cerrar_caja_view(request):
         caja.fecha_hora_cierre = timezone.now()
         caja.caja_cerrada = True
         caja.save()
+        auditar(
+            AuditoriaCaja.Accion.CERRAR, request=request, caja=caja,
+            detalle=f"Cierre con saldo final ${saldo_sistema}",
+        )
 
         request.session["cierre_info"] = {
             "saldo_inicial": f"{caja.saldo_inicial:,.2f}",
@@ -812,7 +848,9 @@ def cerrar_caja_view(request):
         return redirect("cajas_list")
 
     return render(request, "core/caja/cerrar_caja_modal.html", {
-        "saldo_sistema": saldo_sistema
+        "saldo_sistema": saldo_sistema,
+        "resumen_forma_pago": caja.resumen_por_forma_pago(),
+        "resumen_origen": caja.resumen_por_origen(),
     })
 
 
@@ -828,8 +866,11 @@ def detalle_caja_view(request, id):
     return render(request, 'core/caja/detalle_caja.html', {
         'caja': caja,
         'movimientos': movimientos,
+        'resumen_forma_pago': caja.resumen_por_forma_pago(),
+        'resumen_origen': caja.resumen_por_origen(),
     })
 @login_required
+@transaction.atomic
 def movimiento_create(request):
 
     if request.method == "GET":
@@ -867,34 +908,78 @@ def movimiento_create(request):
     except FormaPago.DoesNotExist:
         return JsonResponse({"error": "Forma de pago inválida"}, status=400)
 
-    saldo_actual = caja.saldo_sistema  
-    nuevo_saldo = saldo_actual + monto if tipo == "INGRESO" else saldo_actual - monto
-
-    movimiento = MovimientosCaja.objects.create(
-        caja=caja,
-        fecha_hora=timezone.now(),
-        tipo=tipo,
-        forma_pago=forma_pago,
-        monto=monto,
-        descripcion=descripcion,
+    contabilizar_movimiento(
+        caja,
+        tipo,
+        forma_pago,
+        monto,
+        empleado,
         origen=MovimientosCaja.Origen.MANUAL,
-        creado_por=empleado,
-        saldo_resultante=nuevo_saldo,
-    )
-
-    AuditoriaCaja.objects.create(
-        caja=caja,
-        movimiento=movimiento,
+        descripcion=descripcion,
         usuario=request.user,
-        accion=AuditoriaCaja.Accion.MOV_ALTA,
-        detalle=f"Movimiento manual: {tipo} ${monto}",
         ip=request.META.get("REMOTE_ADDR"),
     )
 
     return redirect("movimientos_list")
 
 
+def leer_archivo_texto(archivo):
+    contenido = archivo.read()
+    try:
+        return contenido.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return contenido.decode("latin-1")
+
+
+@login_required
+@permission_required('core.add_movimientoscaja', raise_exception=True)
+def movimientos_importar(request):
+    """
+    Importa un extracto bancario / de la procesadora de tarjetas a la caja abierta
+    del empleado logueado. El primer POST solo valida y muestra la vista previa;
+    "confirmar" contabiliza.
+    """
+    caja = caja_abierta_de(request)
+    contexto = {"caja": caja, "columnas": ";".join(COLUMNAS_IMPORTACION)}
+
+    if request.method == "POST" and caja:
+        if "confirmar" in request.POST:
+            texto = request.session.pop("importacion_movimientos", None)
+            empleado = Empleados.objects.filter(user=request.user).first()
+            if texto is None or empleado is None:
+                messages.error(request, "No hay una importación pendiente para confirmar.")
+                return redirect("movimientos_importar")
+            filas, errores = leer_movimientos_csv(texto)
+            if errores:
+                messages.error(request, "El archivo tiene errores; vuelva a subirlo.")
+                return redirect("movimientos_importar")
+            movimientos = importar_movimientos(
+                caja, filas, empleado, usuario=request.user, ip=request.META.get("REMOTE_ADDR"),
+            )
+            messages.success(request, f"Se importaron {len(movimientos)} movimientos.")
+            return redirect("movimientos_list")
+
+        archivo = request.FILES.get("archivo")
+        if not archivo:
+            messages.error(request, "Seleccione un archivo CSV.")
+            return redirect("movimientos_importar")
+        texto = leer_archivo_texto(archivo)
+        filas, errores = leer_movimientos_csv(texto)
+
+        ingresos = sum(f["monto"] for f in filas if f["tipo"] == MovimientosCaja.Tipo.INGRESO)
+        egresos = sum(f["monto"] for f in filas if f["tipo"] == MovimientosCaja.Tipo.EGRESO)
+        if filas and not errores:
+            request.session["importacion_movimientos"] = texto
+        contexto.update({
+            "filas": filas[:50],
+            "cantidad": len(filas),
+            "errores": errores,
+            "ingresos": ingresos,
+            "egresos": egresos,
+            "saldo_final": caja.saldo_sistema + ingresos - egresos,
+        })
 
+    return render(request, "core/caja/importar_movimientos.html", contexto)
 
 
 @never_cache
@@ -1202,15 +1287,17 @@ def pedidos_list(request):
 @login_required
 @permission_required('core.view_presupuestos', raise_exception=True)
 def presupuestos_list(request):
-    from decimal import Decimal
-    from core.models import Productos
-
     q = request.GET.get("q", "").strip()
     filtro_estado = request.GET.get("estado", "").strip()
+    orden = request.GET.get("orden", "").strip()
     presupuestos_qs = Presupuestos.objects.select_related("id_cliente") \
         .exclude(estado_presupuesto="Borrador") \
         .order_by("-id_presupuesto")
 
+    # costo_real y ganancia_real están persistidos: se ordena directamente en SQL.
+    if orden in ("ganancia_real", "-ganancia_real"):
+        presupuestos_qs = presupuestos_qs.order_by(orden, "-id_presupuesto")
+
     if q:
         presupuestos_qs = presupuestos_qs.filter(
             Q(id_presupuesto__icontains=q) |
@@ -1225,29 +1312,12 @@ def presupuestos_list(request):
     page_number = request.GET.get("page")
     presupuestos = paginator.get_page(page_number)
 
-    for pre in presupuestos:
-        costo_trabajos = sum([
-            float(t.subtotal_insumos or 0)
-            for t in pre.trabajos.all()
-        ])
-
-        costo_productos = 0
-        for t in pre.trabajos.all():
-            try:
-                producto = Productos.objects.get(nombre=t.nombre_trabajo)
-                if producto.tipo.nombre_tipo.lower() == "tercerizado":
-                    costo_productos += float(producto.costo_inicial or 0) * int(t.cantidad)
-            except Productos.DoesNotExist:
-                pass
-
-        costo_total_real = costo_trabajos + costo_productos
-        pre.ganancia_real = round(float(pre.total_presupuesto or 0) - costo_total_real, 2)
-
     return render(request, "core/presupuestos/presupuestos_list.html", {
         "presupuestos": presupuestos,
         "page_obj": presupuestos,
         "q": q,
-        "filtro_estado": filtro_estado
+        "filtro_estado": filtro_estado,
+        "orden": orden,
     })
 
 
@@ -1289,90 +1359,90 @@ def configuracion(request):
     })
 
 @login_required
+@require_POST
 @transaction.atomic
 def convertir_presupuesto_a_pedido(request, pk):
-    from core.models import (
-        Productos, PedidosProductos,
-        StockMovimientos, TrabajoInsumo, Trabajo
-    )
-
-    presupuesto = get_object_or_404(Presupuestos, id_presupuesto=pk)
+    """
+    Genera el pedido de un presupuesto y descuenta stock en bloque: trabajos
+    (con su producto) e insumos se leen en dos consultas, las cantidades se
+    agregan por insumo y las líneas, movimientos y deltas de stock se escriben
+    con bulk_create / una única actualización. Es el único punto donde un
+    presupuesto descuenta stock, insumos y tercerizados; confirmar sólo reserva.
+    """
+    from core.models import PedidosProductos, TrabajoInsumo, Trabajo
+    from django.db.models import Prefetch
+
+    presupuesto = get_object_or_404(Presupuestos.objects.select_for_update(), id_presupuesto=pk)
     if not presupuesto.id_cliente:
         messages.error(request, "No podés generar un pedido sin seleccionar un cliente.")
         return redirect("presupuesto_detalle", pk)
+    if presupuesto.estado_presupuesto == "RECHAZADO" or Pedidos.objects.filter(presupuesto=presupuesto).exists():
+        messages.error(request, "El presupuesto está rechazado o ya generó un pedido.")
+        return redirect("presupuesto_detalle", pk)
+
+    trabajos = list(
+        Trabajo.objects.filter(presupuesto=presupuesto)
+        .select_related("producto__tipo")
+        .prefetch_related(Prefetch("insumos", queryset=TrabajoInsumo.objects.select_related("insumo")))
+    )
 
     pedido = Pedidos.objects.create(
         id_cliente=presupuesto.id_cliente,
+        presupuesto=presupuesto,
         total_pedido=presupuesto.total_presupuesto,
+        id_estado=EstadosPedidos.objects.get(nombre_estado="EN PRODUCCIÓN"),
+        stock_descontado=True,
     )
 
-    estado_produccion = EstadosPedidos.objects.get(nombre_estado="EN PRODUCCIÓN")
-    pedido.id_estado = estado_produccion
-    pedido.stock_descontado = False
-    pedido.save()
-
-    trabajos = Trabajo.objects.filter(presupuesto=presupuesto)
+    pedidos_productos = []
+    productos_stock = []
+    # id_insumo -> [insumo, cantidad, importe]; PedidosInsumos admite una línea por insumo.
+    insumos = {}
 
     for trabajo in trabajos:
-
-        try:
-            producto_catalogo = Productos.objects.get(nombre=trabajo.nombre_trabajo)
-        except Productos.DoesNotExist:
-            producto_catalogo = None
-
+        producto_catalogo = trabajo.producto
         if producto_catalogo:
-            precio_unitario = producto_catalogo.precio_venta or 0
-
-            PedidosProductos.objects.create(
+            pedidos_productos.append(PedidosProductos(
                 id_pedido=pedido,
                 id_producto=producto_catalogo,
                 cantidad=trabajo.cantidad,
-                precio_unitario=precio_unitario,
-            )
-
-            if producto_catalogo.tipo.nombre_tipo.lower() == "tercerizado":
-                stock_antes = float(producto_catalogo.stock_actual or 0)
-                stock_nuevo = stock_antes - float(trabajo.cantidad)
-                producto_catalogo.stock_actual = stock_nuevo
-                producto_catalogo.save()
-
-                StockMovimientos.objects.create(
-                    producto=producto_catalogo,
-                    tipo="salida",
-                    cantidad=trabajo.cantidad,
-                    detalle=f"Uso de producto en Pedido #{pedido.id_pedido}"
-                )
-
-        insumos_trabajo = TrabajoInsumo.objects.filter(trabajo=trabajo)
-
-        for det in insumos_trabajo:
-            insumo = det.insumo
-            factor = float(insumo.factor_conversion or 1)
-            cantidad_real = float(det.cantidad) / factor
-
-            PedidosInsumos.objects.create(
-                pedido=pedido,
-                insumo=insumo,
-                cantidad=det.cantidad,
-                precio_unitario=det.precio_unitario,
-            )
-
-            stock_antes = float(insumo.stock_actual or 0)
-            insumo.stock_actual = stock_antes - cantidad_real
-            insumo.save()
-
-            StockMovimientos.objects.create(
-                insumo=insumo,
-                tipo="salida",
-                cantidad=cantidad_real,
-                detalle=f"Uso de insumo por Pedido #{pedido.id_pedido}"
-            )
-
-    pedido.stock_descontado = True
-    pedido.save()
+                precio_unitario=producto_catalogo.precio or 0,
+            ))
+            if producto_catalogo.tipo and producto_catalogo.tipo.nombre_tipo.lower() == "tercerizado":
+                productos_stock.append((
+                    producto_catalogo, "salida", Decimal(trabajo.cantidad),
+                    f"Venta por Pedido #{pedido.id_pedido}",
+                ))
+
+        for det in trabajo.insumos.all():
+            linea = insumos.setdefault(det.insumo_id, [det.insumo, Decimal(0), Decimal(0)])
+            linea[1] += det.cantidad
+            linea[2] += det.cantidad * det.precio_unitario
+
+    PedidosProductos.objects.bulk_create(pedidos_productos)
+    PedidosInsumos.objects.bulk_create([
+        PedidosInsumos(
+            pedido=pedido,
+            insumo=insumo,
+            cantidad=cantidad,
+            precio_unitario=(importe / cantidad).quantize(Decimal("0.01")) if cantidad else 0,
+        )
+        for insumo, cantidad, importe in insumos.values()
+    ])
+    contabilizar_stock(
+        [
+            (insumo, "salida", cantidad / Decimal(insumo.factor_conversion or 1),
+             f"Uso de insumo por Pedido #{pedido.id_pedido}")
+            for insumo, cantidad, _ in insumos.values()
+        ],
+        f"Pedido #{pedido.id_pedido}",
+        request=request,
+        productos=productos_stock,
+    )
+    liberar_reservas(presupuesto)
 
     presupuesto.estado_presupuesto = "CONFIRMADO"
-    presupuesto.save()
+    presupuesto.save(update_fields=["estado_presupuesto"])
 
     messages.success(
         request,
@@ -1417,24 +1487,31 @@ def pedido_editar_insumos(request, pk):
 @login_required
 @transaction.atomic
 def pedido_confirmar(request, pk):
-    pedido = get_object_or_404(Pedidos, id_pedido=pk)
-    detalles = PedidosInsumos.objects.filter(pedido=pedido)
-    for det in detalles:
-        if det.insumo.stock_actual < det.cantidad:
-            messages.error(
-                request,
-                f"No hay suficiente stock de {det.insumo.nombre}. Stock actual: {det.insumo.stock_actual}, necesario: {det.cantidad}"
-            )
-            return redirect('pedidos_list')
-    for det in detalles:
-        det.insumo.stock_actual -= det.cantidad
-        det.insumo.save()
-        StockMovimientos.objects.create(
-            insumo=det.insumo,
-            tipo='salida',
-            cantidad=det.cantidad,
-            detalle=f"Pedido #{pedido.id_pedido}"
+    pedido = get_object_or_404(Pedidos.objects.select_for_update(), id_pedido=pk)
+
+    # Los pedidos generados desde un presupuesto ya descontaron su stock al convertirse.
+    if not pedido.stock_descontado:
+        productos_stock, lineas = consumo_de_pedidos([pedido.id_pedido])
+        requeridos = {}
+        for insumo_id, cantidad, _ in lineas:
+            requeridos[insumo_id] = requeridos.get(insumo_id, 0) + cantidad
+        for insumo in Insumos.objects.filter(id_insumo__in=requeridos):
+            if insumo.stock_actual < requeridos[insumo.id_insumo]:
+                messages.error(
+                    request,
+                    f"No hay suficiente stock de {insumo.nombre}. Stock actual: {insumo.stock_actual}, "
+                    f"necesario: {requeridos[insumo.id_insumo]}"
+                )
+                return redirect('pedidos_list')
+
+        detalle = f"Pedido #{pedido.id_pedido}"
+        contabilizar_stock(
+            [(insumo_id, "salida", cantidad, detalle) for insumo_id, cantidad in requeridos.items()],
+            f"Confirmación de Pedido #{pedido.id_pedido}",
+            request=request,
+            productos=[(producto_id, "salida", cantidad, detalle) for producto_id, cantidad, _ in productos_stock],
         )
+        pedido.stock_descontado = True
 
     pedido.id_estado = get_object_or_404(EstadosPedidos, pk=2)  
     pedido.save()
@@ -1468,30 +1545,15 @@ from core.models import Presupuestos, Trabajo, TrabajoInsumo, ConfiguracionEmpre
 
 @login_required
 def presupuesto_detalle(request, pk):
-    from core.models import Productos
-
     presupuesto = get_object_or_404(Presupuestos, id_presupuesto=pk)
     trabajos = Trabajo.objects.filter(presupuesto=presupuesto).prefetch_related("insumos__insumo")
     config = ConfiguracionEmpresa.objects.first()
     subtotal_general = sum(t.total_trabajo for t in trabajos)
     total_general = subtotal_general
-    costo_real_insumos = 0
-    costo_real_tercerizados = 0
-
-    for t in trabajos:
-
-        costo_real_insumos += float(t.subtotal_insumos or 0)
-        try:
-            producto = Productos.objects.get(nombre=t.nombre_trabajo)
-
-            if producto.tipo.nombre_tipo.lower() == "tercerizado":
-                costo_real_tercerizados += float(producto.costo_inicial or 0) * int(t.cantidad)
-
-        except Productos.DoesNotExist:
-            pass
-
-    costo_real_total = costo_real_insumos + costo_real_tercerizados
-    ganancia_real = float(total_general) - costo_real_total
+    costo_real_insumos = sum(t.subtotal_insumos or 0 for t in trabajos)
+    costo_real_total = presupuesto.costo_real
+    costo_real_tercerizados = costo_real_total - costo_real_insumos
+    ganancia_real = presupuesto.ganancia_real
 
     return render(request, "core/presupuestos/presupuesto_detalle.html", {
         "presupuesto": presupuesto,
@@ -1518,6 +1580,7 @@ def eliminar_insumo_presupuesto(request, detalle_id):
         presupuesto.total_presupuesto = presupuesto.subtotal
     presupuesto.save()
     detalle.delete()
+    actualizar_costos_presupuesto(presupuesto)
 
     return JsonResponse({"success": True})
 
@@ -1526,7 +1589,7 @@ def editar_insumo_presupuesto(request, detalle_id):
         detalle = PresupuestosInsumos.objects.get(id_detalle=detalle_id)
         presupuesto = detalle.presupuesto
         cantidad_usada = Decimal(request.POST["cantidad_usada"])
-        insumo = detalle.id_insumo
+        insumo = detalle.insumo
         nueva_cantidad_real = cantidad_usada / Decimal(insumo.factor_conversion)
         subtotal_anterior = detalle.cantidad * detalle.precio_unitario
         presupuesto.subtotal -= subtotal_anterior
@@ -1539,15 +1602,235 @@ def editar_insumo_presupuesto(request, detalle_id):
         else:
             presupuesto.total_presupuesto = presupuesto.subtotal
         presupuesto.save()
+        actualizar_costos_presupuesto(presupuesto)
         return JsonResponse({"success": True})
 
 
+def filtrar_movimientos_stock(params):
+    q = params.get("q", "").strip()
+    fecha_desde = params.get("desde", "")
+    fecha_hasta = params.get("hasta", "")
+    filtro_tipo = params.get("tipo", "")
+
+    movimientos = filtrar_rango_fechas(StockMovimientos.objects.all(), fecha_desde, fecha_hasta)
+
+    if q:
+        if q.isdigit():
+            movimientos = movimientos.filter(insumo_id=int(q))
+        else:
+            movimientos = movimientos.filter(
+                Q(insumo__nombre__icontains=q) | Q(producto__nombre__icontains=q) | Q(detalle__icontains=q)
+            )
+
+    if filtro_tipo in ("entrada", "salida"):
+        movimientos = movimientos.filter(tipo=filtro_tipo)
+
+    filtros = {
+        "filtro_busqueda": q,
+        "filtro_fecha_desde": fecha_desde,
+        "filtro_fecha_hasta": fecha_hasta,
+        "filtro_tipo": filtro_tipo,
+    }
+    return movimientos, filtros
+
+
 @login_required
 def movimientos_stock_list(request):
-    movimientos = StockMovimientos.objects.all().order_by('-fecha_hora')[:200]
+    movimientos, filtros = filtrar_movimientos_stock(request.GET)
+    movimientos = movimientos.select_related("insumo", "producto").order_by('-fecha_hora')[:200]
 
     return render(request, 'core/stock/movimientos_stock_list.html', {
-        'movimientos': movimientos
+        'movimientos': movimientos,
+        'export_qs': request.GET.urlencode(),
+        **filtros,
+    })
+
+
+class Echo:
+    """Pseudo-buffer para csv.writer: devuelve la línea en vez de guardarla."""
+
+    def write(self, value):
+        return value
+
+
+def iterar_en_lotes(qs, tamanio=2000):
+    """
+    Recorre qs ordenado por PK pidiendo lotes con WHERE pk > último. A diferencia
+    de .iterator(), mantiene la memoria acotada también con mysqlclient, que
+    carga en el cliente todo el resultado de cada consulta.
+    """
+    ultimo = None
+    while True:
+        lote = qs.order_by("pk")
+        if ultimo is not None:
+            lote = lote.filter(pk__gt=ultimo)
+        lote = list(lote[:tamanio])
+        if not lote:
+            return
+        yield from lote
+        ultimo = lote[-1].pk
+
+
+def respuesta_csv_streaming(nombre_archivo, encabezado, filas):
+    """
+    Devuelve un StreamingHttpResponse que escribe el CSV fila por fila.
+    Se antepone BOM y se usa ';' para que Excel lo abra con columnas y acentos correctos.
+    """
+    writer = csv.writer(Echo(), delimiter=";")
+
+    def generar():
+        yield "\ufeff"
+        yield writer.writerow(encabezado)
+        for fila in filas:
+            yield writer.writerow(fila)
+
+    response = StreamingHttpResponse(generar(), content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{nombre_archivo}"'
+    return response
+
+
+@login_required
+def movimientos_caja_exportar(request):
+    movimientos, _ = filtrar_movimientos_caja(request.GET)
+    movimientos = iterar_en_lotes(movimientos.select_related("forma_pago", "creado_por"))
+    filas = (
+        (
+            m.id, m.caja_id, m.secuencia, timezone.localtime(m.fecha_hora).strftime("%d/%m/%Y %H:%M"),
+            m.tipo, m.origen, m.forma_pago.nombre, m.monto, m.saldo_resultante,
+            m.referencia_id or "", m.descripcion,
+            f"{m.creado_por.nombre} {m.creado_por.apellido or ''}".strip(),
+            "Sí" if m.revertido else "No",
+        )
+        for m in movimientos
+    )
+    return respuesta_csv_streaming(
+        f"movimientos_caja_{timezone.localdate():%Y%m%d}.csv",
+        ["ID", "Caja", "Secuencia", "Fecha/Hora", "Tipo", "Origen", "Forma de pago", "Monto",
+         "Saldo resultante", "Referencia", "Descripción", "Empleado", "Revertido"],
+        filas,
+    )
+
+
+@login_required
+def movimientos_stock_exportar(request):
+    movimientos, _ = filtrar_movimientos_stock(request.GET)
+    movimientos = iterar_en_lotes(movimientos.select_related("insumo", "producto"))
+    filas = (
+        (
+            m.id_movimiento, timezone.localtime(m.fecha_hora).strftime("%d/%m/%Y %H:%M"),
+            m.insumo_id or "", m.producto_id or "", m.articulo.nombre, m.tipo, m.cantidad, m.detalle or "",
+        )
+        for m in movimientos
+    )
+    return respuesta_csv_streaming(
+        f"movimientos_stock_{timezone.localdate():%Y%m%d}.csv",
+        ["ID", "Fecha/Hora", "ID insumo", "ID producto", "Artículo", "Tipo", "Cantidad", "Detalle"],
+        filas,
+    )
+
+
+def conteos_del_formulario(post):
+    """Lee los campos conteo_<id_insumo> cargados en pantalla; los vacíos no se cuentan."""
+    conteos, errores = {}, []
+    cargados = {
+        int(clave[len("conteo_"):]): valor.strip()
+        for clave, valor in post.items()
+        if clave.startswith("conteo_") and clave[len("conteo_"):].isdigit() and valor.strip()
+    }
+    nombres = dict(Insumos.objects.filter(id_insumo__in=cargados, is_active=True).values_list("id_insumo", "nombre"))
+    for insumo_id, valor in cargados.items():
+        try:
+            cantidad = Decimal(valor.replace(",", "."))
+            if insumo_id not in nombres or cantidad < 0:
+                raise InvalidOperation
+        except InvalidOperation:
+            errores.append(f"Cantidad inválida para {nombres.get(insumo_id, f'insumo #{insumo_id}')}.")
+            continue
+        conteos[insumo_id] = cantidad
+    return conteos, errores
+
+
+@login_required
+@permission_required('core.change_insumos', raise_exception=True)
+def conteo_inventario(request):
+    """
+    Conteo físico de insumos, desde un CSV o cargado en pantalla. El primer
+    POST muestra las diferencias contra el sistema; "confirmar" las ajusta.
+    """
+    contexto = {"columnas": ";".join(COLUMNAS_CONTEO)}
+
+    if request.method == "POST":
+        if "confirmar" in request.POST:
+            pendiente = request.session.pop("conteo_inventario", None)
+            if not pendiente:
+                messages.error(request, "No hay un conteo pendiente para confirmar.")
+                return redirect("conteo_inventario")
+            diferencias = aplicar_conteo(
+                {int(i): Decimal(c) for i, c in pendiente.items()},
+                request=request,
+            )
+            messages.success(request, f"Conteo aplicado: {len(diferencias)} insumos ajustados.")
+            return redirect("movimientos_stock_list")
+
+        archivo = request.FILES.get("archivo")
+        if archivo:
+            conteos, errores = leer_conteo_csv(leer_archivo_texto(archivo))
+        else:
+            conteos, errores = conteos_del_formulario(request.POST)
+        if not conteos and not errores:
+            errores = ["No se cargó ninguna cantidad."]
+
+        diferencias = diferencias_conteo(conteos) if not errores else []
+        if conteos and not errores:
+            request.session["conteo_inventario"] = {str(i): str(c) for i, c in conteos.items()}
+        contexto.update({
+            "errores": errores,
+            "contados": len(conteos),
+            "diferencias": diferencias,
+            "vista_previa": not errores,
+        })
+    else:
+        contexto["insumos"] = Insumos.objects.filter(is_active=True).only(
+            "id_insumo", "nombre", "unidad_medida", "stock_actual"
+        ).order_by("nombre")
+
+    return render(request, "core/stock/conteo_inventario.html", contexto)
+
+
+@login_required
+def inventario_a_fecha(request):
+    """Stock de cada insumo al cierre del día pedido (snapshot más cercano + movimientos)."""
+    try:
+        fecha = date.fromisoformat(request.GET.get("fecha", ""))
+    except ValueError:
+        fecha = timezone.localdate()
+    momento = timezone.make_aware(datetime.combine(fecha, datetime.max.time()))
+
+    stock = stock_a_fecha(momento)
+    insumos = Insumos.objects.filter(id_insumo__in=stock.keys()).order_by("nombre")
+    filas = [(i, stock[i.id_insumo]) for i in insumos]
+
+    return render(request, "core/stock/inventario_a_fecha.html", {
+        "fecha": fecha,
+        "filas": filas,
+    })
+
+
+@login_required
+def reporte_valuacion_inventario(request):
+    """Inventario valorizado a costo promedio y costo de los consumos del período."""
+    insumos, total = valuacion_inventario()
+    desde = request.GET.get("desde", "")
+    hasta = request.GET.get("hasta", "")
+    consumos = list(consumo_valorizado(filtrar_rango_fechas(StockMovimientos.objects.all(), desde, hasta)))
+
+    return render(request, "core/stock/valuacion_inventario.html", {
+        "insumos": insumos,
+        "total": total,
+        "consumos": consumos,
+        "total_consumos": sum((c["costo_total"] or 0 for c in consumos), Decimal("0")),
+        "filtro_fecha_desde": desde,
+        "filtro_fecha_hasta": hasta,
     })
 
 
@@ -1672,11 +1955,15 @@ def generar_pdf_presupuesto(request, pk):
 
 @login_required
 @require_POST
+@transaction.atomic
 def presupuesto_confirmar(request, pk):
     presupuesto = get_object_or_404(Presupuestos, id_presupuesto=pk)
     if not presupuesto.id_cliente:
         messages.error(request, "Debes seleccionar un cliente antes de confirmar el presupuesto.")
         return redirect("presupuesto_edit", presupuesto.id_presupuesto)
+    if presupuesto.estado_presupuesto == "RECHAZADO" or Pedidos.objects.filter(presupuesto=presupuesto).exists():
+        messages.error(request, "El presupuesto está rechazado o ya generó un pedido.")
+        return redirect("presupuesto_detalle", presupuesto.id_presupuesto)
 
     trabajos_qs = presupuesto.trabajos.all()
     if not trabajos_qs.exists():
@@ -1687,23 +1974,30 @@ def presupuesto_confirmar(request, pk):
     presupuesto.total_presupuesto = total
     faltantes_alerta = []
 
-    for trabajo in trabajos_qs:
-        producto = getattr(trabajo, "producto", None)
-
-        if producto and producto.tipo and producto.tipo.nombre_tipo == "Tercerizado":
-            cantidad_total = trabajo.cantidad or 0
-            stock_previo = producto.stock_actual or 0
-            nuevo_stock = stock_previo - cantidad_total
-            producto.stock_actual = nuevo_stock
-            producto.save()
-
-            if nuevo_stock < 0:
-                faltantes_alerta.append(
-                    f"Faltan {abs(nuevo_stock)} unidades de '{producto.nombre}'."
-                )
+    # El stock de tercerizados se descuenta al generar el pedido; acá sólo se avisa si no alcanza.
+    requeridos = {}
+    for trabajo in trabajos_qs.select_related("producto__tipo"):
+        producto = trabajo.producto
+        if producto and producto.tipo and producto.tipo.nombre_tipo.lower() == "tercerizado":
+            requeridos.setdefault(producto.pk, [producto, 0])[1] += trabajo.cantidad or 0
+
+    for producto, cantidad_total in requeridos.values():
+        nuevo_stock = (producto.stock_actual or 0) - cantidad_total
+        if nuevo_stock < 0:
+            faltantes_alerta.append(
+                f"Faltan {abs(nuevo_stock)} unidades de '{producto.nombre}'."
+            )
 
     presupuesto.estado_presupuesto = "CONFIRMADO"
     presupuesto.save()
+    actualizar_costos_presupuesto(presupuesto)
+
+    for insumo, requerido, disponible in faltantes_de(
+        reservar_presupuesto(presupuesto), excluir_presupuesto=presupuesto
+    ):
+        faltantes_alerta.append(
+            f"'{insumo.nombre}': se reservan {requerido:.2f} y hay {disponible:.2f} disponibles."
+        )
 
     if faltantes_alerta:
         for alerta in faltantes_alerta:
@@ -1743,6 +2037,7 @@ def presupuesto_edit(request, presupuesto_id):
 
             presupuesto.total_presupuesto = total
             presupuesto.save()
+            actualizar_costos_presupuesto(presupuesto)
 
             messages.success(request, "Presupuesto actualizado exitosamente.")
             list(messages.get_messages(request))
@@ -1914,13 +2209,15 @@ def guardar_trabajo(request, pk):
     if request.method == "POST":
         nombre = request.POST.get("nombre_trabajo")
         cantidad = int(request.POST.get("cantidad_trabajo", 1))
-        subtotal = float(request.POST.get("subtotal_trabajo", 0))
+        subtotal = Decimal(request.POST.get("subtotal_trabajo") or "0")
         if not nombre:
             messages.error(request, "Debe ingresar un nombre para el trabajo.")
             return redirect("presupuesto_edit", pk)
-        presupuesto.subtotal += subtotal * cantidad
-        presupuesto.total_presupuesto = presupuesto.subtotal + float(presupuesto.costo_diseno or 0)
+        presupuesto.subtotal = (presupuesto.subtotal or Decimal(0)) + subtotal * cantidad
+        presupuesto.total_presupuesto = presupuesto.subtotal + (presupuesto.costo_diseno or Decimal(0))
         presupuesto.save()
+        actualizar_costos_presupuesto(presupuesto)
+        refrescar_reservas(presupuesto)
 
         messages.success(request, "Trabajo agregado ✅")
         list(messages.get_messages(request))
@@ -2018,14 +2315,19 @@ def agregar_trabajo(request, presupuesto_id):
     if not lista_insumos:
         return JsonResponse({"ok": False, "error": "Debe agregar al menos un insumo."})
 
+    insumos_activos = Insumos.objects.filter(is_active=True).in_bulk(
+        [item.get("id_insumo") for item in lista_insumos if item.get("id_insumo")]
+    )
+    # Se valida la lista completa en memoria: un solo in_bulk y una consulta de disponibles.
+    requerimiento = {}
+    lineas = []
     for item in lista_insumos:
         id_insumo = item.get("id_insumo")
         if not id_insumo:
             continue
 
-        try:
-            insumo = Insumos.objects.get(id_insumo=id_insumo, is_active=True)
-        except:
+        insumo = insumos_activos.get(int(id_insumo)) if str(id_insumo).isdigit() else None
+        if insumo is None:
             return JsonResponse({"ok": False, "error": "Insumo inválido o dado de baja."})
 
         try:
@@ -2035,66 +2337,91 @@ def agregar_trabajo(request, presupuesto_id):
         except:
             return JsonResponse({"ok": False, "error": "Cantidad inválida de insumo."})
 
-        factor = Decimal(insumo.factor_conversion or 1)
-        cantidad_real = cant / factor
-
-        if cantidad_real > Decimal(insumo.stock_actual or 0):
-            disp_real = float(insumo.stock_actual or 0)
-            disp_hojas = disp_real * float(factor)
-            return JsonResponse({
-                "ok": False,
-                "error": f"No hay stock suficiente de '{insumo.nombre}'. "
-                         f"Disponible: {disp_real:.2f} unidades "
-                         f"(≈ {disp_hojas:.0f} hojas)"
-            })
-
-    editar_id = request.POST.get("editar_trabajo_id")
-    if editar_id:
-        Trabajo.objects.filter(pk=editar_id, presupuesto=presupuesto).delete()
-
-    trabajo = Trabajo.objects.create(
-        presupuesto=presupuesto,
-        nombre_trabajo=nombre,
-        descripcion=descripcion,
-        cantidad=cantidad,
-        costo_diseno=costo_diseno,
-        margen_ganancia=margen,
-        subtotal_insumos=Decimal("0.00"),
-        precio_unitario=Decimal("0.00"),
-        total_trabajo=Decimal("0.00"),
-    )
-
-    subtotal_insumos = Decimal("0.00")
-
-    for item in lista_insumos:
-        insumo = Insumos.objects.get(id_insumo=item["id_insumo"])
-        cant = Decimal(str(item.get("cantidad") or "1"))
-        precio_unit = Decimal(str(item.get("costo_unitario") or "0"))
-        subtotal = precio_unit * cant
-
-        TrabajoInsumo.objects.create(
-            trabajo=trabajo,
-            insumo=insumo,
-            cantidad=cant,
-            precio_unitario=precio_unit,
-            subtotal=subtotal,
-        )
+        try:
+            precio_unit = Decimal(str(item.get("costo_unitario") or "0"))
+        except:
+            return JsonResponse({"ok": False, "error": "Costo unitario inválido de insumo."})
 
-        subtotal_insumos += subtotal
+        lineas.append((insumo, cant, precio_unit))
+        factor = Decimal(insumo.factor_conversion or 1)
+        requerimiento[insumo.id_insumo] = requerimiento.get(insumo.id_insumo, 0) + cant / factor
+
+    # Disponible = stock − reservado por otros presupuestos confirmados, en una sola consulta.
+    faltantes = faltantes_de(requerimiento, excluir_presupuesto=presupuesto)
+    if faltantes:
+        insumo, _, disponible = faltantes[0]
+        disp_real = float(disponible)
+        disp_hojas = disp_real * float(insumo.factor_conversion or 1)
+        return JsonResponse({
+            "ok": False,
+            "error": f"No hay stock suficiente de '{insumo.nombre}'. "
+                     f"Disponible: {disp_real:.2f} unidades "
+                     f"(≈ {disp_hojas:.0f} hojas)"
+        })
 
+    subtotal_insumos = sum((precio_unit * cant for _, cant, precio_unit in lineas), Decimal("0.00"))
     costo_bruto = subtotal_insumos + costo_diseno
     precio_unitario = costo_bruto * (Decimal("1.00") + (margen / Decimal("100")))
     total_trabajo = precio_unitario * cantidad
 
+    editar_id = request.POST.get("editar_trabajo_id")
+    trabajo = Trabajo.objects.filter(pk=editar_id, presupuesto=presupuesto).first() if editar_id else None
+    editando = trabajo is not None
+    if not editando:
+        trabajo = Trabajo(presupuesto=presupuesto)
+
+    trabajo.nombre_trabajo = nombre
+    trabajo.descripcion = descripcion
+    trabajo.cantidad = cantidad
+    trabajo.costo_diseno = costo_diseno
+    trabajo.margen_ganancia = margen
     trabajo.subtotal_insumos = subtotal_insumos
     trabajo.precio_unitario = precio_unitario
     trabajo.total_trabajo = total_trabajo
     trabajo.save()
 
+    # Al editar se emparejan las líneas existentes por insumo y sólo se escriben las que cambian.
+    existentes = {}
+    if editando:
+        for ti in trabajo.insumos.all():
+            existentes.setdefault(ti.insumo_id, []).append(ti)
+
+    centavos = Decimal("0.01")
+    nuevas = []
+    modificadas = []
+    for insumo, cant, precio_unit in lineas:
+        subtotal = precio_unit * cant
+        previas = existentes.get(insumo.id_insumo)
+        if not previas:
+            nuevas.append(TrabajoInsumo(
+                trabajo=trabajo,
+                insumo=insumo,
+                cantidad=cant,
+                precio_unitario=precio_unit,
+                subtotal=subtotal,
+            ))
+            continue
+
+        ti = previas.pop(0)
+        valores = (cant.quantize(centavos), precio_unit.quantize(centavos), subtotal.quantize(centavos))
+        if (ti.cantidad, ti.precio_unitario, ti.subtotal) != valores:
+            ti.cantidad, ti.precio_unitario, ti.subtotal = valores
+            modificadas.append(ti)
+
+    sobrantes = [ti.id for previas in existentes.values() for ti in previas]
+    if sobrantes:
+        TrabajoInsumo.objects.filter(id__in=sobrantes).delete()
+    if modificadas:
+        TrabajoInsumo.objects.bulk_update(modificadas, ["cantidad", "precio_unitario", "subtotal"])
+    if nuevas:
+        TrabajoInsumo.objects.bulk_create(nuevas)
+
     presupuesto.total_presupuesto = (
         presupuesto.trabajos.aggregate(s=Sum("total_trabajo"))["s"] or Decimal("0.00")
     )
     presupuesto.save()
+    actualizar_costos_presupuesto(presupuesto)
+    refrescar_reservas(presupuesto)
 
     tabla_html = render_to_string(
         "core/presupuestos/_tabla_trabajos.html",
@@ -2134,6 +2461,8 @@ def eliminar_trabajo(request, trabajo_id):
     )
     presupuesto.total_presupuesto = total_presupuesto
     presupuesto.save()
+    actualizar_costos_presupuesto(presupuesto)
+    refrescar_reservas(presupuesto)
 
     tabla_html = render_to_string(
         "core/presupuestos/_tabla_trabajos.html",
@@ -2191,6 +2520,7 @@ def duplicar_trabajo(request, trabajo_id):
     nuevo_trabajo = Trabajo.objects.create(
         presupuesto=presupuesto,
         nombre_trabajo=f"{trabajo.nombre_trabajo} (copia)",
+        producto_id=trabajo.producto_id,
         descripcion=trabajo.descripcion,
         cantidad=trabajo.cantidad,
         costo_diseno=trabajo.costo_diseno,
@@ -2215,6 +2545,8 @@ def duplicar_trabajo(request, trabajo_id):
     )
     presupuesto.total_presupuesto = total_presupuesto
     presupuesto.save()
+    actualizar_costos_presupuesto(presupuesto)
+    refrescar_reservas(presupuesto)
 
     tabla_html = render_to_string(
         "core/presupuestos/_tabla_trabajos.html",
@@ -2250,15 +2582,78 @@ def obtener_producto(request, producto_id):
 
 
 @login_required
+@require_POST
+@transaction.atomic
 def presupuesto_aprobar(request, id):
-    presupuesto = get_object_or_404(Presupuestos, id_presupuesto=id)
+    presupuesto = get_object_or_404(Presupuestos.objects.select_for_update(), id_presupuesto=id)
+    if presupuesto.estado_presupuesto == "RECHAZADO" or Pedidos.objects.filter(presupuesto=presupuesto).exists():
+        messages.error(request, "El presupuesto está rechazado o ya generó un pedido.")
+        return redirect("presupuesto_detalle", presupuesto.id_presupuesto)
 
     presupuesto.estado_presupuesto = "CONFIRMADO"
     presupuesto.save()
+    reservar_presupuesto(presupuesto)
+
+    return redirect("presupuesto_detalle", presupuesto.id_presupuesto)
+
 
+@login_required
+@require_POST
+@transaction.atomic
+def presupuesto_rechazar(request, id):
+    """
+    Rechaza un presupuesto en espera o confirmado que todavía no generó su
+    pedido y libera sus reservas.
+    """
+    presupuesto = get_object_or_404(Presupuestos.objects.select_for_update(), id_presupuesto=id)
+    if presupuesto.estado_presupuesto not in ("EN ESPERA", "CONFIRMADO") or \
+            Pedidos.objects.filter(presupuesto=presupuesto).exists():
+        messages.error(request, "Sólo se pueden rechazar presupuestos en espera o confirmados sin pedido.")
+        return redirect("presupuesto_detalle", presupuesto.id_presupuesto)
+
+    presupuesto.estado_presupuesto = "RECHAZADO"
+    presupuesto.save(update_fields=["estado_presupuesto"])
+    liberar_reservas(presupuesto)
+
+    messages.success(request, "Presupuesto rechazado. Se liberó el stock reservado.")
     return redirect("presupuesto_detalle", presupuesto.id_presupuesto)
 
 
+@login_required
+@permission_required('core.change_presupuestos', raise_exception=True)
+def repreciar_presupuestos_view(request):
+    """
+    Actualiza los presupuestos en espera al costo vigente de los insumos
+    elegidos (todos si no se elige ninguno). El primer POST muestra la
+    diferencia por presupuesto; "confirmar" la aplica.
+    """
+    contexto = {"insumos": Insumos.objects.filter(is_active=True).only("id_insumo", "nombre").order_by("nombre")}
+
+    if request.method == "POST":
+        if "confirmar" in request.POST:
+            if "repreciar_presupuestos" not in request.session:
+                messages.error(request, "No hay una actualización pendiente para confirmar.")
+                return redirect("repreciar_presupuestos")
+            insumo_ids = request.session.pop("repreciar_presupuestos")
+            resumen = repreciar_presupuestos(insumo_ids, aplicar=True)
+            messages.success(
+                request,
+                f"Se actualizaron {len(resumen['presupuestos'])} presupuestos "
+                f"(diferencia total ${resumen['delta']:.2f}).",
+            )
+            return redirect("presupuestos_list")
+
+        insumo_ids = [int(i) for i in request.POST.getlist("insumo") if i.isdigit()] or None
+        request.session["repreciar_presupuestos"] = insumo_ids
+        contexto.update({
+            "resumen": repreciar_presupuestos(insumo_ids),
+            "seleccionados": insumo_ids or [],
+            "vista_previa": True,
+        })
+
+    return render(request, "core/presupuestos/repreciar_presupuestos.html", contexto)
+
+
 
 from django.core.paginator import Paginator
 
@@ -2382,12 +2777,22 @@ def producto_edit(request, pk):
             producto.costo_inicial = Decimal(request.POST.get("costo_inicial", "0"))
             producto.margen_ganancia = Decimal(request.POST.get("margen_ganancia", "0"))
             producto.precio = Decimal(request.POST.get("precio", "0"))
-            producto.stock_actual = Decimal(request.POST.get("stock_actual", "0"))
+            stock_anterior = producto.stock_actual
+            stock_nuevo = Decimal(request.POST.get("stock_actual", "0"))
             producto.stock_minimo = Decimal(request.POST.get("stock_minimo", "0"))
 
             producto.costo_diseno = 0
             producto.save()
 
+            diferencia = stock_nuevo - stock_anterior
+            contabilizar_stock(
+                [], f"Ajuste manual de {producto.nombre}: {stock_anterior} → {stock_nuevo}",
+                request=request,
+                productos=[(
+                    producto, "entrada" if diferencia > 0 else "salida", abs(diferencia), "Ajuste manual",
+                )],
+            )
+
             ProductosInsumos.objects.filter(producto=producto).delete()
 
         messages.success(request, f"Producto '{producto.nombre}' actualizado correctamente.")
@@ -2442,7 +2847,7 @@ def producto_delete(request, id_producto):
 def agregar_producto_presupuesto(request, presupuesto_id):
 
     from decimal import Decimal
-    from core.models import Productos, ProductosInsumos, Trabajo, TrabajoInsumo
+    from core.models import Productos, Trabajo, TrabajoInsumo
 
     if not presupuesto_id or presupuesto_id == "0":
         nuevo = Presupuestos.objects.create(
@@ -2471,6 +2876,7 @@ def agregar_producto_presupuesto(request, presupuesto_id):
     trabajo = Trabajo.objects.create(
         presupuesto=presupuesto,
         nombre_trabajo=producto.nombre,
+        producto=producto,
         descripcion=producto.descripcion or "",
         cantidad=cantidad,
         costo_diseno=0,          
@@ -2479,42 +2885,40 @@ def agregar_producto_presupuesto(request, presupuesto_id):
 
     tipo_producto = producto.tipo.nombre_tipo.strip().lower()
 
-    subtotal_insumos = 0
-    subtotal_costo_real = 0
-    total_venta = float(producto.precio) * cantidad
+    subtotal_insumos = Decimal("0")
+    total_venta = Decimal(producto.precio) * cantidad
 
     if tipo_producto == "personalizado":
-        insumos_producto = ProductosInsumos.objects.filter(producto=producto)
-
-        for pi in insumos_producto:
-            cant_insumo = float(pi.cantidad)
-            precio_unit_insumo = float(pi.insumo.precio_costo_unitario) / float(pi.insumo.factor_conversion or 1)
-            subtotal = precio_unit_insumo * cant_insumo
-
+        # Receta por unidad en unidades de stock; cantidad y precio se guardan en unidad base.
+        receta = receta_de(producto.id_producto)
+        insumos = Insumos.objects.in_bulk(receta)
+        lineas = []
+        for insumo_id, cantidad_stock in receta.items():
+            insumo = insumos[insumo_id]
+            factor = Decimal(insumo.factor_conversion or 1)
+            costo = Decimal(insumo.precio_costo_unitario or 0)
+            subtotal = costo * cantidad_stock
             subtotal_insumos += subtotal
-            subtotal_costo_real += subtotal
-
-            TrabajoInsumo.objects.create(
+            lineas.append(TrabajoInsumo(
                 trabajo=trabajo,
-                insumo=pi.insumo,
-                cantidad=cant_insumo,
-                precio_unitario=precio_unit_insumo,
+                insumo=insumo,
+                cantidad=cantidad_stock * factor,
+                precio_unitario=costo / factor,
                 subtotal=subtotal,
-            )
-    else:
-        costo_real = float(producto.costo_inicial or 0)
-        subtotal_costo_real = costo_real * cantidad
-        subtotal_insumos = 0
+            ))
+        TrabajoInsumo.objects.bulk_create(lineas)
 
-    trabajo.subtotal_insumos = round(subtotal_insumos, 2)
-    trabajo.precio_unitario = round(float(producto.precio), 2)
-    trabajo.total_trabajo = round(total_venta, 2)
+    trabajo.subtotal_insumos = subtotal_insumos.quantize(Decimal("0.01"))
+    trabajo.precio_unitario = Decimal(producto.precio).quantize(Decimal("0.01"))
+    trabajo.total_trabajo = total_venta.quantize(Decimal("0.01"))
     trabajo.save()
 
     tot = presupuesto.trabajos.aggregate(s=Sum("total_trabajo"))["s"] or 0
     presupuesto.subtotal = tot
     presupuesto.total_presupuesto = tot
     presupuesto.save()
+    actualizar_costos_presupuesto(presupuesto)
+    refrescar_reservas(presupuesto)
 
     html = render_to_string(
         "core/presupuestos/_tabla_trabajos.html",
@@ -2607,46 +3011,131 @@ def api_grafico_ventas(request):
 
 
 
-@login_required
-def movimientos_list(request):
-    empleado = Empleados.objects.filter(user=request.user).first()
+MOVIMIENTOS_POR_PAGINA = 20
 
-    formas_pago = FormaPago.objects.filter(activo=True).order_by('nombre')
-    q = request.GET.get("q", "")
-    fecha_desde = request.GET.get("desde", "")
-    fecha_hasta = request.GET.get("hasta", "")
-    filtro_forma_pago = request.GET.get("forma_pago", "")
 
-    movimientos = MovimientosCaja.objects.all().order_by("-fecha_hora")
+def filtrar_rango_fechas(qs, fecha_desde, fecha_hasta, campo="fecha_hora"):
+    """Filtra [desde 00:00, hasta+1 00:00) sobre un DateTimeField; ignora fechas inválidas."""
+    try:
+        desde = date.fromisoformat(fecha_desde) if fecha_desde else None
+    except ValueError:
+        desde = None
+    try:
+        hasta = date.fromisoformat(fecha_hasta) if fecha_hasta else None
+    except ValueError:
+        hasta = None
 
-    if q:
-        movimientos = movimientos.filter(
-            Q(descripcion__icontains=q) |
-            Q(id__icontains=q)
-        )
+    if desde:
+        qs = qs.filter(**{
+            f"{campo}__gte": timezone.make_aware(datetime.combine(desde, datetime.min.time()))
+        })
+    if hasta:
+        qs = qs.filter(**{
+            f"{campo}__lt": timezone.make_aware(datetime.combine(hasta + timedelta(days=1), datetime.min.time()))
+        })
+    return qs
 
-    if fecha_desde:
-        movimientos = movimientos.filter(fecha_hora__date__gte=fecha_desde)
 
-    if fecha_hasta:
-        movimientos = movimientos.filter(fecha_hora__date__lte=fecha_hasta)
+def filtrar_movimientos_caja(params):
+    """
+    Aplica los filtros del listado de movimientos de caja de forma que usen índices:
+    un número busca por PK o referencia exacta y las fechas se convierten en
+    rangos semiabiertos sobre fecha_hora (sin envolver la columna en DATE()).
+    """
+    q = params.get("q", "").strip()
+    fecha_desde = params.get("desde", "")
+    fecha_hasta = params.get("hasta", "")
+    filtro_forma_pago = params.get("forma_pago", "")
 
-    if filtro_forma_pago:
-        movimientos = movimientos.filter(forma_pago_id=filtro_forma_pago)
+    movimientos = filtrar_rango_fechas(MovimientosCaja.objects.all(), fecha_desde, fecha_hasta)
 
-    # Paginación
-    paginator = Paginator(movimientos, 20)
-    page = request.GET.get("page")
-    movs = paginator.get_page(page)
+    if q:
+        if q.isdigit():
+            movimientos = movimientos.filter(Q(pk=int(q)) | Q(referencia_id=int(q)))
+        else:
+            movimientos = movimientos.filter(descripcion__icontains=q)
 
-    contexto = {
-        "movs": movs,
-        "formas_pago": formas_pago,        
+    if filtro_forma_pago.isdigit():
+        movimientos = movimientos.filter(forma_pago_id=filtro_forma_pago)
+
+    filtros = {
         "filtro_busqueda": q,
         "filtro_fecha_desde": fecha_desde,
         "filtro_fecha_hasta": fecha_hasta,
         "filtro_forma_pago": filtro_forma_pago,
     }
+    return movimientos, filtros
+
+
+def cursor_movimiento(mov):
+    return f"{mov.fecha_hora.isoformat()}|{mov.id}"
+
+
+def leer_cursor_movimiento(valor):
+    try:
+        fecha, pk = valor.rsplit("|", 1)
+        return datetime.fromisoformat(fecha), int(pk)
+    except (ValueError, AttributeError):
+        return None
+
+
+@login_required
+def movimientos_list(request):
+    formas_pago = FormaPago.objects.filter(activo=True).order_by('nombre')
+    movimientos, filtros = filtrar_movimientos_caja(request.GET)
+    movimientos = movimientos.select_related("forma_pago", "creado_por")
+
+    # Paginación por cursor sobre (fecha_hora, id): cada página cuesta lo mismo
+    # sin importar cuán atrás esté, y no hace falta COUNT(*).
+    despues = leer_cursor_movimiento(request.GET.get("despues"))
+    antes = leer_cursor_movimiento(request.GET.get("antes"))
+
+    if antes:
+        fecha, pk = antes
+        movs = list(
+            movimientos
+            .filter(Q(fecha_hora__gt=fecha) | Q(fecha_hora=fecha, id__gt=pk))
+            .order_by("fecha_hora", "id")[:MOVIMIENTOS_POR_PAGINA + 1]
+        )
+        hay_anterior = len(movs) > MOVIMIENTOS_POR_PAGINA
+        movs = movs[:MOVIMIENTOS_POR_PAGINA][::-1]
+        hay_siguiente = True
+    else:
+        if despues:
+            fecha, pk = despues
+            movimientos = movimientos.filter(Q(fecha_hora__lt=fecha) | Q(fecha_hora=fecha, id__lt=pk))
+        movs = list(movimientos.order_by("-fecha_hora", "-id")[:MOVIMIENTOS_POR_PAGINA + 1])
+        hay_siguiente = len(movs) > MOVIMIENTOS_POR_PAGINA
+        movs = movs[:MOVIMIENTOS_POR_PAGINA]
+        hay_anterior = despues is not None
+
+    base_qs = request.GET.copy()
+    for clave in ("despues", "antes", "page"):
+        base_qs.pop(clave, None)
+
+    siguiente_qs = anterior_qs = None
+    if movs and hay_siguiente:
+        qs = base_qs.copy()
+        qs["despues"] = cursor_movimiento(movs[-1])
+        siguiente_qs = qs.urlencode()
+    if movs and hay_anterior:
+        qs = base_qs.copy()
+        qs["antes"] = cursor_movimiento(movs[0])
+        anterior_qs = qs.urlencode()
+
+    caja_abierta = Cajas.objects.filter(caja_cerrada=False).order_by('-id_caja').first()
+
+    contexto = {
+        "movs": movs,
+        "export_qs": base_qs.urlencode(),
+        "siguiente_qs": siguiente_qs,
+        "anterior_qs": anterior_qs,
+        "caja_abierta": caja_abierta,
+        "resumen_forma_pago": caja_abierta.resumen_por_forma_pago() if caja_abierta else [],
+        "resumen_origen": caja_abierta.resumen_por_origen() if caja_abierta else [],
+        "formas_pago": formas_pago,
+        **filtros,
+    }
 
     return render(request, "core/caja/movimientos_list.html", contexto)
 
@@ -2838,48 +3327,15 @@ def pedido_cambiar_estado(request, id_pedido, nuevo_estado):
     if nuevo_estado == "ENTREGADO":
 
         if not pedido.stock_descontado:
-            detalles = pedido.detalles.all()
-            productos_pedido = PedidosProductos.objects.filter(id_pedido=pedido)
-
-            for det in detalles:
-                insumo = det.insumo
-                factor = Decimal(insumo.factor_conversion or 1)
-                cantidad_real = Decimal(det.cantidad) / factor
-                insumo.stock_actual -= cantidad_real
-                if insumo.stock_actual < 0:
-                    insumo.stock_actual = 0
-                insumo.save()
-                StockMovimientos.objects.create(
-                    insumo=insumo,
-                    tipo="salida",
-                    cantidad=cantidad_real,
-                    detalle=f"Salida por Pedido #{pedido.id_pedido}"
-                )
-
-            for item in productos_pedido:
-                producto = item.id_producto
-                if producto.tipo and producto.tipo.nombre_tipo.upper() == "TERCERIZADO":
-                    producto.stock_actual -= Decimal(item.cantidad)
-                    if producto.stock_actual < 0:
-                        producto.stock_actual = 0
-                    producto.save()
-
-            for item in productos_pedido:
-                producto = item.id_producto
-                if producto.tipo and producto.tipo.nombre_tipo.upper() == "PERSONALIZADO":
-                    receta = ProductosInsumos.objects.filter(producto=producto)
-                    for pi in receta:
-                        insumo = pi.insumo
-                        factor = Decimal(insumo.factor_conversion or 1)
-                        cantidad_real = (Decimal(pi.cantidad) * Decimal(item.cantidad)) / factor
-                        insumo.stock_actual -= cantidad_real
-                        insumo.save()
-                        StockMovimientos.objects.create(
-                            insumo=insumo,
-                            tipo="salida",
-                            cantidad=cantidad_real,
-                            detalle=f"Receta Personalizado (Pedido #{pedido.id_pedido})"
-                        )
+            productos_stock, lineas = consumo_de_pedidos([pedido.id_pedido])
+            contabilizar_stock(
+                [(insumo_id, "salida", cantidad, f"Salida por Pedido #{pedido.id_pedido}")
+                 for insumo_id, cantidad, _ in lineas],
+                f"Entrega de Pedido #{pedido.id_pedido}",
+                request=request,
+                productos=[(producto_id, "salida", cantidad, f"Salida por Pedido #{pedido.id_pedido}")
+                           for producto_id, cantidad, _ in productos_stock],
+            )
 
             pedido.stock_descontado = True
         if not movimiento_existente:
@@ -2890,18 +3346,17 @@ def pedido_cambiar_estado(request, id_pedido, nuevo_estado):
 
             monto = pedido.total_pedido or 0
             forma_pago = FormaPago.objects.filter(activo=True).first() or FormaPago.objects.first()
-            saldo_nuevo = caja.saldo_sistema + monto
-            mov = MovimientosCaja.objects.create(
-                caja=caja,
-                tipo=MovimientosCaja.Tipo.INGRESO,
-                forma_pago=forma_pago,
-                monto=monto,
-                descripcion=f"Cobro de Pedido #{pedido.id_pedido}",
+            contabilizar_movimiento(
+                caja,
+                MovimientosCaja.Tipo.INGRESO,
+                forma_pago,
+                monto,
+                empleado,
                 origen=MovimientosCaja.Origen.VENTA,
+                descripcion=f"Cobro de Pedido #{pedido.id_pedido}",
                 referencia_id=pedido.id_pedido,
-                creado_por=empleado,
-                saldo_resultante=saldo_nuevo,
-                revertido=False
+                usuario=request.user,
+                ip=request.META.get("REMOTE_ADDR"),
             )
 
         pedido.id_estado = estado
@@ -2920,36 +3375,13 @@ def pedido_cambiar_estado(request, id_pedido, nuevo_estado):
         except Cajas.DoesNotExist:
             return JsonResponse({"error": "No hay caja abierta"}, status=400)
 
-        saldo_nuevo = caja.saldo_sistema - movimiento_existente.monto
-        MovimientosCaja.objects.create(
-            caja=caja,
-            tipo=MovimientosCaja.Tipo.EGRESO,
-            forma_pago=movimiento_existente.forma_pago,
-            monto=movimiento_existente.monto,
-            descripcion=f"Reversión entrega Pedido #{pedido.id_pedido}",
-            origen=MovimientosCaja.Origen.VENTA,
-            referencia_id=pedido.id_pedido,
-            creado_por=empleado,
-            saldo_resultante=saldo_nuevo,
-            revertido=False
+        revertir_ventas(
+            [pedido],
+            caja,
+            empleado,
+            usuario=request.user,
+            ip=request.META.get("REMOTE_ADDR"),
         )
-
-        movimiento_existente.revertido = True
-        movimiento_existente.save()
-        if pedido.stock_descontado:
-            detalles = pedido.detalles.all()
-            productos_pedido = PedidosProductos.objects.filter(id_pedido=pedido)
-            for det in detalles:
-                insumo = det.insumo
-                factor = Decimal(insumo.factor_conversion or 1)
-                cantidad_real = Decimal(det.cantidad) / factor
-                insumo.stock_actual += cantidad_real
-                insumo.save()
-            for item in productos_pedido:
-                producto = item.id_producto
-                producto.stock_actual += Decimal(item.cantidad)
-                producto.save()
-            pedido.stock_descontado = False
     pedido.id_estado = estado
     pedido.save()
     return JsonResponse({
@@ -2959,6 +3391,51 @@ def pedido_cambiar_estado(request, id_pedido, nuevo_estado):
     })
 
 
+@login_required
+@permission_required('core.add_movimientoscaja', raise_exception=True)
+@require_POST
+@transaction.atomic
+def pedidos_revertir_entregas(request):
+    """Anula en bloque la entrega de varios pedidos entregados: revierte cobros y repone stock."""
+    ids = [int(i) for i in request.POST.getlist("pedidos") if i.isdigit()]
+    if not ids:
+        return JsonResponse({"error": "No se indicaron pedidos"}, status=400)
+
+    try:
+        estado = EstadosPedidos.objects.get(nombre_estado=request.POST.get("estado", "CANCELADO"))
+    except EstadosPedidos.DoesNotExist:
+        return JsonResponse({"error": "Estado inválido"}, status=400)
+
+    try:
+        caja = Cajas.objects.filter(caja_cerrada=False).latest("id_caja")
+    except Cajas.DoesNotExist:
+        return JsonResponse({"error": "No hay caja abierta"}, status=400)
+
+    empleado = Empleados.objects.filter(user=request.user).first()
+    if not empleado:
+        return JsonResponse({"error": "Empleado no encontrado"}, status=400)
+
+    pedidos = list(Pedidos.objects.select_for_update().filter(id_pedido__in=ids))
+    no_entregados = (
+        Pedidos.objects.filter(id_pedido__in=ids)
+        .exclude(id_estado__nombre_estado="ENTREGADO")
+        .order_by("id_pedido").values_list("id_pedido", flat=True)
+    )
+    if no_entregados:
+        detalle = ", ".join(f"#{i}" for i in no_entregados)
+        return JsonResponse({"error": f"Sólo se pueden revertir pedidos entregados: {detalle}"}, status=400)
+
+    reversiones = revertir_ventas(
+        pedidos, caja, empleado, estado=estado,
+        usuario=request.user, ip=request.META.get("REMOTE_ADDR"),
+    )
+    return JsonResponse({
+        "success": True,
+        "nuevo_estado": estado.nombre_estado,
+        "revertidos": len(reversiones),
+    })
+
+
 
 
 @login_required